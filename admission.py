@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+import re
+import time
+import threading
+
+ADMISSION_INITIAL_LIMIT = 20
+ADMISSION_MIN_LIMIT = 1
+ADMISSION_MAX_LIMIT = 500
+ADMISSION_TARGET_LATENCY = 0.2
+ADMISSION_TARGET_QUEUE_DELAY = 0.05
+ADMISSION_BACKOFF = 0.9
+ADMISSION_RETRY_AFTER = 1
+ADMISSION_EXEMPT_PATHS = ('metrics',)
+ADMIN_LOGIN = b'admin'
+# bytes of a body searched for the admin login, a login after a long arguments object is not seen
+ADMISSION_PEEK_SIZE = 512
+# JSON strings and brackets, enough to follow the nesting depth without parsing
+JSON_TOKEN_RE = re.compile(rb'"(?:[^"\\]|\\.)*"|[{}\[\]]')
+ADMIN_VALUE_RE = re.compile(rb'\s*:\s*"%s"' % ADMIN_LOGIN)
+
+
+class Overloaded(Exception):
+    """An admitted request waited in a queue longer than the target queue delay"""
+    pass
+
+
+class AdaptiveLimiter(object):
+    """
+    AIMD concurrency limit: every request finished within the target latency grows the limit
+    by 1/limit (about +1 per limit-worth of requests), a slower one or a request that waited
+    in the queue longer than the target delay shrinks it by ADMISSION_BACKOFF,
+    at most once per target latency window so one burst does not collapse the limit.
+    """
+
+    def __init__(self, initial_limit=ADMISSION_INITIAL_LIMIT, min_limit=ADMISSION_MIN_LIMIT,
+                 max_limit=ADMISSION_MAX_LIMIT, target_latency=ADMISSION_TARGET_LATENCY,
+                 target_queue_delay=ADMISSION_TARGET_QUEUE_DELAY):
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.target_latency = target_latency
+        self.target_queue_delay = target_queue_delay
+        self.inflight = 0
+        self.accepted = 0
+        self.rejected = 0
+        self.dropped = 0
+        self.decreased_at = 0.0
+        self.lock = threading.Lock()
+
+    def _decrease(self, now):
+        if now - self.decreased_at >= self.target_latency:
+            self.limit = max(self.min_limit, self.limit * ADMISSION_BACKOFF)
+            self.decreased_at = now
+
+    def try_acquire(self, queue_delay=0.0):
+        with self.lock:
+            if queue_delay > self.target_queue_delay:
+                self._decrease(time.monotonic())
+                self.rejected += 1
+                return False
+            if self.inflight >= int(self.limit):
+                self.rejected += 1
+                return False
+            self.inflight += 1
+            self.accepted += 1
+            return True
+
+    def check_queue_delay(self, queue_delay):
+        """
+        Reports how long an admitted request waited in a queue behind the limiter (the scheduler
+        one), False means it waited past the target queue delay and is to be shed
+        """
+        if queue_delay <= self.target_queue_delay:
+            return True
+        with self.lock:
+            self._decrease(time.monotonic())
+            self.dropped += 1
+        return False
+
+    def release(self, latency):
+        with self.lock:
+            self.inflight -= 1
+            if latency > self.target_latency:
+                self._decrease(time.monotonic())
+            else:
+                self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+
+    def stats(self):
+        return {
+            'limit': int(self.limit),
+            'inflight': self.inflight,
+            'accepted': self.accepted,
+            'rejected': self.rejected,
+            'dropped': self.dropped,
+        }
+
+
+def has_admin_login(body):
+    """
+    Whether the top-level object of a plain JSON body has "login": "admin" within its first
+    ADMISSION_PEEK_SIZE bytes. Strings and brackets are skipped to track the depth, so a login
+    inside arguments does not count, and nothing is decoded or parsed.
+    """
+    head = bytes(body[:ADMISSION_PEEK_SIZE])
+    depth = 0
+    for match in JSON_TOKEN_RE.finditer(head):
+        token = match.group()
+        if token in (b'{', b'['):
+            depth += 1
+        elif token in (b'}', b']'):
+            depth -= 1
+        elif depth == 1 and token == b'"login"' and ADMIN_VALUE_RE.match(head, match.end()):
+            return True
+    return False
+
+
+def is_exempt(path, body=None):
+    """
+    Cheap check made before the body is decoded: metrics and admin requests are never shed.
+    body is the raw body when it is plain JSON, None for compressed or MessagePack bodies
+    whose admin requests are admitted like any other.
+    """
+    return path in ADMISSION_EXEMPT_PATHS or (body is not None and has_admin_login(body))
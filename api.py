@@ -2,34 +2,66 @@
 # -*- coding: utf-8 -*-
 
 import abc
+import os
 import json
+import socket
+import stat
 import datetime
 import logging
 import hashlib
 import uuid
+import time
 from optparse import OptionParser
-from http.server import HTTPServer, BaseHTTPRequestHandler
+import socketserver
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
 from weakref import WeakKeyDictionary
 import scoring
+import models
 import re
 from collections import namedtuple
 from store import RedisStore
+from interests import InterestCodec, InterestCache, INTERESTS_INVALIDATION_CHANNEL
+from snapshot import SnapshotReloader
+from admission import AdaptiveLimiter, Overloaded, is_exempt, ADMISSION_RETRY_AFTER, ADMISSION_TARGET_LATENCY, \
+    ADMISSION_TARGET_QUEUE_DELAY
+from ratelimit import RateLimitSync, load_limits
+from scheduler import FairScheduler, estimate_cost
+from compression import CompressionError, choose_encoding, compress_stream, decompress_body, iter_chunks, \
+    COMPRESSION_LEVEL, COMPRESSION_MIN_SIZE
+import formats
+from deadline import Deadline, DeadlineExceeded, parse_timeout, REQUEST_TIMEOUT, TIMEOUT_HEADER
+from jobs import JobManager, JobsFull, FAILED, JOBS_CHUNK_SIZE, JOBS_TTL
+from idempotency import IdempotencyCache, IdempotencyConflict, request_key, request_digest, IDEMPOTENCY_TTL, \
+    IDEMPOTENCY_MAX_BYTES, IDEMPOTENCY_MAX_RESULT_SIZE
+from buffers import BufferPool, read_into
+from refresh import BackgroundRefresher, REFRESH_WORKERS
+from health import HealthCheck, HEALTH_CHECK_TTL, WARMUP_CONNECTIONS, WARMUP_REQUESTS
 
 SALT = "Otus"
 ADMIN_LOGIN = "admin"
 ADMIN_SALT = "42"
 OK = 200
+ACCEPTED = 202
+PARTIAL_CONTENT = 206
 BAD_REQUEST = 400
 FORBIDDEN = 403
 NOT_FOUND = 404
+UNSUPPORTED_MEDIA_TYPE = 415
 INVALID_REQUEST = 422
+TOO_MANY_REQUESTS = 429
 INTERNAL_ERROR = 500
+SERVICE_UNAVAILABLE = 503
+GATEWAY_TIMEOUT = 504
 ERRORS = {
     BAD_REQUEST: "Bad Request",
     FORBIDDEN: "Forbidden",
     NOT_FOUND: "Not Found",
+    UNSUPPORTED_MEDIA_TYPE: "Unsupported Media Type",
     INVALID_REQUEST: "Invalid Request",
+    TOO_MANY_REQUESTS: "Too Many Requests",
     INTERNAL_ERROR: "Internal Server Error",
+    SERVICE_UNAVAILABLE: "Service Unavailable",
+    GATEWAY_TIMEOUT: "Gateway Timeout",
 }
 UNKNOWN = 0
 MALE = 1
@@ -41,6 +73,17 @@ GENDERS = {
 }
 
 Response = namedtuple('Response', ['response', 'code'])
+# ratelimit.RateLimiter checked right after authentication
+rate_limiter = None
+# jobs.JobManager running clients_interests requests with "async": true
+job_manager = None
+# idempotency.IdempotencyCache replaying completed responses to retries with the same X-Request-ID
+idempotency_cache = None
+REQUEST_ID_HEADER = 'X-Request-ID'
+# connections the kernel queues for accept, the socketserver default of 5 drops SYNs under bursts
+LISTEN_BACKLOG = 128
+WARMUP_ACCOUNT = "warmup"
+OVERLOADED_RESPONSE = json.dumps({"error": ERRORS[SERVICE_UNAVAILABLE], "code": SERVICE_UNAVAILABLE}).encode('utf_8')
 
 
 class ValidationError(ValueError):
@@ -127,6 +170,12 @@ class GenderField(NumericField):
             raise ValidationError('gender must be 0, 1 or 2')
 
 
+class BooleanField(BaseField):
+    def validate(self, value):
+        if not isinstance(value, bool):
+            raise ValidationError('must be a boolean')
+
+
 class ListField(BaseField):
     def validate(self, value):
         if not isinstance(value, list):
@@ -199,6 +248,45 @@ class BaseRequest(object):
 class ClientsInterestsRequest(BaseRequest):
     client_ids = ClientIDsField(required=True)
     date = DateField(required=False, nullable=True)
+    date_to = DateField(required=False, nullable=True)
+    partial = BooleanField(required=False, nullable=True)
+    # "async" is a keyword, the field is put into the class namespace by name
+    locals()['async'] = BooleanField(required=False, nullable=True)
+
+    def validate(self):
+        super(ClientsInterestsRequest, self).validate()
+        if not self.date_to:
+            return
+        if not self.date:
+            raise ValidationError('Field date_to has error: date is required')
+        days = (self.get_date(self.date_to) - self.get_date(self.date)).days
+        if days < 0:
+            raise ValidationError('Field date_to has error: must not be before date')
+        if days >= scoring.INTERESTS_MAX_RANGE_DAYS:
+            raise ValidationError('Field date_to has error: at most %d days' % scoring.INTERESTS_MAX_RANGE_DAYS)
+
+    @staticmethod
+    def get_date(value):
+        return datetime.datetime.strptime(value, '%d.%m.%Y').date() if value else None
+
+
+class JobStatusRequest(BaseRequest):
+    job_id = CharField(required=True)
+
+
+class JobResultRequest(JobStatusRequest):
+    job_id = CharField(required=True)
+    page = NumericField(required=False, nullable=True)
+
+
+class InterestsSummaryRequest(BaseRequest):
+    client_ids = ClientIDsField(required=True)
+    top = NumericField(required=False, nullable=True)
+
+    def validate(self):
+        super(InterestsSummaryRequest, self).validate()
+        if self.top is not None and self.top < 0:
+            raise ValidationError('Field top has error: must be positive')
 
 
 class OnlineScoreRequest(BaseRequest):
@@ -231,11 +319,14 @@ class MethodRequest(BaseRequest):
         return self.login == ADMIN_LOGIN
 
 
+def get_token(account, login):
+    if login == ADMIN_LOGIN:
+        return hashlib.sha512((datetime.datetime.now().strftime("%Y%m%d%H") + ADMIN_SALT).encode('utf-8')).hexdigest()
+    return hashlib.sha512((account + login + SALT).encode('utf-8')).hexdigest()
+
+
 def check_auth(request):
-    if request.is_admin:
-        digest = hashlib.sha512((datetime.datetime.now().strftime("%Y%m%d%H") + ADMIN_SALT).encode('utf-8')).hexdigest()
-    else:
-        digest = hashlib.sha512((request.account + request.login + SALT).encode('utf-8')).hexdigest()
+    digest = get_token(request.account, request.login)
     if digest == request.token:
         return True
     return False
@@ -247,7 +338,95 @@ def clients_interest_handler(request, ctx, store):
 
     ctx['nclients'] = len(model.client_ids)
 
-    response = {x: scoring.get_interests(store, x) for x in model.client_ids}
+    deadline = ctx.get('deadline')
+    if getattr(model, 'async'):
+        return submit_interests_job(request, model, ctx, store)
+
+    if model.date and scoring.dated_interests:
+        dated = scoring.get_interests_dated(store, model.client_ids, model.get_date(model.date),
+                                            model.get_date(model.date_to), deadline=deadline, partial=model.partial)
+        if not model.partial:
+            return Response(dated, OK)
+        interests, errors = dated
+        ctx['nerrors'] = len(errors)
+        return Response({"interests": interests, "errors": errors}, PARTIAL_CONTENT if errors else OK)
+
+    if model.partial:
+        interests, errors = scoring.get_interests_partial(store, model.client_ids, deadline=deadline)
+        ctx['nerrors'] = len(errors)
+        return Response({"interests": interests, "errors": errors}, PARTIAL_CONTENT if errors else OK)
+
+    response = {x: scoring.get_interests(store, x, deadline=deadline) for x in model.client_ids}
+    return Response(response, OK)
+
+
+def submit_interests_job(request, model, ctx, store):
+    if job_manager is None:
+        return Response('Async jobs are disabled', INVALID_REQUEST)
+    date, date_to = model.get_date(model.date), model.get_date(model.date_to)
+    if date and scoring.dated_interests:
+        def fetch(cids):
+            return scoring.get_interests_dated(store, cids, date, date_to)
+    else:
+        def fetch(cids):
+            return scoring.get_interests_many(store, cids)
+    try:
+        job_id, state = job_manager.submit((request.account or '', request.login), model.client_ids, fetch)
+    except JobsFull as e:
+        logging.warning(e)
+        return Response(None, TOO_MANY_REQUESTS)
+    ctx['job_id'] = job_id
+    return Response({"job_id": job_id, "status": state['status'], "pages": state['pages']}, ACCEPTED)
+
+
+def job_status_handler(request, ctx, store):
+    model = JobStatusRequest(**request.arguments)
+    model.validate()
+
+    if job_manager is None:
+        return Response('Async jobs are disabled', INVALID_REQUEST)
+    state = job_manager.status(model.job_id, (request.account or '', request.login))
+    if state is None:
+        return Response('Unknown job %s' % model.job_id, NOT_FOUND)
+    state.pop('owner')
+    return Response(state, OK)
+
+
+def job_result_handler(request, ctx, store):
+    """
+    One page of a job result, 202 with the job state while the page is not fetched yet
+    and 500 with the job error when the job failed before fetching it
+    """
+    model = JobResultRequest(**request.arguments)
+    model.validate()
+
+    if job_manager is None:
+        return Response('Async jobs are disabled', INVALID_REQUEST)
+    state = job_manager.status(model.job_id, (request.account or '', request.login))
+    if state is None:
+        return Response('Unknown job %s' % model.job_id, NOT_FOUND)
+    page = model.page or 0
+    if not 0 <= page < state['pages']:
+        return Response('Page must be from 0 to %d' % (state['pages'] - 1), INVALID_REQUEST)
+    response = {"job_id": model.job_id, "status": state['status'], "page": page, "pages": state['pages']}
+    if page >= state['done']:
+        if state['status'] == FAILED:
+            return Response('Job %s failed: %s' % (model.job_id, state.get('error')), INTERNAL_ERROR)
+        return Response(response, ACCEPTED)
+    interests = job_manager.page(model.job_id, page)
+    if interests is None:
+        return Response('Page %d of job %s expired' % (page, model.job_id), NOT_FOUND)
+    response['interests'] = interests
+    return Response(response, OK)
+
+
+def interests_summary_handler(request, ctx, store):
+    model = InterestsSummaryRequest(**request.arguments)
+    model.validate()
+
+    ctx['nclients'] = len(model.client_ids)
+
+    response = scoring.get_interests_summary(store, model.client_ids, top=model.top, deadline=ctx.get('deadline'))
     return Response(response, OK)
 
 
@@ -266,7 +445,9 @@ def online_score_handler(request, ctx, store):
                                   birthday=model.birthday,
                                   gender=model.gender,
                                   first_name=model.first_name,
-                                  last_name=model.last_name)
+                                  last_name=model.last_name,
+                                  model=models.model_for_account(request.account),
+                                  deadline=ctx.get('deadline'))
         response, code = dict(score=score), OK
     return Response(response, code)
 
@@ -274,7 +455,10 @@ def online_score_handler(request, ctx, store):
 def get_handler(method):
     handlers = {
         'online_score': online_score_handler,
-        'clients_interests': clients_interest_handler
+        'clients_interests': clients_interest_handler,
+        'interests_summary': interests_summary_handler,
+        'job_status': job_status_handler,
+        'job_result': job_result_handler,
     }
     return handlers.get(method, None)
 
@@ -294,71 +478,429 @@ def method_handler(request, ctx, store):
     if not check_auth(method_request):
         return Response(response=None, code=FORBIDDEN)
 
+    if rate_limiter is not None and not rate_limiter.allow(method_request.account, method_request.login,
+                                                           method_request.method):
+        return Response(response=None, code=TOO_MANY_REQUESTS)
+
     handler = get_handler(method_request.method)
     if not handler:
         return Response(response='Unknown method %s' % str(method_request.method), code=INVALID_REQUEST)
 
+    key = None
+    if idempotency_cache is not None:
+        headers = request.get('headers') or {}
+        key = request_key(headers.get(REQUEST_ID_HEADER), method_request.account, method_request.login,
+                          method_request.method)
+
     try:
-        return handler(request=method_request, ctx=ctx, store=store)
+        if key is None:
+            return handler(request=method_request, ctx=ctx, store=store)
+        return idempotency_cache.run(key, lambda: handler(request=method_request, ctx=ctx, store=store),
+                                     digest=request_digest(method_request.arguments))
+    except IdempotencyConflict:
+        return Response(response='%s %s was already used with other arguments'
+                                 % (REQUEST_ID_HEADER, headers.get(REQUEST_ID_HEADER)), code=INVALID_REQUEST)
     except ValidationError as e:
         logging.exception(e)
         return Response(response=str(e), code=INVALID_REQUEST)
+    except DeadlineExceeded as e:
+        logging.warning(e)
+        return Response(response=None, code=GATEWAY_TIMEOUT)
+
+
+def warm_up_request(store, i):
+    """Synthetic online_score request number i going the whole method_handler path"""
+    login = "warmup%d" % i
+    request = {"account": WARMUP_ACCOUNT, "login": login, "method": "online_score",
+               "token": hashlib.sha512((WARMUP_ACCOUNT + login + SALT).encode('utf-8')).hexdigest(),
+               "arguments": {"phone": "7000000%04d" % i, "email": "warmup%d@example.com" % i}}
+    return method_handler({"body": request, "headers": {}}, {}, store)
 
 
 class MainHTTPHandler(BaseHTTPRequestHandler):
     router = {
         "method": method_handler
     }
-    store = RedisStore(socket_connect_timeout=30)
+    # the store is built and connected by the main block, nothing talks to redis at import time
+    store = None
+    # health.HealthCheck answering GET /health/ready, without it the instance is ready once serving
+    health = None
+    admission = None
+    scheduler = None
+    # name -> callable returning a dict, served by GET /metrics
+    metrics = {}
+    # responses shorter than compression_min_size bytes are sent as is
+    compression_min_size = COMPRESSION_MIN_SIZE
+    compression_level = COMPRESSION_LEVEL
+    # seconds a request may take when the client does not send X-Request-Timeout
+    request_timeout = REQUEST_TIMEOUT
+    # request bodies are read into pooled buffers instead of a new bytes object per request
+    buffers = BufferPool()
+
+    def setup(self):
+        accepted = getattr(self.server, 'accepted', {})
+        self.accepted_at = accepted.pop(self.request, None) or time.monotonic()
+        super(MainHTTPHandler, self).setup()
 
     def get_request_id(self, headers):
-        return headers.get('HTTP_X_REQUEST_ID', uuid.uuid4().hex)
+        return headers.get(REQUEST_ID_HEADER) or uuid.uuid4().hex
+
+    def route(self, path, request, context, limiter=None):
+        """
+        Runs the handler of path, through the scheduler when there is one. The time a request
+        admitted by limiter waited in the scheduler queue is reported to it and a request that
+        waited past the target queue delay raises Overloaded instead of running.
+        """
+        queued_at = time.monotonic()
+
+        def handle():
+            if limiter is not None and self.scheduler is not None \
+                    and not limiter.check_queue_delay(time.monotonic() - queued_at):
+                raise Overloaded()
+            # the request may have waited in the scheduler queue past its deadline
+            deadline = context.get("deadline")
+            if deadline is not None and deadline.expired():
+                return Response(None, GATEWAY_TIMEOUT)
+            return self.router[path]({"body": request, "headers": self.headers}, context, self.store)
+
+        if self.scheduler is None:
+            return handle()
+        account = request.get("account") if isinstance(request, dict) else None
+        return self.scheduler.run(account if isinstance(account, str) else "", estimate_cost(request), handle)
+
+    def plain_body(self, body):
+        """The raw body when it is JSON without a content coding, admission peeks only into those"""
+        if (self.headers.get('Content-Encoding') or 'identity').strip().lower() != 'identity':
+            return None
+        if formats.media_type(self.headers.get('Content-Type')) == formats.MSGPACK:
+            return None
+        return body
+
+    def send_overloaded(self):
+        self.send_response(SERVICE_UNAVAILABLE)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Retry-After", str(ADMISSION_RETRY_AFTER))
+        self.end_headers()
+        self.wfile.write(OVERLOADED_RESPONSE)
+
+    def send_body(self, code, r, fmt=formats.JSON):
+        """
+        Sends a response in fmt compressed with the best coding from Accept-Encoding when it is
+        long enough. The payload is compressed and written chunk by chunk, the client starts
+        receiving a large response before it is compressed whole.
+        """
+        payload = formats.encode(r, fmt)
+        encoding = None
+        if len(payload) >= self.compression_min_size:
+            encoding = choose_encoding(self.headers.get('Accept-Encoding'))
+        self.send_response(code)
+        self.send_header("Content-Type", fmt)
+        if encoding is not None:
+            self.send_header("Content-Encoding", encoding)
+            self.send_header("Vary", "Accept-Encoding")
+        self.end_headers()
+        if encoding is None:
+            self.wfile.write(payload)
+            return
+        for chunk in compress_stream(iter_chunks(payload), encoding, self.compression_level):
+            self.wfile.write(chunk)
+
+    def do_GET(self):
+        path = self.path.strip("/")
+        if path == "metrics":
+            response, code = {name: source() for name, source in self.metrics.items()}, OK
+        elif path == "health/live":
+            response, code = {"live": True}, OK
+        elif path == "health/ready":
+            ready, details = self.health.ready() if self.health is not None else (True, {})
+            response, code = dict(details, ready=ready), OK if ready else SERVICE_UNAVAILABLE
+        else:
+            response, code = None, NOT_FOUND
+        if code not in ERRORS:
+            r = {"response": response, "code": code}
+        else:
+            r = {"error": response or ERRORS.get(code, "Unknown Error"), "code": code}
+        self.send_body(code, r, formats.response_format(self.headers.get('Accept')))
 
     def do_POST(self):
         response, code = {}, OK
-        context = {"request_id": self.get_request_id(self.headers)}
+        context = {"request_id": self.get_request_id(self.headers),
+                   "deadline": Deadline(parse_timeout(self.headers.get(TIMEOUT_HEADER), self.request_timeout),
+                                        self.accepted_at)}
         request = None
+        limiter = None
+        fmt = formats.JSON
+        buffer = body = None
+        # from accept to a handler thread, the body upload is not queueing; the wait in the listen
+        # backlog is not observable and the scheduler queue is checked by route()
+        queue_delay = time.monotonic() - self.accepted_at
         try:
-            data_string = self.rfile.read(int(self.headers['Content-Length']))
-            request = json.loads(data_string)
+            length = int(self.headers['Content-Length'])
+            buffer = self.buffers.acquire(length)
+            body = read_into(self.rfile, buffer, length)
         except:
             code = BAD_REQUEST
+        started = time.monotonic()
 
-        if request:
+        try:
             path = self.path.strip("/")
-            logging.info("%s: %s %s" % (self.path, data_string, context["request_id"]))
-            if path in self.router:
-                try:
-                    response, code = self.router[path]({"body": request, "headers": self.headers}, context, self.store)
-                except Exception as e:
-                    logging.exception("Unexpected error: %s" % e)
-                    code = INTERNAL_ERROR
-            else:
-                code = NOT_FOUND
+            if body is not None and self.admission is not None and not is_exempt(path, self.plain_body(body)):
+                if not self.admission.try_acquire(queue_delay):
+                    return self.send_overloaded()
+                limiter = self.admission
+
+            try:
+                fmt = formats.request_format(self.headers.get('Content-Type'))
+                data = decompress_body(body, self.headers.get('Content-Encoding'))
+                request = formats.decode(data, fmt)
+            except (CompressionError, formats.FormatError) as e:
+                response, code = str(e), UNSUPPORTED_MEDIA_TYPE
+            except:
+                code = BAD_REQUEST
+
+            if request:
+                # the body is copied and formatted only when the line is going to be written
+                if logging.getLogger().isEnabledFor(logging.INFO):
+                    logging.info("%s: %s %s", self.path, bytes(data), context["request_id"])
+                if path in self.router:
+                    try:
+                        response, code = self.route(path, request, context, limiter)
+                    except Overloaded:
+                        return self.send_overloaded()
+                    except Exception as e:
+                        logging.exception("Unexpected error: %s" % e)
+                        code = INTERNAL_ERROR
+                else:
+                    code = NOT_FOUND
+        finally:
+            if limiter is not None:
+                limiter.release(time.monotonic() - started)
+            if body is not None:
+                body.release()
+            if buffer is not None:
+                self.buffers.release(buffer)
 
-        self.send_response(code)
-        self.send_header("Content-Type", "application/json")
-        self.end_headers()
         if code not in ERRORS:
             r = {"response": response, "code": code}
         else:
             r = {"error": response or ERRORS.get(code, "Unknown Error"), "code": code}
         context.update(r)
         logging.info(context)
-        self.wfile.write(json.dumps(r).encode('utf_8'))
+        self.send_body(code, r, formats.response_format(self.headers.get('Accept'), fmt))
         return
 
 
+class ScoringHTTPServer(ThreadingHTTPServer):
+    """
+    Serves every connection in its own thread and remembers when it was accepted.
+    With reuse_port several independent processes bind the same port (SO_REUSEPORT)
+    and the kernel spreads the incoming connections between them.
+    """
+    daemon_threads = True
+
+    def __init__(self, server_address, handler, bind_and_activate=True, backlog=LISTEN_BACKLOG,
+                 reuse_port=False):
+        self.accepted = {}
+        self.request_queue_size = backlog
+        self.reuse_port = reuse_port
+        super(ScoringHTTPServer, self).__init__(server_address, handler, bind_and_activate)
+
+    def server_bind(self):
+        if self.reuse_port:
+            if not hasattr(socket, 'SO_REUSEPORT'):
+                raise ValueError('SO_REUSEPORT is not supported on this platform')
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        super(ScoringHTTPServer, self).server_bind()
+
+    def process_request(self, request, client_address):
+        self.accepted[request] = time.monotonic()
+        super(ScoringHTTPServer, self).process_request(request, client_address)
+
+
+class UnixScoringHTTPServer(ScoringHTTPServer):
+    """ScoringHTTPServer on a Unix domain socket for a gateway on the same host, skips the TCP stack"""
+    address_family = socket.AF_UNIX
+
+    def server_bind(self):
+        # a socket file left by a previous process would fail the bind
+        if os.path.exists(self.server_address) and stat.S_ISSOCK(os.stat(self.server_address).st_mode):
+            os.unlink(self.server_address)
+        socketserver.TCPServer.server_bind(self)
+        self.server_name = 'localhost'
+        self.server_port = 0
+
+    def get_request(self):
+        request, _ = self.socket.accept()
+        # peers of a Unix socket have no address, BaseHTTPRequestHandler logs client_address[0]
+        return request, (self.server_address, 0)
+
+    def server_close(self):
+        super(UnixScoringHTTPServer, self).server_close()
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+
+
+def make_server(handler, host="localhost", port=8080, unix_socket=None, backlog=LISTEN_BACKLOG, reuse_port=False,
+                tcp_nodelay=False):
+    """Listens on the unix_socket path when given, on host:port otherwise"""
+    # StreamRequestHandler sets TCP_NODELAY on every accepted connection
+    handler.disable_nagle_algorithm = tcp_nodelay and not unix_socket
+    if unix_socket:
+        return UnixScoringHTTPServer(unix_socket, handler, backlog=backlog)
+    return ScoringHTTPServer((host, port), handler, backlog=backlog, reuse_port=reuse_port)
+
+
 if __name__ == "__main__":
     op = OptionParser()
     op.add_option("-p", "--port", action="store", type=int, default=8080)
+    op.add_option("--host", action="store", default="localhost")
+    op.add_option("--unix-socket", action="store", default=None,
+                  help="listen on a Unix domain socket at this path instead of host:port")
+    op.add_option("--reuse-port", action="store_true", default=False,
+                  help="set SO_REUSEPORT, several server processes share the port")
+    op.add_option("--tcp-nodelay", action="store_true", default=False,
+                  help="set TCP_NODELAY on accepted connections, responses are not held back by Nagle")
+    op.add_option("--backlog", action="store", type=int, default=LISTEN_BACKLOG,
+                  help="listen backlog of the server socket")
     op.add_option("-l", "--log", action="store", default=None)
+    op.add_option("--redis-nodes", action="store", default=None,
+                  help="comma separated host:port list, keys are sharded across the nodes; "
+                       "host:port+replica:port+... gives a node its replicas")
+    op.add_option("--redis-replicas", action="store", default=None,
+                  help="comma separated host:port list of replicas serving reads of a single node")
+    op.add_option("--redis-read-strategy", action="store", default="round_robin",
+                  choices=["round_robin", "least_latency"])
+    op.add_option("--interests-format", action="store", default="set", choices=["set", "bitmap"],
+                  help="bitmap stores clients interests as dictionary encoded ids")
+    op.add_option("--interests-versioned", action="store_true", default=False,
+                  help="read interests from the keyspace selected by loader.py --swap")
+    op.add_option("--interests-dated", action="store_true", default=False,
+                  help="serve requests with date/date_to from the day partitions i#{cid}#YYYYMMDD")
+    op.add_option("--interests-snapshot", action="store", default=None,
+                  help="snapshot file exported by snapshot.py, served before the store")
+    op.add_option("--interests-snapshot-max-age", action="store", type=int, default=24 * 60 * 60)
+    op.add_option("--models", action="store", default=None,
+                  help="JSON file with extra scoring models and the account -> model mapping")
+    op.add_option("--admission", action="store_true", default=False,
+                  help="shed load with an adaptive concurrency limit")
+    op.add_option("--admission-target-latency", action="store", type=float,
+                  default=ADMISSION_TARGET_LATENCY)
+    op.add_option("--admission-target-queue-delay", action="store", type=float,
+                  default=ADMISSION_TARGET_QUEUE_DELAY)
+    op.add_option("--rate-limits", action="store", default=None,
+                  help="JSON file with per account/login token bucket limits")
+    op.add_option("--rate-limits-sync", action="store_true", default=False,
+                  help="share rate limits consumption between instances through the store")
+    op.add_option("--scheduler-workers", action="store", type=int, default=0,
+                  help="run handlers on a pool of workers with weighted fair queueing across accounts")
+    op.add_option("--scheduler-weights", action="store", default=None,
+                  help="JSON file with account -> weight, default weight is 1")
+    op.add_option("--interests-cache-size", action="store", type=int, default=0,
+                  help="cache up to N clients interests in process, invalidated on writes of every instance")
+    op.add_option("--interests-cache-ttl", action="store", type=int, default=60)
+    op.add_option("--jobs-workers", action="store", type=int, default=0,
+                  help="run clients_interests with \"async\": true on N background workers")
+    op.add_option("--jobs-chunk-size", action="store", type=int, default=JOBS_CHUNK_SIZE)
+    op.add_option("--jobs-ttl", action="store", type=int, default=JOBS_TTL)
+    op.add_option("--score-refresh-workers", action="store", type=int, default=REFRESH_WORKERS,
+                  help="threads refreshing stale cached scores while they are served, 0 refreshes them inline")
+    op.add_option("--request-timeout", action="store", type=float, default=REQUEST_TIMEOUT,
+                  help="seconds a request may take when the client does not send X-Request-Timeout")
+    op.add_option("--idempotency-size", action="store", type=int, default=0,
+                  help="replay responses to retries with the same X-Request-ID, up to N remembered requests")
+    op.add_option("--idempotency-ttl", action="store", type=int, default=IDEMPOTENCY_TTL)
+    op.add_option("--idempotency-max-bytes", action="store", type=int, default=IDEMPOTENCY_MAX_BYTES,
+                  help="bytes of remembered responses, least recently used are forgotten first")
+    op.add_option("--idempotency-max-response-size", action="store", type=int, default=IDEMPOTENCY_MAX_RESULT_SIZE,
+                  help="larger responses are not remembered")
+    op.add_option("--compression-min-size", action="store", type=int, default=COMPRESSION_MIN_SIZE,
+                  help="compress responses of at least this many bytes when the client accepts it")
+    op.add_option("--compression-level", action="store", type=int, default=COMPRESSION_LEVEL)
+    op.add_option("--prewarm", action="store", default=None,
+                  help="request log or JSONL sample of online_score requests to fill the score cache from before ready")
+    op.add_option("--prewarm-rate", action="store", type=float, default=None,
+                  help="score cache keys written per second by --prewarm")
+    op.add_option("--health-check-ttl", action="store", type=float, default=HEALTH_CHECK_TTL,
+                  help="seconds GET /health/ready reuses the result of the store ping")
+    op.add_option("--warmup-requests", action="store", type=int, default=WARMUP_REQUESTS,
+                  help="synthetic online_score requests run before the instance reports ready")
+    op.add_option("--warmup-connections", action="store", type=int, default=WARMUP_CONNECTIONS,
+                  help="connections opened in the pool of every redis node before reporting ready")
     (opts, args) = op.parse_args()
+    if opts.redis_nodes and opts.redis_replicas:
+        op.error("--redis-replicas is for a single node, give sharded nodes their replicas as host:port+replica:port")
     logging.basicConfig(filename=opts.log, level=logging.INFO,
                         format='[%(asctime)s] %(levelname).1s %(message)s', datefmt='%Y.%m.%d %H:%M:%S')
+    MainHTTPHandler.store = RedisStore(
+        nodes=opts.redis_nodes.split(',') if opts.redis_nodes else None,
+        replicas=opts.redis_replicas.split(',') if opts.redis_replicas else None,
+        read_strategy=opts.redis_read_strategy,
+        invalidation_channel=INTERESTS_INVALIDATION_CHANNEL,
+        socket_connect_timeout=30
+    )
+    if opts.models:
+        models.load_config(opts.models)
     MainHTTPHandler.store.connect()
-    server = HTTPServer(("localhost", opts.port), MainHTTPHandler)
-    logging.info("Starting server at %s" % opts.port)
+    if opts.interests_format == "bitmap":
+        scoring.interest_codec = InterestCodec()
+        scoring.interest_codec.load(MainHTTPHandler.store)
+    scoring.versioned_interests = opts.interests_versioned
+    scoring.dated_interests = opts.interests_dated
+    if opts.interests_cache_size:
+        scoring.interest_cache = InterestCache(max_size=opts.interests_cache_size, ttl=opts.interests_cache_ttl)
+        scoring.interest_cache.attach(MainHTTPHandler.store)
+        MainHTTPHandler.metrics["interests_cache"] = scoring.interest_cache.stats
+    if opts.interests_snapshot:
+        reloader = SnapshotReloader(opts.interests_snapshot, max_age=opts.interests_snapshot_max_age)
+        reloader.reload()
+        reloader.start()
+    if opts.rate_limits:
+        rate_limiter = load_limits(opts.rate_limits)
+        if opts.rate_limits_sync:
+            RateLimitSync(rate_limiter, MainHTTPHandler.store).start()
+    if opts.admission:
+        MainHTTPHandler.admission = AdaptiveLimiter(target_latency=opts.admission_target_latency,
+                                                    target_queue_delay=opts.admission_target_queue_delay)
+        MainHTTPHandler.metrics["admission"] = MainHTTPHandler.admission.stats
+    if opts.scheduler_workers:
+        weights = None
+        if opts.scheduler_weights:
+            with open(opts.scheduler_weights) as f:
+                weights = json.load(f)
+        MainHTTPHandler.scheduler = FairScheduler(workers=opts.scheduler_workers, weights=weights)
+        MainHTTPHandler.metrics["scheduler"] = MainHTTPHandler.scheduler.stats
+    if opts.jobs_workers:
+        job_manager = JobManager(MainHTTPHandler.store, workers=opts.jobs_workers, chunk_size=opts.jobs_chunk_size,
+                                 ttl=opts.jobs_ttl)
+        MainHTTPHandler.metrics["jobs"] = job_manager.stats
+    if opts.score_refresh_workers:
+        scoring.score_refresher = BackgroundRefresher(workers=opts.score_refresh_workers)
+        MainHTTPHandler.metrics["score_refresh"] = scoring.score_refresher.stats
+    if opts.idempotency_size:
+        idempotency_cache = IdempotencyCache(max_size=opts.idempotency_size, ttl=opts.idempotency_ttl,
+                                             max_bytes=opts.idempotency_max_bytes,
+                                             max_result_size=opts.idempotency_max_response_size)
+        MainHTTPHandler.metrics["idempotency"] = idempotency_cache.stats
+    MainHTTPHandler.metrics["buffers"] = MainHTTPHandler.buffers.stats
+    MainHTTPHandler.request_timeout = opts.request_timeout
+    MainHTTPHandler.compression_min_size = opts.compression_min_size
+    MainHTTPHandler.compression_level = opts.compression_level
+    MainHTTPHandler.health = HealthCheck(MainHTTPHandler.store, ttl=opts.health_check_ttl)
+    server = make_server(MainHTTPHandler, host=opts.host, port=opts.port, unix_socket=opts.unix_socket,
+                         backlog=opts.backlog, reuse_port=opts.reuse_port, tcp_nodelay=opts.tcp_nodelay)
+    logging.info("Starting server at %s" % (opts.unix_socket or "%s:%s" % (opts.host, opts.port)))
+    prepare = None
+    if opts.prewarm:
+        # prewarm imports api, it is only needed by the main block
+        import prewarm
+
+        def prepare():
+            options = {"rate": opts.prewarm_rate} if opts.prewarm_rate is not None else {}
+            prewarm.prewarm_file(MainHTTPHandler.store, opts.prewarm, **options)
+    # live right away, ready once the pools are open, the score cache is warmed and the request path has run
+    MainHTTPHandler.health.start_warm_up(lambda i: warm_up_request(MainHTTPHandler.store, i),
+                                         requests=opts.warmup_requests, connections=opts.warmup_connections,
+                                         prepare=prepare)
     try:
         server.serve_forever()
     except KeyboardInterrupt:
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+CPU time versus bytes on the wire for clients_interests-like responses of different sizes:
+
+    python benchmarks/bench_compression.py --clients 10,100,1000,10000 --levels 1,6,9
+"""
+
+import os
+import sys
+import json
+import time
+import random
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from compression import COMPRESSORS, compress  # noqa: E402
+
+INTERESTS = ["cars", "pets", "travel", "hi-tech", "sport", "music", "books", "tv", "cinema", "geek", "otus"]
+
+
+def make_payload(clients, seed=0):
+    rnd = random.Random(seed)
+    response = {str(rnd.randrange(10 ** 6)): rnd.sample(INTERESTS, 2) for _ in range(clients)}
+    return json.dumps({"response": response, "code": 200}).encode('utf_8')
+
+
+def measure(payload, encoding, level, min_time):
+    runs, started = 0, time.perf_counter()
+    while True:
+        compressed = compress(payload, encoding, level)
+        runs += 1
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_time:
+            return len(compressed), elapsed / runs
+
+
+if __name__ == "__main__":
+    op = OptionParser()
+    op.add_option("--clients", action="store", default="10,100,1000,10000",
+                  help="comma separated numbers of client ids in a response")
+    op.add_option("--levels", action="store", default="1,6,9")
+    op.add_option("--min-time", action="store", type=float, default=0.2,
+                  help="seconds every combination is repeated for")
+    (opts, args) = op.parse_args()
+
+    print("%-8s %10s %-6s %5s %10s %7s %10s %10s" % (
+        "clients", "bytes", "codec", "level", "compressed", "ratio", "us/op", "MB/s"))
+    for clients in [int(value) for value in opts.clients.split(',')]:
+        payload = make_payload(clients)
+        for encoding in COMPRESSORS:
+            for level in [int(value) for value in opts.levels.split(',')]:
+                size, seconds = measure(payload, encoding, level, opts.min_time)
+                print("%-8d %10d %-6s %5d %10d %6.1f%% %10.1f %10.1f" % (
+                    clients, len(payload), encoding, level, size, 100.0 * size / len(payload),
+                    seconds * 1e6, len(payload) / seconds / 1e6))
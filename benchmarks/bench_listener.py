@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Request latency of the server over TCP loopback versus a Unix domain socket. The server
+runs in a separate process and answers admin online_score requests, which do not touch
+the store, so the difference is the transport:
+
+    python benchmarks/bench_listener.py --requests 2000 --tcp-nodelay
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import shutil
+import tempfile
+import http.client
+import multiprocessing
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import api  # noqa: E402
+from replay import percentile, PERCENTILES  # noqa: E402
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+
+    def __init__(self, socket_path, timeout=10):
+        super(UnixHTTPConnection, self).__init__('localhost', timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+def serve(ready, **kwargs):
+    # BaseHTTPRequestHandler writes an access log line per request to stderr
+    sys.stderr = open(os.devnull, 'w')
+    server = api.make_server(api.MainHTTPHandler, **kwargs)
+    ready.set()
+    server.serve_forever()
+
+
+def start_server(**kwargs):
+    ready = multiprocessing.Event()
+    process = multiprocessing.Process(target=serve, args=(ready,), kwargs=kwargs, daemon=True)
+    process.start()
+    ready.wait(10)
+    return process
+
+
+def measure(connect, requests):
+    """Latency of every request, a connection per request as the server speaks HTTP/1.0"""
+    body = json.dumps({"account": "horns&hoofs", "login": api.ADMIN_LOGIN, "method": "online_score",
+                       "token": api.get_token("horns&hoofs", api.ADMIN_LOGIN),
+                       "arguments": {"phone": "79175002040", "email": "stupnikov@otus.ru"}}).encode('utf-8')
+    latencies = []
+    for _ in range(requests):
+        started = time.perf_counter()
+        connection = connect()
+        connection.request('POST', '/method/', body=body, headers={'Content-Type': 'application/json'})
+        response = connection.getresponse()
+        response.read()
+        connection.close()
+        latencies.append(time.perf_counter() - started)
+    return latencies
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('localhost', 0))
+        return s.getsockname()[1]
+
+
+if __name__ == "__main__":
+    op = OptionParser()
+    op.add_option("--requests", action="store", type=int, default=2000)
+    op.add_option("--tcp-nodelay", action="store_true", default=False)
+    (opts, args) = op.parse_args()
+
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'api.sock')
+    port = free_port()
+    transports = [
+        ("tcp", dict(port=port, tcp_nodelay=opts.tcp_nodelay),
+         lambda: http.client.HTTPConnection('localhost', port, timeout=10)),
+        ("unix", dict(unix_socket=path), lambda: UnixHTTPConnection(path)),
+    ]
+    print("%-6s %10s" % ("", "mean ms") + "".join("%10s" % ("p%s ms" % p) for p in PERCENTILES))
+    try:
+        for name, options, connect in transports:
+            process = start_server(**options)
+            try:
+                # the first requests pay for imports and thread start up
+                measure(connect, min(100, opts.requests))
+                latencies = measure(connect, opts.requests)
+            finally:
+                process.terminate()
+                process.join()
+            print("%-6s %10.3f" % (name, sum(latencies) / len(latencies) * 1000)
+                  + "".join("%10.3f" % (percentile(latencies, p) * 1000) for p in PERCENTILES))
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
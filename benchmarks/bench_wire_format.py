@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Parse plus encode time and payload size of JSON versus MessagePack for /method requests
+and responses:
+
+    python benchmarks/bench_wire_format.py --clients 1,100,1000,10000
+"""
+
+import os
+import sys
+import time
+import random
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import formats  # noqa: E402
+
+INTERESTS = ["cars", "pets", "travel", "hi-tech", "sport", "music", "books", "tv", "cinema", "geek", "otus"]
+
+
+def online_score(_):
+    request = {"account": "horns&hoofs", "login": "h&f", "method": "online_score",
+               "token": "55cc9ce545bcd144300fe9efc28e65d415b923ebb6be1e19d2750a2c03e80dd2"
+                        "09a27dd45ee8b9e2e6d0fd41e9ef7e14b89c6b5bc0d9a2ae2d4a1a3c20b2e5d5",
+               "arguments": {"phone": "79175002040", "email": "stupnikov@otus.ru", "first_name": "Стансилав",
+                             "last_name": "Ступников", "birthday": "01.01.1990", "gender": 1}}
+    return request, {"response": {"score": 5.0}, "code": 200}
+
+
+def clients_interests(clients, seed=0):
+    rnd = random.Random(seed)
+    cids = [rnd.randrange(10 ** 6) for _ in range(clients)]
+    request = {"account": "horns&hoofs", "login": "h&f", "method": "clients_interests", "token": "",
+               "arguments": {"client_ids": cids, "date": "20.07.2017"}}
+    return request, {"response": {str(cid): rnd.sample(INTERESTS, 2) for cid in cids}, "code": 200}
+
+
+def measure(request, response, fmt, min_time):
+    """Seconds per request decode plus response encode, the work do_POST does"""
+    body = formats.encode(request, fmt)
+    runs, started = 0, time.perf_counter()
+    while True:
+        formats.decode(body, fmt)
+        payload = formats.encode(response, fmt)
+        runs += 1
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_time:
+            return len(body), len(payload), elapsed / runs
+
+
+if __name__ == "__main__":
+    op = OptionParser()
+    op.add_option("--clients", action="store", default="1,100,1000,10000",
+                  help="comma separated numbers of client_ids in a clients_interests request")
+    op.add_option("--min-time", action="store", type=float, default=0.2,
+                  help="seconds every combination is repeated for")
+    (opts, args) = op.parse_args()
+    if formats.msgpack is None:
+        print("msgpack is not installed, only JSON is measured")
+
+    cases = [("online_score", online_score(None))]
+    cases += [("interests/%d" % clients, clients_interests(clients))
+              for clients in [int(value) for value in opts.clients.split(',')]]
+    print("%-16s %-20s %10s %10s %10s" % ("request", "format", "request B", "response B", "us/op"))
+    for name, (request, response) in cases:
+        for fmt in formats.available():
+            request_size, response_size, seconds = measure(request, response, fmt, opts.min_time)
+            print("%-16s %-20s %10d %10d %10.1f" % (name, fmt, request_size, response_size, seconds * 1e6))
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+import threading
+
+BUFFER_INITIAL_SIZE = 16 * 1024
+# a buffer grown past this size serves its request and is dropped, one huge body does not pin memory
+BUFFER_MAX_SIZE = 1024 * 1024
+BUFFER_POOL_SIZE = 64
+
+
+class BufferPool(object):
+    """
+    Free list of bytearrays request bodies are read into. A request takes a buffer, reads its
+    body with readinto and gives the buffer back once the body is parsed, so in the steady state
+    reading a body allocates nothing. The server runs a thread per connection, a pool shared by
+    the threads is reused where per-thread buffers would die with their connection.
+    """
+
+    def __init__(self, max_buffers=BUFFER_POOL_SIZE, initial_size=BUFFER_INITIAL_SIZE, max_size=BUFFER_MAX_SIZE):
+        self.max_buffers = max_buffers
+        self.initial_size = initial_size
+        self.max_size = max_size
+        self.free = []
+        self.lock = threading.Lock()
+        self.created = 0
+        self.reused = 0
+
+    def acquire(self, size):
+        """A buffer of at least size bytes"""
+        with self.lock:
+            buffer = self.free.pop() if self.free else None
+            if buffer is not None and len(buffer) >= size:
+                self.reused += 1
+                return buffer
+            self.created += 1
+        # too small buffers are replaced by one at least twice as large, a growing body size settles fast
+        return bytearray(max(size, self.initial_size, 2 * len(buffer) if buffer is not None else 0))
+
+    def release(self, buffer):
+        if len(buffer) > self.max_size:
+            return
+        with self.lock:
+            if len(self.free) < self.max_buffers:
+                self.free.append(buffer)
+
+    def stats(self):
+        with self.lock:
+            return {'free': len(self.free), 'created': self.created, 'reused': self.reused}
+
+
+def read_into(rfile, buffer, length):
+    """
+    Reads exactly length bytes of rfile into the buffer and returns a memoryview of them.
+    The view must be released before the buffer is reused.
+    """
+    if length < 0:
+        raise ValueError('Negative length %d' % length)
+    view = memoryview(buffer)[:length]
+    read = 0
+    while read < length:
+        count = rfile.readinto(view[read:])
+        if not count:
+            view.release()
+            raise EOFError('Body ended after %d of %d bytes' % (read, length))
+        read += count
+    return view
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+COMPRESSION_MIN_SIZE = 1024
+COMPRESSION_LEVEL = 6
+COMPRESSION_CHUNK_SIZE = 64 * 1024
+# a gzip request body is never inflated beyond this, a few KB of zeros must not eat the memory
+MAX_DECOMPRESSED_SIZE = 16 * 1024 * 1024
+IDENTITY = 'identity'
+
+
+class CompressionError(Exception):
+    pass
+
+
+class GzipCompressor(object):
+    name = 'gzip'
+
+    def __init__(self, level=COMPRESSION_LEVEL):
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data):
+        return self.compressor.compress(data)
+
+    def flush(self):
+        return self.compressor.flush()
+
+
+class BrotliCompressor(object):
+    name = 'br'
+
+    def __init__(self, level=COMPRESSION_LEVEL):
+        # brotli qualities are 0-11, zlib levels 1-9 map onto them as is
+        self.compressor = brotli.Compressor(quality=min(level, 11))
+
+    def compress(self, data):
+        return self.compressor.process(data)
+
+    def flush(self):
+        return self.compressor.finish()
+
+
+class ZstdCompressor(object):
+    name = 'zstd'
+
+    def __init__(self, level=COMPRESSION_LEVEL):
+        self.compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data):
+        return self.compressor.compress(data)
+
+    def flush(self):
+        return self.compressor.flush()
+
+
+# server preference when the client weights several codings equally
+COMPRESSORS = [GzipCompressor]
+if zstandard is not None:
+    COMPRESSORS.insert(0, ZstdCompressor)
+if brotli is not None:
+    COMPRESSORS.insert(0, BrotliCompressor)
+COMPRESSORS = {compressor.name: compressor for compressor in COMPRESSORS}
+
+
+def parse_accept_encoding(header):
+    """'gzip;q=0.5, br' -> {'gzip': 0.5, 'br': 1.0}, malformed weights count as 0"""
+    codings = {}
+    for part in (header or '').split(','):
+        coding, _, params = part.partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        codings[coding] = q
+    return codings
+
+
+def choose_encoding(header):
+    """Best available coding the client accepts or None for an uncompressed response"""
+    codings = parse_accept_encoding(header)
+    default = codings.get('*', 0.0)
+    best, best_q = None, 0.0
+    for name in COMPRESSORS:
+        q = codings.get(name, default)
+        if q > best_q:
+            best, best_q = name, q
+    return best
+
+
+def get_compressor(encoding, level=COMPRESSION_LEVEL):
+    return COMPRESSORS[encoding](level)
+
+
+def compress_stream(chunks, encoding, level=COMPRESSION_LEVEL):
+    """Compresses an iterable of bytes chunk by chunk, yielding only non-empty pieces"""
+    compressor = get_compressor(encoding, level)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    data = compressor.flush()
+    if data:
+        yield data
+
+
+def iter_chunks(payload, size=COMPRESSION_CHUNK_SIZE):
+    view = memoryview(payload)
+    for start in range(0, len(view), size):
+        yield view[start:start + size]
+
+
+def compress(payload, encoding, level=COMPRESSION_LEVEL):
+    return b''.join(compress_stream(iter_chunks(payload), encoding, level))
+
+
+def decompress_body(data, encoding, max_size=MAX_DECOMPRESSED_SIZE):
+    """Decodes a request body sent with Content-Encoding, only gzip bodies are accepted"""
+    encoding = (encoding or IDENTITY).strip().lower()
+    if encoding == IDENTITY:
+        return data
+    if encoding not in ('gzip', 'x-gzip'):
+        raise CompressionError('Unsupported Content-Encoding %s' % encoding)
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    try:
+        body = decompressor.decompress(data, max_size)
+    except zlib.error as e:
+        raise CompressionError('Malformed gzip body: %s' % e)
+    if decompressor.unconsumed_tail:
+        raise CompressionError('Request body is larger than %d bytes' % max_size)
+    if not decompressor.eof:
+        raise CompressionError('Truncated gzip body')
+    return body
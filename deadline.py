@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+import time
+import threading
+from contextlib import contextmanager
+
+REQUEST_TIMEOUT = 10.0
+MAX_REQUEST_TIMEOUT = 60.0
+TIMEOUT_HEADER = 'X-Request-Timeout'
+
+_local = threading.local()
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class Deadline(object):
+    """Point in time.monotonic() after which nobody waits for the result of the request"""
+    __slots__ = ('expires',)
+
+    def __init__(self, timeout, started=None):
+        self.expires = (time.monotonic() if started is None else started) + timeout
+
+    def remaining(self):
+        return max(0.0, self.expires - time.monotonic())
+
+    def expired(self):
+        return time.monotonic() >= self.expires
+
+    def check(self):
+        if self.expired():
+            raise DeadlineExceeded('Request deadline exceeded')
+
+    def __repr__(self):
+        return 'Deadline(remaining=%.3f)' % self.remaining()
+
+
+def parse_timeout(value, default=REQUEST_TIMEOUT, maximum=MAX_REQUEST_TIMEOUT):
+    """Seconds from the X-Request-Timeout header, the default when it is missing or malformed"""
+    try:
+        timeout = float(value)
+    except (TypeError, ValueError):
+        return default
+    if timeout != timeout or timeout <= 0:
+        return default
+    return min(timeout, maximum)
+
+
+def current_deadline():
+    """Deadline bound to the running thread by bind_deadline() or None"""
+    return getattr(_local, 'deadline', None)
+
+
+@contextmanager
+def bind_deadline(deadline):
+    previous = current_deadline()
+    _local.deadline = deadline
+    try:
+        yield deadline
+    finally:
+        _local.deadline = previous
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+import json
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+JSON = 'application/json'
+MSGPACK = 'application/msgpack'
+# content types clients send for the same formats
+ALIASES = {
+    'application/json': JSON,
+    'text/json': JSON,
+    'application/msgpack': MSGPACK,
+    'application/x-msgpack': MSGPACK,
+    'application/vnd.msgpack': MSGPACK,
+}
+
+
+class FormatError(Exception):
+    pass
+
+
+def available():
+    return [JSON, MSGPACK] if msgpack is not None else [JSON]
+
+
+def media_type(header):
+    """'application/x-msgpack; charset=utf-8' -> MSGPACK, unknown types are returned as is"""
+    value = (header or '').split(';', 1)[0].strip().lower()
+    return ALIASES.get(value, value)
+
+
+def request_format(content_type):
+    """Format of a request body, JSON unless Content-Type asks for MessagePack"""
+    fmt = media_type(content_type)
+    if fmt != MSGPACK:
+        return JSON
+    if fmt not in available():
+        raise FormatError('Unsupported Content-Type %s' % content_type)
+    return fmt
+
+
+def response_format(accept, default=JSON):
+    """
+    First available format listed in Accept (weights are not ranked, clients list one format),
+    the request format when Accept names nothing we can produce
+    """
+    for part in (accept or '').split(','):
+        fmt = media_type(part)
+        if fmt in available():
+            return fmt
+    return default
+
+
+def str_keys(pairs):
+    """
+    object_pairs_hook of msgpack maps: requests are passed on as keyword arguments, so a map
+    with a key that is not a str is a bad request rather than a TypeError deep in the handler
+    """
+    result = {}
+    for key, value in pairs:
+        if not isinstance(key, str):
+            raise ValueError('Map keys must be strings, got %r' % (key,))
+        result[key] = value
+    return result
+
+
+def decode(data, fmt=JSON):
+    """Decodes bytes or a memoryview, msgpack reads the view in place"""
+    if fmt == MSGPACK:
+        return msgpack.unpackb(data, raw=False, object_pairs_hook=str_keys)
+    if isinstance(data, memoryview):
+        # json.loads does not take buffers, decoding the view to str skips an intermediate bytes copy
+        data = str(data, 'utf-8')
+    return json.loads(data)
+
+
+def encode(obj, fmt=JSON):
+    if fmt == MSGPACK:
+        return msgpack.packb(obj, use_bin_type=True)
+    return json.dumps(obj).encode('utf_8')
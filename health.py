@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+import time
+import logging
+import threading
+
+HEALTH_CHECK_TTL = 1.0
+WARMUP_CONNECTIONS = 8
+WARMUP_REQUESTS = 10
+
+
+class HealthCheck(object):
+    """
+    Readiness of an instance: it is ready once warmed up and while the store answers a ping.
+    The ping result is cached for ttl seconds, probes do not hit the store on every call,
+    and while one probe refreshes it the others get the previous result instead of waiting.
+    """
+
+    def __init__(self, store, ttl=HEALTH_CHECK_TTL):
+        self.store = store
+        self.ttl = ttl
+        self.warm = threading.Event()
+        self.lock = threading.Lock()
+        self.checked_at = None
+        self.healthy = False
+        self.error = None
+
+    def check(self):
+        """(healthy, error) of the store, pinged at most once per ttl"""
+        now = time.monotonic()
+        if self.checked_at is not None and now - self.checked_at < self.ttl:
+            return self.healthy, self.error
+        if not self.lock.acquire(blocking=False):
+            return self.healthy, self.error
+        try:
+            try:
+                self.store.ping()
+                self.healthy, self.error = True, None
+            except Exception as e:
+                self.healthy, self.error = False, str(e) or e.__class__.__name__
+            self.checked_at = time.monotonic()
+            return self.healthy, self.error
+        finally:
+            self.lock.release()
+
+    def ready(self):
+        """(ready, details) for GET /health/ready"""
+        warm = self.warm.is_set()
+        healthy, error = self.check()
+        details = {"warm": warm, "store": "ok" if healthy else error}
+        return warm and healthy, details
+
+    def warm_up(self, request, requests=WARMUP_REQUESTS, connections=WARMUP_CONNECTIONS, prepare=None):
+        """
+        Opens the store connections, calls prepare() when given and runs request(i) for i in
+        range(requests) before reporting ready. Warm-up is best effort: a failed step is logged
+        and the instance still gets ready, the store check decides whether it takes traffic.
+        """
+        started = time.monotonic()
+        try:
+            opened = self.store.open_connections(connections) if connections else 0
+            if prepare is not None:
+                prepare()
+            for i in range(requests):
+                request(i)
+            logging.info("Warmed up in %.3fs: %d connections, %d requests"
+                         % (time.monotonic() - started, opened, requests))
+        except Exception as e:
+            logging.exception("Warm-up failed: %s" % e)
+        finally:
+            self.warm.set()
+
+    def start_warm_up(self, request, requests=WARMUP_REQUESTS, connections=WARMUP_CONNECTIONS, prepare=None):
+        thread = threading.Thread(target=self.warm_up, args=(request, requests, connections, prepare),
+                                  name='warm-up', daemon=True)
+        thread.start()
+        return thread
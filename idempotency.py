@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+IDEMPOTENCY_MAX_SIZE = 10000
+IDEMPOTENCY_MAX_BYTES = 64 * 1024 * 1024
+# larger responses are not remembered, a few of them would take the whole byte budget
+IDEMPOTENCY_MAX_RESULT_SIZE = 64 * 1024
+IDEMPOTENCY_TTL = 60
+IDEMPOTENCY_WAIT_TIMEOUT = 30
+# longer client request ids are not cached, a key must not cost more than a few hundred bytes
+IDEMPOTENCY_MAX_KEY_LENGTH = 128
+
+
+class IdempotencyConflict(Exception):
+    """The key was already used by a request with other arguments"""
+    pass
+
+
+class Execution(object):
+    __slots__ = ('done', 'ok', 'result', 'expires', 'digest', 'size')
+
+    def __init__(self, digest=None):
+        self.done = threading.Event()
+        self.ok = False
+        self.result = None
+        self.expires = None
+        self.digest = digest
+        self.size = 0
+
+
+def result_size(result):
+    """Approximate memory held by a result: the length of its JSON, which is what gets sent back"""
+    return len(json.dumps(result, default=str))
+
+
+class IdempotencyCache(object):
+    """
+    Remembers results of completed requests by key for ttl seconds, at most max_size of them
+    taking at most max_bytes as measured by sizeof (least recently used are evicted first),
+    results over max_result_size are not remembered. A duplicate that arrives while the first
+    execution is still running waits for it instead of running in parallel. Failed executions
+    are not remembered: the waiting duplicates race to run again. A request reusing a key
+    with another digest of its arguments gets IdempotencyConflict instead of the result.
+    """
+
+    def __init__(self, max_size=IDEMPOTENCY_MAX_SIZE, ttl=IDEMPOTENCY_TTL, wait_timeout=IDEMPOTENCY_WAIT_TIMEOUT,
+                 max_bytes=IDEMPOTENCY_MAX_BYTES, max_result_size=IDEMPOTENCY_MAX_RESULT_SIZE, sizeof=result_size):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.wait_timeout = wait_timeout
+        self.max_bytes = max_bytes
+        self.max_result_size = max_result_size
+        self.sizeof = sizeof
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.waits = 0
+        self.conflicts = 0
+        self.oversized = 0
+
+    def _remove(self, key):
+        self.bytes -= self.entries.pop(key).size
+
+    def _evict(self):
+        while len(self.entries) > self.max_size or self.bytes > self.max_bytes:
+            self._remove(next(iter(self.entries)))
+
+    def _acquire(self, key, digest):
+        """Returns the execution for key and whether the caller has to run it"""
+        with self.lock:
+            execution = self.entries.get(key)
+            if execution is not None and execution.done.is_set() and execution.expires <= time.monotonic():
+                self._remove(key)
+                execution = None
+            if execution is not None:
+                if execution.digest != digest:
+                    self.conflicts += 1
+                    raise IdempotencyConflict(key)
+                self.entries.move_to_end(key)
+                return execution, False
+            execution = self.entries[key] = Execution(digest)
+            self._evict()
+            self.misses += 1
+            return execution, True
+
+    def run(self, key, func, digest=None):
+        while True:
+            execution, owner = self._acquire(key, digest)
+            if owner:
+                break
+            if not execution.done.is_set():
+                with self.lock:
+                    self.waits += 1
+                if not execution.done.wait(self.wait_timeout):
+                    return func()
+            if execution.ok:
+                with self.lock:
+                    self.hits += 1
+                return execution.result
+
+        try:
+            result = func()
+        except BaseException:
+            with self.lock:
+                if self.entries.get(key) is execution:
+                    self._remove(key)
+            execution.done.set()
+            raise
+        size = self.sizeof(result)
+        execution.result, execution.ok = result, True
+        execution.expires = time.monotonic() + self.ttl
+        with self.lock:
+            if self.entries.get(key) is execution:
+                if size > self.max_result_size:
+                    # the duplicates already waiting still get the result
+                    self._remove(key)
+                    self.oversized += 1
+                else:
+                    execution.size = size
+                    self.bytes += size
+                    self._evict()
+        execution.done.set()
+        return result
+
+    def stats(self):
+        with self.lock:
+            return {
+                'size': len(self.entries),
+                'bytes': self.bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'waits': self.waits,
+                'conflicts': self.conflicts,
+                'oversized': self.oversized,
+            }
+
+
+def request_key(request_id, account, login, method):
+    """Cache key of a client request id or None when the id can not be used"""
+    if not request_id or len(request_id) > IDEMPOTENCY_MAX_KEY_LENGTH:
+        return None
+    return account or '', login or '', method, request_id
+
+
+def request_digest(arguments):
+    """Digest of the request arguments stored with the key, a retry must send the same ones"""
+    return hashlib.sha256(json.dumps(arguments, sort_keys=True, default=str).encode('utf-8')).hexdigest()
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+import sys
+import time
+import threading
+from collections import OrderedDict
+
+INTERESTS_TABLE_KEY = 'idict'
+INTERESTS_INDEX_KEY = 'idict:ids'
+INTERESTS_COUNTER_KEY = 'idict:next'
+INTERESTS_INVALIDATION_CHANNEL = 'i#invalidate'
+
+INTEREST_CACHE_TTL = 60
+INTEREST_CACHE_NEGATIVE_TTL = 10
+INTEREST_CACHE_MAX_SIZE = 100000
+
+BYTE_BITS = tuple(tuple(bit for bit in range(8) if byte & (1 << bit)) for byte in range(256))
+
+
+class InterestCodec(object):
+    """
+    Compact interest storage: every distinct interest gets a small integer id, the shared
+    id -> name table lives in the INTERESTS_TABLE_KEY hash and a client's interests are stored
+    as a bitmap of ids. The table is cached in process and its names are interned,
+    so decoding a bitmap only builds a list of already existing str objects.
+    """
+
+    def __init__(self):
+        self.names = []
+        self.ids = {}
+        self.lock = threading.Lock()
+
+    def load(self, store):
+        table = store.get_hash(INTERESTS_TABLE_KEY)
+        names = []
+        for id_, name in table.items():
+            id_ = int(id_)
+            if id_ >= len(names):
+                names.extend([None] * (id_ + 1 - len(names)))
+            names[id_] = sys.intern(name.decode('utf-8'))
+        ids = {name: id_ for id_, name in enumerate(names) if name is not None}
+        with self.lock:
+            self.names, self.ids = names, ids
+
+    def intern(self, store, name):
+        id_ = self.ids.get(name)
+        if id_ is not None:
+            return id_
+        stored = store.get_hash_field(INTERESTS_INDEX_KEY, name)
+        if stored is None:
+            # the table entry is written before the index one, so readers never meet an unknown id
+            candidate = store.incr(INTERESTS_COUNTER_KEY) - 1
+            store.set_hash_field(INTERESTS_TABLE_KEY, candidate, name)
+            if store.set_hash_field(INTERESTS_INDEX_KEY, name, candidate, nx=True):
+                stored = candidate
+            else:
+                stored = store.get_hash_field(INTERESTS_INDEX_KEY, name)
+        id_ = int(stored)
+        with self.lock:
+            if id_ >= len(self.names):
+                self.names.extend([None] * (id_ + 1 - len(self.names)))
+            self.names[id_] = sys.intern(name)
+            self.ids[name] = id_
+        return id_
+
+    def encode(self, store, interests):
+        ids = [self.intern(store, name) for name in interests]
+        if not ids:
+            return b''
+        bitmap = bytearray(max(ids) // 8 + 1)
+        for id_ in ids:
+            bitmap[id_ >> 3] |= 1 << (id_ & 7)
+        return bytes(bitmap)
+
+    def lookup(self, bitmap, strict=True):
+        names = self.names
+        size = len(names)
+        result = []
+        for index, byte in enumerate(bitmap):
+            if byte:
+                base = index << 3
+                for bit in BYTE_BITS[byte]:
+                    id_ = base + bit
+                    name = names[id_] if id_ < size else None
+                    if name is None:
+                        if strict:
+                            return None
+                        continue
+                    result.append(name)
+        return result
+
+    def decode(self, store, bitmap):
+        if not bitmap:
+            return []
+        result = self.lookup(bitmap)
+        if result is None:
+            # an id assigned by another process since the table was loaded
+            self.load(store)
+            result = self.lookup(bitmap, strict=False)
+        return result
+
+
+class InterestCache(object):
+    """
+    In-process LRU cache of clients interests keyed by storage key, with a TTL and a shorter
+    one for clients without interests. Every invalidation bumps an epoch; a reader takes
+    the epoch before going to the store and put() drops its value when the key was
+    invalidated after that, so a read that raced with a write never repopulates stale data.
+    The invalidated keys are remembered in a bounded map, epochs of the evicted ones are folded
+    into a floor that conservatively rejects puts older than it.
+    """
+
+    def __init__(self, max_size=INTEREST_CACHE_MAX_SIZE, ttl=INTEREST_CACHE_TTL,
+                 negative_ttl=INTEREST_CACHE_NEGATIVE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.entries = OrderedDict()
+        self.invalidated = OrderedDict()
+        self.epoch = 0
+        self.floor = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """Returns (True, interests) on a hit and (False, epoch token for put) on a miss"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                expires, value = entry
+                if expires > time.monotonic():
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return True, value
+                del self.entries[key]
+            self.misses += 1
+            return False, self.epoch
+
+    def put(self, key, value, token):
+        with self.lock:
+            if token < self.floor or self.invalidated.get(key, -1) >= token:
+                return False
+            self.entries[key] = (time.monotonic() + (self.ttl if value else self.negative_ttl), value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+            return True
+
+    def invalidate(self, key):
+        self.invalidate_many([key])
+
+    def invalidate_many(self, keys):
+        """Drops the keys under one lock acquisition, a batch of the loader stalls readers once"""
+        keys = [key.decode('utf-8') if isinstance(key, bytes) else key for key in keys]
+        with self.lock:
+            for key in keys:
+                self.entries.pop(key, None)
+                self.invalidated[key] = self.epoch
+                self.invalidated.move_to_end(key)
+                self.epoch += 1
+            while len(self.invalidated) > self.max_size:
+                _, epoch = self.invalidated.popitem(last=False)
+                self.floor = max(self.floor, epoch + 1)
+
+    def stats(self):
+        return {'size': len(self.entries), 'hits': self.hits, 'misses': self.misses}
+
+    def attach(self, store, channel=INTERESTS_INVALIDATION_CHANNEL):
+        """
+        Invalidates on the writes of this process and, through the channel, on the writes of every
+        store created with invalidation_channel, the loader and the other instances included
+        """
+        store.write_listeners.append(self.invalidate_many)
+        if channel is not None:
+            store.subscribe(channel, lambda message: self.invalidate_many(message.split(b'\n')))
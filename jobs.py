@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+import json
+import time
+import uuid
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+JOBS_WORKERS = 2
+JOBS_CHUNK_SIZE = 1000
+JOBS_TTL = 60 * 60
+JOBS_MAX_PENDING = 100
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class JobError(Exception):
+    pass
+
+
+class JobsFull(JobError):
+    pass
+
+
+def job_key(job_id):
+    return 'job#%s' % job_id
+
+
+def page_key(job_id, page):
+    return 'job#%s#%d' % (job_id, page)
+
+
+class JobManager(object):
+    """
+    Runs bulk requests in the background: a job splits its items into pages of chunk_size,
+    fetches them one page after another on a small pool of workers and stores every page
+    and the job state in the store for ttl seconds, so any instance can serve them.
+    At most max_pending jobs are queued or running, the rest are refused.
+    """
+
+    def __init__(self, store, workers=JOBS_WORKERS, chunk_size=JOBS_CHUNK_SIZE, ttl=JOBS_TTL,
+                 max_pending=JOBS_MAX_PENDING):
+        self.store = store
+        self.chunk_size = chunk_size
+        self.ttl = ttl
+        self.max_pending = max_pending
+        self.pending = 0
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='job')
+
+    def save(self, job_id, state):
+        if not self.store.cache_set(job_key(job_id), json.dumps(state), self.ttl):
+            raise JobError('State of job %s was not saved' % job_id)
+
+    def submit(self, owner, items, fetch):
+        """
+        Queues fetch(page items) -> JSON-serializable page over items, returns the job id and
+        a copy of its initial state, the worker keeps updating its own
+        """
+        with self.lock:
+            if self.pending >= self.max_pending:
+                raise JobsFull('Too many jobs, %d are pending' % self.pending)
+            self.pending += 1
+        try:
+            job_id = uuid.uuid4().hex
+            state = {
+                'status': QUEUED,
+                'owner': list(owner),
+                'total': len(items),
+                'pages': (len(items) + self.chunk_size - 1) // self.chunk_size,
+                'done': 0,
+                'created': time.time(),
+            }
+            self.save(job_id, state)
+            self.executor.submit(self.run, job_id, dict(state), items, fetch)
+        except BaseException:
+            with self.lock:
+                self.pending -= 1
+            raise
+        return job_id, state
+
+    def run(self, job_id, state, items, fetch):
+        try:
+            state['status'] = RUNNING
+            self.save(job_id, state)
+            for page in range(state['pages']):
+                start = page * self.chunk_size
+                result = fetch(items[start:start + self.chunk_size])
+                if not self.store.cache_set(page_key(job_id, page), json.dumps(result), self.ttl):
+                    raise JobError('Page %d of job %s was not saved' % (page, job_id))
+                state['done'] = page + 1
+                self.save(job_id, state)
+            state['status'] = DONE
+            self.save(job_id, state)
+        except Exception as e:
+            logging.exception('Job %s failed: %s' % (job_id, e))
+            state['status'], state['error'] = FAILED, str(e)
+            try:
+                self.save(job_id, state)
+            except JobError as e:
+                logging.warning(e)
+        finally:
+            with self.lock:
+                self.pending -= 1
+
+    def status(self, job_id, owner):
+        """State of the job or None when it is unknown, expired or belongs to somebody else"""
+        value = self.store.cache_get(job_key(job_id))
+        if value is None:
+            return None
+        state = json.loads(value)
+        if state.get('owner') != list(owner):
+            return None
+        return state
+
+    def page(self, job_id, page):
+        value = self.store.cache_get(page_key(job_id, page))
+        return json.loads(value) if value is not None else None
+
+    def stats(self):
+        with self.lock:
+            return {'pending': self.pending, 'max_pending': self.max_pending}
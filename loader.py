@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import csv
+import json
+import time
+import datetime
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from optparse import OptionParser
+import scoring
+from store import RedisStore
+from interests import InterestCodec, INTERESTS_INVALIDATION_CHANNEL
+
+LOADER_BATCH_SIZE = 1000
+LOADER_REPORT_INTERVAL = 10
+
+
+def parse_row(line, fmt):
+    """
+    csv:   client_id,interest1,interest2,...
+    jsonl: {"client_id": 1, "interests": ["interest1", "interest2"]}
+    """
+    line = line.strip()
+    if not line:
+        return None
+    if fmt == 'jsonl':
+        record = json.loads(line)
+        return int(record['client_id']), list(record.get('interests') or [])
+    row = next(csv.reader([line]))
+    return int(row[0]), [v for v in row[1:] if v]
+
+
+def read_batches(path, fmt, offset=0, batch_size=LOADER_BATCH_SIZE):
+    """Yields ({cid: interests}, offset after the batch); only one batch is held in memory"""
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        batch = {}
+        for line in f:
+            offset += len(line)
+            row = parse_row(line.decode('utf-8'), fmt)
+            if row is None:
+                continue
+            cid, interests = row
+            batch.setdefault(cid, []).extend(interests)
+            if len(batch) >= batch_size:
+                yield batch, offset
+                batch = {}
+        if batch:
+            yield batch, offset
+
+
+class Checkpoint(object):
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return {}
+        with open(self.path) as f:
+            return json.load(f)
+
+    def save(self, state):
+        if not self.path:
+            return
+        tmp = '%s.tmp' % self.path
+        with open(tmp, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp, self.path)
+
+    def clear(self):
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class BulkLoader(object):
+    """
+    Streams (client_id, interests) rows into the store through pipelined batches written
+    by a pool of workers. At most workers * 2 batches are in flight, the checkpoint records
+    the file offset below which every batch is written, so a failed load resumes from there.
+    With swap the rows go into a fresh keyspace and the namespace pointer is switched only
+    after the whole file is loaded. With date the rows go into the day partitions of that date.
+    """
+
+    def __init__(self, store, path, fmt='csv', workers=4, batch_size=LOADER_BATCH_SIZE,
+                 swap=False, checkpoint=None, date=None):
+        self.store = store
+        self.path = path
+        self.fmt = fmt
+        self.workers = workers
+        self.batch_size = batch_size
+        self.swap = swap
+        self.checkpoint = Checkpoint(checkpoint)
+        self.date = date
+        self.rows = 0
+
+    def write(self, batch, namespace):
+        scoring.set_interests_many(self.store, batch, namespace, self.date)
+        return len(batch)
+
+    def run(self, resume=False):
+        state = self.checkpoint.load() if resume else {}
+        if state and state.get('source') != os.path.abspath(self.path):
+            raise ValueError('Checkpoint %s belongs to %s' % (self.checkpoint.path, state.get('source')))
+        offset = state.get('offset', 0)
+        self.rows = state.get('rows', 0)
+        namespace = state.get('namespace')
+        if namespace is None:
+            namespace = 'v%d:' % time.time() if self.swap else scoring.read_interests_namespace(self.store)
+        state = {'source': os.path.abspath(self.path), 'offset': offset, 'rows': self.rows, 'namespace': namespace}
+
+        started, reported, loaded = time.time(), time.time(), 0
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for batch, end in read_batches(self.path, self.fmt, offset, self.batch_size):
+                pending.append((executor.submit(self.write, batch, namespace), end))
+                while pending and (len(pending) >= self.workers * 2 or pending[0][0].done()):
+                    future, end = pending.popleft()
+                    loaded += future.result()
+                    state.update(offset=end, rows=self.rows + loaded)
+                    self.checkpoint.save(state)
+                if time.time() - reported >= LOADER_REPORT_INTERVAL:
+                    reported = time.time()
+                    logging.info('Loaded %d rows, %.0f rows/s' % (loaded, loaded / (reported - started)))
+            while pending:
+                future, end = pending.popleft()
+                loaded += future.result()
+                state.update(offset=end, rows=self.rows + loaded)
+                self.checkpoint.save(state)
+
+        self.rows += loaded
+        if self.swap:
+            previous = scoring.read_interests_namespace(self.store)
+            self.store.set_value(scoring.INTERESTS_NAMESPACE_KEY, namespace)
+            logging.info('Switched interests namespace from "%s" to "%s"' % (previous, namespace))
+        self.checkpoint.clear()
+        elapsed = time.time() - started
+        logging.info('Loaded %d rows in %.1fs, %.0f rows/s' % (loaded, elapsed, loaded / elapsed if elapsed else 0))
+        return namespace
+
+
+if __name__ == "__main__":
+    op = OptionParser(usage="%prog [options] FILE")
+    op.add_option("-f", "--format", action="store", default="csv", choices=["csv", "jsonl"])
+    op.add_option("-w", "--workers", action="store", type=int, default=4)
+    op.add_option("-b", "--batch-size", action="store", type=int, default=LOADER_BATCH_SIZE)
+    op.add_option("--swap", action="store_true", default=False,
+                  help="load into a new keyspace and switch readers to it when done")
+    op.add_option("--drop-previous", action="store_true", default=False,
+                  help="delete the previous keyspace after the swap")
+    op.add_option("--checkpoint", action="store", default=None)
+    op.add_option("--resume", action="store_true", default=False)
+    op.add_option("--redis-nodes", action="store", default=None)
+    op.add_option("--interests-format", action="store", default="set", choices=["set", "bitmap"])
+    op.add_option("--date", action="store", default=None,
+                  help="DD.MM.YYYY, load into the day partitions of the date")
+    (opts, args) = op.parse_args()
+    if len(args) != 1:
+        op.error("input file is required")
+    date = datetime.datetime.strptime(opts.date, '%d.%m.%Y').date() if opts.date else None
+    logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(levelname).1s %(message)s',
+                        datefmt='%Y.%m.%d %H:%M:%S')
+    # a swap loads into a fresh keyspace nobody has cached, in place writes invalidate the instances caches
+    store = RedisStore(nodes=opts.redis_nodes.split(',') if opts.redis_nodes else None, socket_connect_timeout=30,
+                       invalidation_channel=None if opts.swap else INTERESTS_INVALIDATION_CHANNEL)
+    store.connect()
+    if opts.interests_format == "bitmap":
+        scoring.interest_codec = InterestCodec()
+        scoring.interest_codec.load(store)
+    previous = scoring.read_interests_namespace(store)
+    loader = BulkLoader(store, args[0], fmt=opts.format, workers=opts.workers, batch_size=opts.batch_size,
+                        swap=opts.swap, checkpoint=opts.checkpoint, date=date)
+    namespace = loader.run(resume=opts.resume)
+    # the unversioned keyspace shares its prefix with the namespace pointer, it is never dropped
+    if opts.swap and opts.drop_previous and previous and previous != namespace:
+        # let readers drop the cached pointer to the previous keyspace first
+        time.sleep(scoring.INTERESTS_NAMESPACE_TTL)
+        logging.info('Deleted %d keys of "%s"' % (
+            store.delete_matching('%s%s' % (previous, scoring.interests_key('*'))), previous))
+    store.close()
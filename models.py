@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+import json
+
+# imported by the first score_batch call, importing NumPy takes tens of milliseconds
+# that every process importing api would pay; None when it is not installed
+numpy = None
+numpy_imported = False
+
+FEATURES = ('phone', 'email', 'birthday', 'gender', 'first_name', 'last_name')
+DEFAULT_MODEL = 'default'
+
+MODELS = {}
+# account -> model name, accounts without an entry are scored with DEFAULT_MODEL
+ACCOUNT_MODELS = {}
+
+
+class ScoringModel(object):
+    """
+    A score is the sum of the weights of the feature groups that are present: a group counts
+    when every field in it is set (truthy). Weights are added in declaration order, so
+    the scalar and the batch evaluation produce the same floats.
+    Cacheable models go through the store cache, the others are cheaper to recompute.
+    A cached score is fresh for cache_ttl seconds and served stale while it is refreshed
+    for cache_grace seconds more.
+    """
+
+    def __init__(self, name, weights, cacheable=True, cache_ttl=60, cache_grace=30):
+        self.name = name
+        self.weights = [(tuple(fields), weight) for fields, weight in weights]
+        for fields, _ in self.weights:
+            unknown = set(fields) - set(FEATURES)
+            if unknown:
+                raise ValueError('Unknown features %s' % ', '.join(sorted(unknown)))
+        self.cacheable = cacheable
+        self.cache_ttl = cache_ttl
+        self.cache_grace = cache_grace
+
+    @property
+    def features(self):
+        return sorted({field for fields, _ in self.weights for field in fields}, key=FEATURES.index)
+
+    def score(self, **values):
+        score = 0
+        for fields, weight in self.weights:
+            if all(values.get(field) for field in fields):
+                score += weight
+        return score
+
+    def score_batch(self, rows):
+        """
+        Scores a sequence of dicts with the FEATURES keys at once. Uses NumPy column masks when
+        it is installed and falls back to score() for every row otherwise.
+        """
+        numpy = import_numpy()
+        if numpy is None:
+            return [self.score(**row) for row in rows]
+        present = {field: numpy.fromiter((bool(row.get(field)) for row in rows), dtype=bool, count=len(rows))
+                   for field in self.features}
+        scores = numpy.zeros(len(rows))
+        for fields, weight in self.weights:
+            mask = numpy.ones(len(rows), dtype=bool)
+            for field in fields:
+                mask &= present[field]
+            scores += numpy.where(mask, weight, 0.0)
+        return scores.tolist()
+
+
+def import_numpy():
+    global numpy, numpy_imported
+    if not numpy_imported:
+        try:
+            import numpy as module
+            numpy = module
+        except ImportError:
+            pass
+        numpy_imported = True
+    return numpy
+
+
+def register_model(model):
+    MODELS[model.name] = model
+    return model
+
+
+def get_model(name=None):
+    return MODELS[name or DEFAULT_MODEL]
+
+
+def model_for_account(account):
+    return get_model(ACCOUNT_MODELS.get(account))
+
+
+def load_config(path):
+    """
+    {"models": [{"name": "fast", "weights": [[["phone"], 1.5], [["email"], 1.5]], "cacheable": false}],
+     "accounts": {"horns&hoofs": "fast"}}
+    """
+    with open(path) as f:
+        config = json.load(f)
+    for model in config.get('models', []):
+        register_model(ScoringModel(**model))
+    for account, name in config.get('accounts', {}).items():
+        if name not in MODELS:
+            raise ValueError('Unknown model %s for account %s' % (name, account))
+        ACCOUNT_MODELS[account] = name
+
+
+register_model(ScoringModel(DEFAULT_MODEL, [
+    (('phone',), 1.5),
+    (('email',), 1.5),
+    (('birthday', 'gender'), 1.5),
+    (('first_name', 'last_name'), 0.5),
+]))
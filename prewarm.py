@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import time
+import logging
+from collections import Counter
+from optparse import OptionParser
+import models
+import scoring
+from api import OnlineScoreRequest, ValidationError, ADMIN_LOGIN
+from replay import parse_line
+from store import RedisStore
+
+PREWARM_BATCH_SIZE = 500
+# score cache keys written per second
+PREWARM_RATE = 5000
+
+
+def parse_sample(line):
+    """
+    (account, arguments) of an online_score request or None. Accepts the lines replay.py reads
+    (request bodies or MainHTTPHandler.do_POST logging) and bare arguments objects.
+    """
+    parsed = parse_line(line)
+    if parsed is None:
+        return None
+    _, body = parsed
+    if 'arguments' not in body:
+        return None, body
+    if body.get('method', 'online_score') != 'online_score' or body.get('login') == ADMIN_LOGIN:
+        return None
+    if not isinstance(body['arguments'], dict):
+        return None
+    account = body.get('account')
+    return account if isinstance(account, str) else None, body['arguments']
+
+
+def score_entry(account, arguments):
+    """(cache key, model, feature values) get_score would use for the request, None if it is not cached"""
+    request = OnlineScoreRequest(**arguments)
+    try:
+        request.validate()
+    except ValidationError:
+        return None
+    model = models.model_for_account(account)
+    if not model.cacheable:
+        return None
+    values = {name: getattr(request, name) for name in models.FEATURES}
+    return scoring.get_score_key(model=model, **values), model, values
+
+
+class Prewarmer(object):
+    """
+    Fills the score cache with the keys of sampled online_score requests, hottest keys first.
+    Keys that are still cached are skipped, the rest are scored in process with score_batch
+    and written by pipelined cache_set_many batches at no more than rate keys per second.
+    With limit only the limit hottest keys are warmed.
+    """
+
+    def __init__(self, store, batch_size=PREWARM_BATCH_SIZE, rate=PREWARM_RATE, limit=None):
+        self.store = store
+        self.batch_size = batch_size
+        self.rate = rate
+        self.limit = limit
+
+    def collect(self, lines):
+        """(Counter of requests per key, {key: (model, values)}, number of lines skipped)"""
+        counts = Counter()
+        entries = {}
+        skipped = 0
+        for line in lines:
+            sample = parse_sample(line)
+            entry = score_entry(*sample) if sample is not None else None
+            if entry is None:
+                skipped += 1 if line.strip() else 0
+                continue
+            key, model, values = entry
+            counts[key] += 1
+            entries[key] = (model, values)
+        return counts, entries, skipped
+
+    def missing(self, keys):
+        try:
+            cached = self.store.get_value_many(keys)
+        except Exception as e:
+            logging.warning('Cached keys were not read, rewriting the batch: %s' % e)
+            return list(keys)
+        return [key for key in keys if not cached.get(key)]
+
+    def write(self, keys, entries):
+        """Scores keys and writes them grouped by model, returns the number of keys written"""
+        by_model = {}
+        for key in keys:
+            model, values = entries[key]
+            by_model.setdefault(model, []).append(key)
+        written = 0
+        for model, model_keys in by_model.items():
+            scores = model.score_batch([entries[key][1] for key in model_keys])
+            mapping = {key: scoring.encode_score(score, model) for key, score in zip(model_keys, scores)}
+            try:
+                written += self.store.cache_set_many(mapping, model.cache_ttl + model.cache_grace)
+            except Exception as e:
+                logging.warning('Batch of %d keys was not written: %s' % (len(model_keys), e))
+        return written
+
+    def run(self, lines):
+        started = time.time()
+        counts, entries, skipped = self.collect(lines)
+        hot = [key for key, _ in counts.most_common(self.limit)]
+        cached, written, attempted = 0, 0, 0
+        covered = set()
+        for i in range(0, len(hot), self.batch_size):
+            batch = hot[i:i + self.batch_size]
+            missing = self.missing(batch)
+            cached += len(batch) - len(missing)
+            covered.update(set(batch) - set(missing))
+            if not missing:
+                continue
+            if self.rate:
+                delay = started + attempted / float(self.rate) - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+            attempted += len(missing)
+            batch_written = self.write(missing, entries)
+            written += batch_written
+            if batch_written == len(missing):
+                covered.update(missing)
+        return self.report(counts, covered, skipped, cached, written, attempted - written, time.time() - started)
+
+    @staticmethod
+    def report(counts, covered, skipped, cached, written, failed, elapsed):
+        requests = sum(counts.values())
+        return {
+            'requests': requests,
+            'skipped': skipped,
+            'keys': len(counts),
+            'cached': cached,
+            'written': written,
+            'failed': failed,
+            'elapsed': elapsed,
+            # share of distinct keys and of sampled requests served from the cache after the run
+            'coverage': len(covered) / float(len(counts)) if counts else 0.0,
+            'request_coverage': sum(counts[key] for key in covered) / float(requests) if requests else 0.0,
+        }
+
+
+def prewarm_file(store, path, **kwargs):
+    with open(path) as f:
+        report = Prewarmer(store, **kwargs).run(f)
+    logging.info('Score cache warmed from %s: %s' % (path, report))
+    return report
+
+
+def format_report(report):
+    return '\n'.join([
+        'requests:   %d (%d lines skipped)' % (report['requests'], report['skipped']),
+        'keys:       %d, %d already cached, %d written, %d failed'
+        % (report['keys'], report['cached'], report['written'], report['failed']),
+        'coverage:   %.1f%% of keys, %.1f%% of requests' % (report['coverage'] * 100,
+                                                            report['request_coverage'] * 100),
+        'elapsed:    %.2fs' % report['elapsed'],
+    ])
+
+
+if __name__ == "__main__":
+    op = OptionParser(usage="%prog [options] REQUESTS_FILE")
+    op.add_option("--redis-nodes", action="store", default=None,
+                  help="comma separated host:port list, keys are sharded across the nodes")
+    op.add_option("--models", action="store", default=None,
+                  help="JSON file with extra scoring models and the account -> model mapping")
+    op.add_option("--batch-size", action="store", type=int, default=PREWARM_BATCH_SIZE)
+    op.add_option("--rate", action="store", type=float, default=PREWARM_RATE,
+                  help="score cache keys written per second, 0 for no limit")
+    op.add_option("--limit", action="store", type=int, default=None,
+                  help="warm only the N most requested keys")
+    (opts, args) = op.parse_args()
+    if len(args) != 1:
+        op.error("requests file is required")
+    logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(levelname).1s %(message)s',
+                        datefmt='%Y.%m.%d %H:%M:%S')
+    if opts.models:
+        models.load_config(opts.models)
+    store = RedisStore(nodes=opts.redis_nodes.split(',') if opts.redis_nodes else None)
+    store.connect()
+    with open(args[0]) as f:
+        report = Prewarmer(store, batch_size=opts.batch_size, rate=opts.rate, limit=opts.limit).run(f)
+    print(format_report(report))
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+import json
+import time
+import logging
+import threading
+
+RATE_LIMIT_SYNC_INTERVAL = 1.0
+RATE_LIMIT_SYNC_WINDOW = 60
+# buckets kept before the idle ones are dropped, the threshold doubles with the buckets still in use
+RATE_LIMIT_PRUNE_SIZE = 10000
+ANY_METHOD = '*'
+
+
+class TokenBucket(object):
+    """
+    rate tokens per second up to burst tokens. Every bucket has its own lock, so concurrent
+    requests of different accounts never wait on each other.
+    """
+    __slots__ = ('rate', 'burst', 'tokens', 'updated', 'lock', 'consumed', 'window', 'own', 'remote')
+
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+        # consumption not yet pushed to the store and the global sync state of the current window
+        self.consumed = 0
+        self.window = None
+        self.own = 0
+        self.remote = 0
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def consume(self, amount=1):
+        with self.lock:
+            self._refill(time.monotonic())
+            if self.tokens < amount:
+                return False
+            self.tokens -= amount
+            self.consumed += amount
+            return True
+
+    def refund(self, amount=1):
+        with self.lock:
+            self.tokens = min(self.burst, self.tokens + amount)
+            self.consumed -= amount
+
+    def drain(self, amount):
+        """Takes tokens consumed by other instances, never below -burst"""
+        with self.lock:
+            self._refill(time.monotonic())
+            self.tokens = max(-self.burst, self.tokens - amount)
+
+    def idle(self, window, synced):
+        """Refilled to burst, nothing to push and not synced in window: dropping it loses nothing"""
+        with self.lock:
+            self._refill(time.monotonic())
+            return self.tokens >= self.burst and not (synced and self.consumed) and self.window != window
+
+    def take_consumed(self):
+        with self.lock:
+            consumed, self.consumed = self.consumed, 0
+            return consumed
+
+
+class RateLimiter(object):
+    """
+    Per account and per login token buckets, optionally per method:
+
+        {"accounts": {"horns&hoofs": {"*": [10, 20], "clients_interests": [1, 5]}},
+         "logins": {"*": {"*": [5, 10]}}}
+
+    A [rate, burst] pair under "*" account/login applies to every account/login without its
+    own entry, and every account/login gets its own bucket. Idle buckets are dropped once
+    there are prune_at of them, a name seen again starts with a full bucket as before.
+    """
+
+    def __init__(self, limits):
+        self.limits = {kind: limits.get(kind, {}) for kind in ('accounts', 'logins')}
+        self.buckets = {}
+        self.prune_at = RATE_LIMIT_PRUNE_SIZE
+        # without a sync thread the consumption is never pushed and never keeps a bucket
+        self.synced = False
+
+    def get_limit(self, kind, name, method):
+        limits = self.limits[kind].get(name) or self.limits[kind].get(ANY_METHOD) or {}
+        if method in limits:
+            return method, limits[method]
+        if ANY_METHOD in limits:
+            return ANY_METHOD, limits[ANY_METHOD]
+        return None, None
+
+    def get_bucket(self, kind, name, method):
+        scope, limit = self.get_limit(kind, name, method)
+        if limit is None:
+            return None
+        key = (kind, name, scope)
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            if len(self.buckets) >= self.prune_at:
+                self.prune()
+            bucket = self.buckets.setdefault(key, TokenBucket(*limit))
+        return bucket
+
+    def prune(self):
+        """Drops the idle buckets, returns how many were dropped"""
+        window = int(time.time() // RATE_LIMIT_SYNC_WINDOW)
+        idle = [key for key, bucket in list(self.buckets.items()) if bucket.idle(window, self.synced)]
+        for key in idle:
+            self.buckets.pop(key, None)
+        self.prune_at = max(RATE_LIMIT_PRUNE_SIZE, len(self.buckets) * 2)
+        return len(idle)
+
+    def allow(self, account, login, method):
+        buckets = [bucket for bucket in (self.get_bucket('accounts', account or '', method),
+                                         self.get_bucket('logins', login or '', method)) if bucket is not None]
+        for i, bucket in enumerate(buckets):
+            if not bucket.consume():
+                # give back what the previous buckets took for a request that is rejected anyway
+                for taken in buckets[:i]:
+                    taken.refund()
+                return False
+        return True
+
+    def sync(self, store):
+        """
+        Pushes the local consumption of every bucket used in the current window to the store
+        in one pipeline and drains what the other instances consumed in the window from them.
+        Buckets idle since an earlier window are skipped until they consume again.
+        """
+        self.synced = True
+        window = int(time.time() // RATE_LIMIT_SYNC_WINDOW)
+        pushed = {}
+        for (kind, name, scope), bucket in list(self.buckets.items()):
+            consumed = bucket.take_consumed()
+            if bucket.window != window:
+                if not consumed:
+                    continue
+                bucket.window, bucket.own, bucket.remote = window, 0, 0
+            bucket.own += consumed
+            pushed['rl#%s#%s#%s#%d' % (kind, name, scope, window)] = (bucket, consumed)
+        if not pushed:
+            return
+        totals = store.incr_many({key: consumed for key, (_, consumed) in pushed.items()},
+                                 expire=RATE_LIMIT_SYNC_WINDOW * 2)
+        for key, total in totals.items():
+            bucket, _ = pushed[key]
+            remote = total - bucket.own
+            if remote > bucket.remote:
+                bucket.drain(remote - bucket.remote)
+                bucket.remote = remote
+
+
+class RateLimitSync(threading.Thread):
+
+    def __init__(self, limiter, store, interval=RATE_LIMIT_SYNC_INTERVAL):
+        super(RateLimitSync, self).__init__(daemon=True)
+        self.limiter = limiter
+        self.store = store
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.limiter.sync(self.store)
+            except Exception as e:
+                logging.warning('Rate limits sync failed: %s' % e)
+
+    def stop(self):
+        self.stopped.set()
+
+
+def load_limits(path):
+    with open(path) as f:
+        return RateLimiter(json.load(f))
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+REFRESH_WORKERS = 2
+REFRESH_MAX_PENDING = 1000
+
+
+class BackgroundRefresher(object):
+    """
+    Refreshes cached values off the request path on a small pool of workers. A key is refreshed
+    by at most one task at a time, requests finding it stale meanwhile keep serving the stale value.
+    At most max_pending refreshes wait, the rest are dropped: the key stays stale and the next
+    request that reads it submits it again.
+    """
+
+    def __init__(self, workers=REFRESH_WORKERS, max_pending=REFRESH_MAX_PENDING):
+        self.max_pending = max_pending
+        self.pending = set()
+        self.lock = threading.Lock()
+        self.submitted = 0
+        self.dropped = 0
+        self.failed = 0
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='refresh')
+
+    def submit(self, key, func):
+        """Schedules func() unless key is already being refreshed, returns whether it was scheduled"""
+        with self.lock:
+            if key in self.pending:
+                return False
+            if len(self.pending) >= self.max_pending:
+                self.dropped += 1
+                return False
+            self.pending.add(key)
+            self.submitted += 1
+        try:
+            self.executor.submit(self.run, key, func)
+        except RuntimeError:
+            # the executor is shut down with the process
+            with self.lock:
+                self.pending.discard(key)
+            return False
+        return True
+
+    def run(self, key, func):
+        try:
+            func()
+        except Exception as e:
+            logging.warning('Refresh of %s failed: %s' % (key, e))
+            with self.lock:
+                self.failed += 1
+        finally:
+            with self.lock:
+                self.pending.discard(key)
+
+    def stats(self):
+        with self.lock:
+            return {'pending': len(self.pending), 'submitted': self.submitted, 'dropped': self.dropped,
+                    'failed': self.failed}
@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import ast
+import json
+import math
+import re
+import time
+import logging
+import threading
+import http.client
+from collections import Counter
+from optparse import OptionParser
+from api import get_token
+
+PERCENTILES = (50, 95, 99, 99.9)
+LOG_LINE_RE = re.compile(r"(?P<path>/\S*): (?P<body>b'.*'|b\".*\") \S+$")
+
+
+def parse_line(line):
+    """
+    Accepts either a JSON object per line (a bare /method body or {"path": ..., "body": ...})
+    or a line written by MainHTTPHandler.do_POST logging.
+    Returns (path, body) or None when the line is not a recorded request.
+    """
+    line = line.strip()
+    if not line:
+        return None
+    try:
+        record = json.loads(line)
+    except ValueError:
+        match = LOG_LINE_RE.search(line)
+        if not match:
+            return None
+        try:
+            record = {"path": match.group('path'), "body": json.loads(ast.literal_eval(match.group('body')))}
+        except (ValueError, SyntaxError):
+            return None
+    if not isinstance(record, dict):
+        return None
+    if isinstance(record.get('body'), dict):
+        return record.get('path') or '/method', record['body']
+    return '/method', record
+
+
+def load_requests(path):
+    requests = []
+    with open(path) as f:
+        for line in f:
+            parsed = parse_line(line)
+            if parsed is not None:
+                requests.append(parsed)
+    return requests
+
+
+def resign(body, force=False):
+    login = body.get('login')
+    if not isinstance(login, str):
+        return body
+    account = body.get('account') if isinstance(body.get('account'), str) else ''
+    token = get_token(account, login)
+    if force or body.get('token') != token:
+        body = dict(body, token=token)
+    return body
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    rank = int(math.ceil(p / 100.0 * len(values))) - 1
+    return values[min(max(rank, 0), len(values) - 1)]
+
+
+class Replayer(object):
+    """
+    Replays recorded requests with a fixed pool of connections. With rate set every request
+    has an intended start time and latency is measured from it, so a stalled server is not hidden
+    by the load generator backing off (coordinated omission). Without rate requests go as fast as possible.
+    """
+
+    def __init__(self, host, port, requests, concurrency=1, rate=None, timeout=10, resign_tokens=False):
+        self.host = host
+        self.port = port
+        self.requests = requests
+        self.concurrency = concurrency
+        self.rate = rate
+        self.timeout = timeout
+        self.resign_tokens = resign_tokens
+        self.latencies = []
+        self.codes = Counter()
+        self.lock = threading.Lock()
+        self.position = 0
+
+    def next_request(self):
+        with self.lock:
+            if self.position >= len(self.requests):
+                return None, None
+            index = self.position
+            self.position += 1
+        return index, self.requests[index]
+
+    def send(self, connection, path, body):
+        if self.resign_tokens:
+            body = resign(body)
+        payload = json.dumps(body).encode('utf-8')
+        connection.request('POST', path, body=payload, headers={'Content-Type': 'application/json'})
+        response = connection.getresponse()
+        response.read()
+        return response.status
+
+    def worker(self, started):
+        connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        while True:
+            index, request = self.next_request()
+            if request is None:
+                break
+            scheduled = started + index / self.rate if self.rate else time.time()
+            delay = scheduled - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            try:
+                code = self.send(connection, *request)
+            except (OSError, http.client.HTTPException) as e:
+                logging.debug('Request %d failed: %s' % (index, e))
+                connection.close()
+                code = 'error'
+            latency = time.time() - scheduled
+            with self.lock:
+                self.latencies.append(latency)
+                self.codes[code] += 1
+        connection.close()
+
+    def run(self):
+        started = time.time()
+        threads = [threading.Thread(target=self.worker, args=(started,)) for _ in range(self.concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return self.report(time.time() - started)
+
+    def report(self, elapsed):
+        total = sum(self.codes.values())
+        return {
+            'requests': total,
+            'elapsed': elapsed,
+            'throughput': total / elapsed if elapsed else 0.0,
+            'latency': {'p%s' % p: percentile(self.latencies, p) for p in PERCENTILES},
+            'codes': dict(self.codes),
+        }
+
+
+def format_report(report):
+    lines = [
+        'requests:   %d in %.2fs' % (report['requests'], report['elapsed']),
+        'throughput: %.1f req/s' % report['throughput'],
+    ]
+    for name, value in report['latency'].items():
+        lines.append('%-11s %.2f ms' % (name + ':', value * 1000))
+    for code, count in sorted(report['codes'].items(), key=lambda x: str(x[0])):
+        lines.append('code %s: %d' % (code, count))
+    return '\n'.join(lines)
+
+
+if __name__ == "__main__":
+    op = OptionParser(usage="%prog [options] REQUESTS_FILE")
+    op.add_option("-H", "--host", action="store", default="localhost")
+    op.add_option("-p", "--port", action="store", type=int, default=8080)
+    op.add_option("-c", "--concurrency", action="store", type=int, default=1)
+    op.add_option("-r", "--rate", action="store", type=float, default=None,
+                  help="requests per second, as fast as possible if omitted")
+    op.add_option("-t", "--timeout", action="store", type=float, default=10)
+    op.add_option("--resign", action="store_true", default=False,
+                  help="recompute tokens that would not pass check_auth")
+    (opts, args) = op.parse_args()
+    if len(args) != 1:
+        op.error("requests file is required")
+    logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(levelname).1s %(message)s',
+                        datefmt='%Y.%m.%d %H:%M:%S')
+    replayer = Replayer(opts.host, opts.port, load_requests(args[0]), concurrency=opts.concurrency,
+                        rate=opts.rate, timeout=opts.timeout, resign_tokens=opts.resign)
+    print(format_report(replayer.run()))
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+import heapq
+import itertools
+import threading
+
+SCHEDULER_WORKERS = 8
+SCHEDULER_DEFAULT_WEIGHT = 1.0
+
+
+def estimate_cost(body):
+    """
+    Relative cost of a /method body: the number of ids for clients_interests and interests_summary,
+    one otherwise and for async requests that only queue a job
+    """
+    if not isinstance(body, dict):
+        return 1
+    arguments = body.get('arguments')
+    if body.get('method') in ('clients_interests', 'interests_summary') and isinstance(arguments, dict) \
+            and not arguments.get('async'):
+        client_ids = arguments.get('client_ids')
+        if isinstance(client_ids, list):
+            return max(1, len(client_ids))
+    return 1
+
+
+class Job(object):
+    __slots__ = ('func', 'account', 'done', 'result', 'error')
+
+    def __init__(self, func, account):
+        self.func = func
+        self.account = account
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class FairScheduler(object):
+    """
+    Weighted fair queueing over accounts. A job gets the virtual finish tag
+    max(virtual time, previous tag of the account) + cost / weight, and workers always run
+    the job with the smallest tag: an account sending heavy requests only delays its own
+    queue, cheap requests of other accounts overtake it.
+    """
+
+    def __init__(self, workers=SCHEDULER_WORKERS, weights=None, default_weight=SCHEDULER_DEFAULT_WEIGHT):
+        self.weights = weights or {}
+        self.default_weight = default_weight
+        self.heap = []
+        self.sequence = itertools.count()
+        self.finish = {}
+        self.depth = {}
+        self.virtual_time = 0.0
+        self.condition = threading.Condition()
+        self.threads = [threading.Thread(target=self.work, daemon=True) for _ in range(workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, account, cost, func):
+        job = Job(func, account)
+        weight = self.weights.get(account, self.default_weight)
+        with self.condition:
+            tag = max(self.virtual_time, self.finish.get(account, 0.0)) + cost / weight
+            self.finish[account] = tag
+            self.depth[account] = self.depth.get(account, 0) + 1
+            heapq.heappush(self.heap, (tag, next(self.sequence), job))
+            self.condition.notify()
+        return job
+
+    def run(self, account, cost, func):
+        """Queues func and blocks until a worker ran it, returning its result or raising its error"""
+        job = self.submit(account, cost, func)
+        job.done.wait()
+        if job.error is not None:
+            raise job.error
+        return job.result
+
+    def work(self):
+        while True:
+            with self.condition:
+                while not self.heap:
+                    self.condition.wait()
+                tag, _, job = heapq.heappop(self.heap)
+                self.virtual_time = tag
+                self.depth[job.account] -= 1
+                if not self.depth[job.account]:
+                    del self.depth[job.account]
+                    if not self.heap:
+                        self.finish.clear()
+            try:
+                job.result = job.func()
+            except Exception as e:
+                job.error = e
+            finally:
+                job.done.set()
+
+    def stats(self):
+        with self.condition:
+            return {
+                'workers': len(self.threads),
+                'queued': len(self.heap),
+                'accounts': dict(self.depth),
+            }
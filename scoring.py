@@ -1,30 +1,273 @@
+import math
+import time
 import random
 import hashlib
+import datetime
+import models
 
+INTERESTS_NAMESPACE_KEY = 'i#namespace'
+INTERESTS_NAMESPACE_TTL = 5
+# dated partitions expire this many days after their day, pruning is left to Redis
+INTERESTS_RETENTION_DAYS = 90
+INTERESTS_MAX_RANGE_DAYS = 31
+# probabilistic early expiration (XFetch): a fresh score is refreshed t seconds before its soft expiry
+# with probability exp(-t / (SCORE_EARLY_EXPIRATION_DELTA * beta)), hot keys written together expire apart
+SCORE_EARLY_EXPIRATION_DELTA = 1.0
+SCORE_EARLY_EXPIRATION_BETA = 1.0
+# hashed with the key, scores with expiries live apart from the bare floats of older releases,
+# so neither side reads a value format it does not know during a rolling deploy
+SCORE_KEY_PREFIX = 'swr#'
 
-def get_score(store, phone, email, birthday=None, gender=None, first_name=None, last_name=None):
+# interests.InterestCodec when clients interests are stored as dictionary encoded bitmaps
+interest_codec = None
+# snapshot.InterestSnapshot serving interests reads before the store
+interest_snapshot = None
+# interests.InterestCache in front of the store reads
+interest_cache = None
+# True when interests are bulk loaded into versioned keyspaces switched by INTERESTS_NAMESPACE_KEY
+versioned_interests = False
+# True when interests are also written into day partitions and dated requests are served from them
+dated_interests = False
+# refresh.BackgroundRefresher recomputing stale scores off the request path, they are recomputed inline without it
+score_refresher = None
+_namespace = (0, '')
+
+
+def get_score_key(phone, email, birthday=None, gender=None, first_name=None, last_name=None, model=None):
     key = 'p#%se#%sb#%sg#%sfn#%sln#%s' % (phone, email, birthday, gender, first_name, last_name)
-    key = hashlib.sha512(key.encode('utf-8')).hexdigest()
+    if model is not None and model.name != models.DEFAULT_MODEL:
+        key = 'm#%s#%s' % (model.name, key)
+    return hashlib.sha512((SCORE_KEY_PREFIX + key).encode('utf-8')).hexdigest()
 
-    score = store.cache_get(key) or 0
-    if score:
-        return float(score)
-    else:
-        score = 0
-        if phone:
-            score += 1.5
-        if email:
-            score += 1.5
-        if birthday and gender:
-            score += 1.5
-        if first_name and last_name:
-            score += 0.5
-        store.cache_set(key, score, 60)
+
+def encode_score(score, model, now=None):
+    """Cached value of a score: the score, its soft and hard expiry as unix times"""
+    now = time.time() if now is None else now
+    return '%r|%.3f|%.3f' % (float(score), now + model.cache_ttl, now + model.cache_ttl + model.cache_grace)
+
+
+def decode_score(value):
+    """(score, soft expiry, hard expiry) of a cached value, expiries are None for a bare score"""
+    if isinstance(value, bytes):
+        value = value.decode('utf-8')
+    score, _, expiries = str(value).partition('|')
+    if not expiries:
+        return float(score), None, None
+    soft, hard = expiries.split('|')
+    return float(score), float(soft), float(hard)
+
+
+def expires_early(now, soft, beta=None):
+    beta = SCORE_EARLY_EXPIRATION_BETA if beta is None else beta
+    return now - SCORE_EARLY_EXPIRATION_DELTA * beta * math.log(1.0 - random.random()) >= soft
+
+
+def set_score(store, key, model, values, deadline=None):
+    score = model.score(**values)
+    store.cache_set(key, encode_score(score, model), model.cache_ttl + model.cache_grace, deadline=deadline)
     return score
 
 
-def get_interests(store, cid):
-    key = 'i#%s' % cid
-    result = store.get(key) or []
-    result = [v.decode('utf-8') for v in result]
+def get_score(store, phone, email, birthday=None, gender=None, first_name=None, last_name=None, model=None,
+              deadline=None):
+    """
+    Cached scores are stale-while-revalidate: a score past its soft expiry (or expiring early
+    by chance) is served while score_refresher recomputes it, and never past its hard expiry,
+    when the key expires in the store too.
+    """
+    model = model or models.get_model()
+    values = dict(phone=phone, email=email, birthday=birthday, gender=gender,
+                  first_name=first_name, last_name=last_name)
+    if not model.cacheable:
+        return model.score(**values)
+
+    key = get_score_key(model=model, **values)
+    cached = store.cache_get(key, deadline=deadline)
+    if cached:
+        score, soft, hard = decode_score(cached)
+        now = time.time()
+        # a bare score written before expiries were cached lives by its store TTL only
+        if soft is None or now < soft and not expires_early(now, soft):
+            return score
+        if now < hard and score_refresher is not None:
+            score_refresher.submit(key, lambda: set_score(store, key, model, values))
+            return score
+    return set_score(store, key, model, values, deadline=deadline)
+
+
+def read_interests_namespace(store, deadline=None):
+    return (store.get_value(INTERESTS_NAMESPACE_KEY, deadline=deadline) or b'').decode('utf-8')
+
+
+def get_interests_namespace(store, deadline=None):
+    global _namespace
+    if not versioned_interests:
+        return ''
+    expires, namespace = _namespace
+    if expires <= time.time():
+        namespace = read_interests_namespace(store, deadline)
+        _namespace = (time.time() + INTERESTS_NAMESPACE_TTL, namespace)
+    return namespace
+
+
+def interests_key(cid, namespace=''):
+    if interest_codec is not None:
+        return '%sib#%s' % (namespace, cid)
+    return '%si#%s' % (namespace, cid)
+
+
+def dated_interests_key(cid, date, namespace=''):
+    """Day partition of a client, the {cid} hash tag keeps every day of the client on one node"""
+    return '%si#{%s}#%s' % (namespace, cid, date.strftime('%Y%m%d'))
+
+
+def dated_interests_expire_at(date):
+    expires = datetime.datetime.combine(date, datetime.time()) + datetime.timedelta(days=INTERESTS_RETENTION_DAYS + 1)
+    return int(time.mktime(expires.timetuple()))
+
+
+def date_range(date, date_to=None):
+    days = (date_to - date).days + 1 if date_to is not None else 1
+    return [date + datetime.timedelta(days=i) for i in range(days)]
+
+
+def get_interests_dated(store, cids, date, date_to=None, deadline=None, partial=False):
+    """
+    Interests of the clients on a day or over the days from date to date_to inclusive,
+    unions of the day partitions are computed by Redis in one pipeline per node.
+    Returns {cid: [interest, ...]} or with partial ({cid: [...]}, {cid: error}).
+    """
+    namespace = get_interests_namespace(store, deadline)
+    days = date_range(date, date_to)
+    names = {'%si#{%s}' % (namespace, cid): cid for cid in cids}
+    mapping = {name: [dated_interests_key(cid, day, namespace) for day in days] for name, cid in names.items()}
+    if partial:
+        values, failed = store.union_many(mapping, deadline=deadline, partial=True)
+    else:
+        values, failed = store.union_many(mapping, deadline=deadline), {}
+    result = {names[name]: [v.decode('utf-8') for v in value or []] for name, value in values.items()}
+    if partial:
+        return result, {names[name]: error for name, error in failed.items()}
     return result
+
+
+def get_interests(store, cid, deadline=None):
+    snapshot = interest_snapshot
+    if snapshot is not None and snapshot.is_fresh():
+        result = snapshot.get(cid)
+        if result is not None:
+            return result
+    key = interests_key(cid, get_interests_namespace(store, deadline))
+    cache = interest_cache
+    if cache is not None:
+        hit, value = cache.get(key)
+        if hit:
+            return value
+    # a cache fill from a lagging replica would serve the stale value for the whole TTL
+    primary = cache is not None
+    if interest_codec is not None:
+        result = interest_codec.decode(store, store.get_value(key, primary=primary, deadline=deadline))
+    else:
+        result = store.get(key, primary=primary, deadline=deadline) or []
+        result = [v.decode('utf-8') for v in result]
+    if cache is not None:
+        cache.put(key, result, value)
+    return result
+
+
+def get_interests_partial(store, cids, deadline=None):
+    """
+    Interests of every client that could be read, one attempt per chunk of a store shard:
+    returns ({cid: [interest, ...]}, {cid: 'timeout' | 'unavailable' | 'error'})
+    """
+    result, keys, tokens = {}, {}, {}
+    snapshot = interest_snapshot
+    if snapshot is not None and not snapshot.is_fresh():
+        snapshot = None
+    namespace = get_interests_namespace(store, deadline)
+    cache = interest_cache
+    for cid in cids:
+        value = snapshot.get(cid) if snapshot is not None else None
+        if value is not None:
+            result[cid] = value
+            continue
+        key = interests_key(cid, namespace)
+        if cache is not None:
+            hit, value = cache.get(key)
+            if hit:
+                result[cid] = value
+                continue
+            tokens[key] = value
+        keys[key] = cid
+    if not keys:
+        return result, {}
+
+    primary = cache is not None
+    if interest_codec is not None:
+        values, failed = store.get_value_many_partial(list(keys), deadline=deadline, primary=primary)
+        values = {key: interest_codec.decode(store, value) for key, value in values.items()}
+    else:
+        values, failed = store.get_many_partial(list(keys), deadline=deadline, primary=primary)
+        values = {key: [v.decode('utf-8') for v in value or []] for key, value in values.items()}
+    for key, value in values.items():
+        result[keys[key]] = value
+        if cache is not None:
+            cache.put(key, value, tokens[key])
+    return result, {keys[key]: error for key, error in failed.items()}
+
+
+def get_interests_summary(store, cids, top=None, deadline=None):
+    """
+    {interest: number of the clients having it}, the top most frequent ones with top.
+    Counting runs inside Redis, the result size depends on distinct interests only.
+    """
+    namespace = get_interests_namespace(store, deadline)
+    keys = list({interests_key(cid, namespace) for cid in cids})
+    codec = interest_codec
+    counts = store.count_members(keys, bitmap=codec is not None, deadline=deadline)
+    if codec is not None:
+        if any(id_ >= len(codec.names) or codec.names[id_] is None for id_ in counts):
+            codec.load(store)
+        names = codec.names
+        counts = {names[id_]: count for id_, count in counts.items() if id_ < len(names) and names[id_] is not None}
+    else:
+        counts = {member.decode('utf-8'): count for member, count in counts.items()}
+    ranked = sorted(counts.items(), key=lambda item: (-item[1], item[0]))
+    return dict(ranked[:top] if top else ranked)
+
+
+def get_interests_many(store, cids, namespace=None):
+    """Pipelined read of several clients, {cid: [interest, ...]}"""
+    if namespace is None:
+        namespace = get_interests_namespace(store)
+    keys = {interests_key(cid, namespace): cid for cid in cids}
+    if interest_codec is not None:
+        values = store.get_value_many(list(keys))
+        return {keys[key]: interest_codec.decode(store, value) for key, value in values.items()}
+    values = store.get_many(list(keys))
+    return {keys[key]: [v.decode('utf-8') for v in value or []] for key, value in values.items()}
+
+
+def set_interests(store, cid, interests, date=None):
+    if date is not None:
+        return set_interests_many(store, {cid: interests}, get_interests_namespace(store), date)
+    key = interests_key(cid, get_interests_namespace(store))
+    if interest_codec is not None:
+        return store.set_value(key, interest_codec.encode(store, interests))
+    return store.set(key, *interests)
+
+
+def set_interests_many(store, interests, namespace='', date=None):
+    """
+    Pipelined write of {cid: [interest, ...]} into the given keyspace, into the day partitions
+    expiring after INTERESTS_RETENTION_DAYS when date is given. Interests are added to the stored
+    ones in both formats, so a client split across loader batches keeps all of its rows.
+    """
+    if date is not None:
+        mapping = {dated_interests_key(cid, date, namespace): values for cid, values in interests.items()}
+        expire_at = dated_interests_expire_at(date)
+        return store.set_many(mapping, expire_at=dict.fromkeys(mapping, expire_at))
+    if interest_codec is not None:
+        return store.merge_bits_many({interests_key(cid, namespace): interest_codec.encode(store, values)
+                                      for cid, values in interests.items()})
+    return store.set_many({interests_key(cid, namespace): values for cid, values in interests.items()})
@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import mmap
+import json
+import time
+import struct
+import logging
+import tempfile
+import threading
+from array import array
+from optparse import OptionParser
+import scoring
+from store import RedisStore
+from interests import InterestCodec
+
+SNAPSHOT_MAGIC = b'ISNP'
+SNAPSHOT_VERSION = 1
+SNAPSHOT_MAX_AGE = 24 * 60 * 60
+SNAPSHOT_RELOAD_INTERVAL = 30
+SNAPSHOT_EXPORT_BATCH_SIZE = 1000
+
+# magic, version, reserved, created, clients count, data offset, table offset
+HEADER = struct.Struct('<4sHHdQQQ')
+# client id, offset of its interest ids in the data section, number of ids
+ENTRY = struct.Struct('<qQI')
+INTEREST_ID = 'H'
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def export(store, path, batch_size=SNAPSHOT_EXPORT_BATCH_SIZE):
+    """
+    Dumps every client interests set into a read-only file:
+    header | index of ENTRY sorted by client id | uint16 interest ids | JSON list of interest names.
+    The file is written next to path and renamed over it, so readers see either snapshot whole.
+    """
+    namespace = scoring.get_interests_namespace(store)
+    prefix = scoring.interests_key('', namespace)
+    cids = []
+    for key in store.scan(prefix + '*'):
+        key = key.decode('utf-8') if isinstance(key, bytes) else key
+        try:
+            cids.append(int(key[len(prefix):]))
+        except ValueError:
+            continue
+    cids.sort()
+
+    names, ids = [], {}
+    data = tempfile.TemporaryFile()
+    index = tempfile.TemporaryFile()
+    offset = 0
+    for start in range(0, len(cids), batch_size):
+        chunk = cids[start:start + batch_size]
+        interests = scoring.get_interests_many(store, chunk, namespace)
+        for cid in chunk:
+            values = array(INTEREST_ID)
+            for name in interests.get(cid) or []:
+                if name not in ids:
+                    if len(names) > 0xffff:
+                        raise SnapshotError('Too many distinct interests for %s ids' % INTEREST_ID)
+                    ids[name] = len(names)
+                    names.append(name)
+                values.append(ids[name])
+            data.write(values.tobytes())
+            index.write(ENTRY.pack(cid, offset, len(values)))
+            offset += len(values) * values.itemsize
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix='.snapshot-')
+    with os.fdopen(fd, 'wb') as f:
+        data_offset = HEADER.size + ENTRY.size * len(cids)
+        f.write(HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, 0, time.time(), len(cids),
+                            data_offset, data_offset + offset))
+        for part in (index, data):
+            part.seek(0)
+            while True:
+                buf = part.read(1 << 20)
+                if not buf:
+                    break
+                f.write(buf)
+            part.close()
+        f.write(json.dumps(names).encode('utf-8'))
+    os.replace(tmp, path)
+    return len(cids)
+
+
+class InterestSnapshot(object):
+    """
+    Read side of an exported snapshot. The file is memory-mapped read-only, so every worker
+    process shares the same page cache pages; lookups are a binary search over the index.
+    """
+
+    def __init__(self, path, max_age=SNAPSHOT_MAX_AGE):
+        self.path = path
+        self.max_age = max_age
+        with open(path, 'rb') as f:
+            self.stat = os.fstat(f.fileno())
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, _, self.created, self.count, self.data_offset, table_offset = HEADER.unpack_from(self.mm)
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+            raise SnapshotError('%s is not an interests snapshot' % path)
+        self.names = [sys.intern(name) for name in json.loads(self.mm[table_offset:].decode('utf-8'))]
+
+    def is_fresh(self):
+        return time.time() - self.created < self.max_age
+
+    def find(self, cid):
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            position = HEADER.size + mid * ENTRY.size
+            current, offset, length = ENTRY.unpack_from(self.mm, position)
+            if current == cid:
+                return offset, length
+            if current < cid:
+                lo = mid + 1
+            else:
+                hi = mid
+        return None
+
+    def get(self, cid):
+        """Interests of the client or None when the client is not in the snapshot"""
+        try:
+            found = self.find(int(cid))
+        except (TypeError, ValueError):
+            return None
+        if found is None:
+            return None
+        offset, length = found
+        start = self.data_offset + offset
+        ids = memoryview(self.mm)[start:start + length * 2].cast(INTEREST_ID)
+        try:
+            return [self.names[id_] for id_ in ids]
+        finally:
+            ids.release()
+
+
+class SnapshotReloader(threading.Thread):
+    """Watches the snapshot file and installs a new scoring.interest_snapshot when it is replaced"""
+
+    def __init__(self, path, max_age=SNAPSHOT_MAX_AGE, interval=SNAPSHOT_RELOAD_INTERVAL):
+        super(SnapshotReloader, self).__init__(daemon=True)
+        self.path = path
+        self.max_age = max_age
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def reload(self):
+        current = scoring.interest_snapshot
+        try:
+            stat = os.stat(self.path)
+            if current is not None and (stat.st_ino, stat.st_mtime) == (current.stat.st_ino, current.stat.st_mtime):
+                return False
+            scoring.interest_snapshot = InterestSnapshot(self.path, self.max_age)
+        except (OSError, ValueError, SnapshotError) as e:
+            logging.warning('Interests snapshot %s was not loaded: %s' % (self.path, e))
+            return False
+        logging.info('Loaded interests snapshot %s with %d clients' % (self.path, scoring.interest_snapshot.count))
+        return True
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.reload()
+
+    def stop(self):
+        self.stopped.set()
+
+
+if __name__ == "__main__":
+    op = OptionParser(usage="%prog [options] SNAPSHOT_FILE")
+    op.add_option("--redis-nodes", action="store", default=None)
+    op.add_option("--interests-format", action="store", default="set", choices=["set", "bitmap"])
+    op.add_option("--interests-versioned", action="store_true", default=False)
+    (opts, args) = op.parse_args()
+    if len(args) != 1:
+        op.error("snapshot file is required")
+    logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(levelname).1s %(message)s',
+                        datefmt='%Y.%m.%d %H:%M:%S')
+    store = RedisStore(nodes=opts.redis_nodes.split(',') if opts.redis_nodes else None, socket_connect_timeout=30)
+    store.connect()
+    if opts.interests_format == "bitmap":
+        scoring.interest_codec = InterestCodec()
+        scoring.interest_codec.load(store)
+    scoring.versioned_interests = opts.interests_versioned
+    started = time.time()
+    logging.info('Exported %d clients in %.1fs' % (export(store, args[0]), time.time() - started))
+    store.close()
@@ -2,34 +2,126 @@
 import redis
 import time
 import logging
+import bisect
+import hashlib
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+from deadline import DeadlineExceeded, bind_deadline, current_deadline
 
 REDIS_RETRY_MAX_ATTEMPTS = 3
 REDIS_RETRY_DELAY = 0.1
+REDIS_HASH_RING_REPLICAS = 160
+REDIS_REBALANCE_BATCH_SIZE = 500
+REDIS_REPLICA_DOWN_TIME = 5
+REDIS_REPLICA_LATENCY_DECAY = 0.2
+# keys per script call, a call blocks Redis for its whole duration
+REDIS_SCRIPT_CHUNK_SIZE = 500
+# keys per pipeline of a partial read, a failing key loses only its own chunk
+REDIS_PARTIAL_CHUNK_SIZE = 100
+# threads reading shards and partial read chunks in parallel
+REDIS_READ_WORKERS = 8
+# changed keys per invalidation message, newline separated
+REDIS_INVALIDATION_BATCH_SIZE = 1000
+
+# flat [member, count, ...] of the members of the set KEYS
+COUNT_MEMBERS_SCRIPT = """
+local counts = {}
+for i = 1, #KEYS do
+    local members = redis.call('SMEMBERS', KEYS[i])
+    for j = 1, #members do
+        counts[members[j]] = (counts[members[j]] or 0) + 1
+    end
+end
+local result = {}
+for member, count in pairs(counts) do
+    result[#result + 1] = member
+    result[#result + 1] = count
+end
+return result
+"""
+
+# flat [bit, count, ...] of the bits set in the string KEYS, bit 0 is the lowest bit of the first byte
+COUNT_BITS_SCRIPT = """
+local counts = {}
+for i = 1, #KEYS do
+    local bitmap = redis.call('GET', KEYS[i])
+    if bitmap then
+        for index = 1, #bitmap do
+            local byte = string.byte(bitmap, index)
+            local bit = (index - 1) * 8
+            while byte > 0 do
+                if byte % 2 == 1 then
+                    counts[bit] = (counts[bit] or 0) + 1
+                end
+                byte = math.floor(byte / 2)
+                bit = bit + 1
+            end
+        end
+    end
+end
+local result = {}
+for bit, count in pairs(counts) do
+    result[#result + 1] = bit
+    result[#result + 1] = count
+end
+return result
+"""
+
+# ORs the bitmap ARGV[i] into the string KEYS[i], so writes of one key from several batches add up
+MERGE_BITS_SCRIPT = """
+for i = 1, #KEYS do
+    local current = redis.call('GET', KEYS[i]) or ''
+    local value = ARGV[i]
+    if #current > 0 then
+        local bytes = {}
+        for index = 1, math.max(#current, #value) do
+            bytes[index] = string.char(bit.bor(string.byte(current, index) or 0, string.byte(value, index) or 0))
+        end
+        value = table.concat(bytes)
+    end
+    redis.call('SET', KEYS[i], value)
+end
+return #KEYS
+"""
 
 
 def retry(raise_on_failure=True, retry_max_attempts=None, retry_delay=None):
+    """
+    Retries redis connection errors and timeouts with exponential backoff. A decorated method
+    takes an optional deadline keyword: every attempt runs with socket timeouts capped by
+    the remaining budget, and DeadlineExceeded is raised instead of an attempt or a sleep
+    the budget can not cover. DeadlineExceeded is never retried nor swallowed.
+    An optional attempts keyword overrides the number of attempts of a single call.
+    """
 
     def retry_on_failure(method):
 
         def wrapper(*args, **kwargs):
-            nonlocal retry_max_attempts, retry_delay
-
-            if retry_max_attempts is None:
-                retry_max_attempts = REDIS_RETRY_MAX_ATTEMPTS
-            if retry_delay is None:
-                retry_delay = REDIS_RETRY_DELAY
+            max_attempts = REDIS_RETRY_MAX_ATTEMPTS if retry_max_attempts is None else retry_max_attempts
+            max_attempts = kwargs.pop('attempts', None) or max_attempts
+            delay = REDIS_RETRY_DELAY if retry_delay is None else retry_delay
+            deadline = kwargs.pop('deadline', None)
 
             last_exception = None
-            for i in range(retry_max_attempts):
+            for i in range(max_attempts):
+                if deadline is not None:
+                    deadline.check()
                 try:
-                    return method(*args, **kwargs)
+                    if deadline is None:
+                        return method(*args, **kwargs)
+                    with bind_deadline(deadline):
+                        return method(*args, **kwargs)
                 except (redis.exceptions.ConnectionError, redis.exceptions.TimeoutError) as e:
                     last_exception = e
-                    time.sleep(retry_delay)
-                    retry_delay *= 2
+                    if i + 1 == max_attempts:
+                        break
+                    if deadline is not None and deadline.remaining() <= delay:
+                        raise DeadlineExceeded('Request deadline exceeded, %s failed: %s' % (method.__name__, e))
+                    time.sleep(delay)
+                    delay *= 2
 
             if last_exception is not None:
-                msg = 'Method %s was failed after %d attempts' % (method, REDIS_RETRY_MAX_ATTEMPTS)
+                msg = 'Method %s was failed after %d attempts' % (method, max_attempts)
                 logging.exception(msg, exc_info=last_exception)
 
             if raise_on_failure:
@@ -39,36 +131,627 @@ def retry(raise_on_failure=True, retry_max_attempts=None, retry_delay=None):
     return retry_on_failure
 
 
+class DeadlineConnection(redis.Connection):
+    """Connection whose socket timeout is cut down to the deadline bound to the calling thread"""
+
+    def apply_deadline(self):
+        if self._sock is None:
+            return
+        timeout = self.socket_timeout
+        deadline = current_deadline()
+        if deadline is not None:
+            # a zero timeout would make the socket non-blocking, an expired deadline fails fast instead
+            remaining = max(deadline.remaining(), 0.001)
+            timeout = remaining if timeout is None else min(timeout, remaining)
+        self._sock.settimeout(timeout)
+
+    def send_packed_command(self, command, check_health=True):
+        if not self._sock:
+            self.connect()
+        self.apply_deadline()
+        return super(DeadlineConnection, self).send_packed_command(command, check_health)
+
+    def read_response(self):
+        self.apply_deadline()
+        return super(DeadlineConnection, self).read_response()
+
+
+def make_client(params):
+    client = redis.Redis(**params)
+    pool = getattr(client, 'connection_pool', None)
+    if isinstance(pool, redis.ConnectionPool) and pool.connection_class is redis.Connection:
+        pool.connection_class = DeadlineConnection
+    return client
+
+
+class HashRing(object):
+    """
+    Consistent hashing ring: every node owns a number of points on the ring and a key belongs
+    to the first point clockwise from its hash, so adding or removing a node only moves
+    the keys of the neighbouring arcs. Like in Redis Cluster only the part of a key inside
+    the first non-empty {...} is hashed, so keys sharing a hash tag live on one node.
+    """
+
+    def __init__(self, nodes=(), replicas=None):
+        self.replicas = replicas or REDIS_HASH_RING_REPLICAS
+        self.ring = {}
+        self.points = []
+        for node in nodes:
+            self.add_node(node)
+
+    @staticmethod
+    def hash(key):
+        if isinstance(key, str):
+            key = key.encode('utf-8')
+        return int.from_bytes(hashlib.md5(key).digest()[:8], 'big')
+
+    @staticmethod
+    def hash_tag(key):
+        if isinstance(key, bytes):
+            key = key.decode('utf-8')
+        start = key.find('{')
+        if start != -1:
+            end = key.find('}', start + 1)
+            if end > start + 1:
+                return key[start + 1:end]
+        return key
+
+    def add_node(self, node):
+        for i in range(self.replicas):
+            point = self.hash('%s-%d' % (node, i))
+            self.ring[point] = node
+            bisect.insort(self.points, point)
+
+    def remove_node(self, node):
+        for i in range(self.replicas):
+            point = self.hash('%s-%d' % (node, i))
+            if self.ring.pop(point, None) is not None:
+                self.points.remove(point)
+
+    def get_node(self, key):
+        if not self.points:
+            return None
+        index = bisect.bisect(self.points, self.hash(self.hash_tag(key))) % len(self.points)
+        return self.ring[self.points[index]]
+
+
+class ReplicaSelector(object):
+    """
+    Picks a replica for a read: round robin or the one with the lowest moving average latency.
+    A replica that failed is skipped for REDIS_REPLICA_DOWN_TIME seconds.
+    """
+    ROUND_ROBIN = 'round_robin'
+    LEAST_LATENCY = 'least_latency'
+
+    def __init__(self, clients, strategy=ROUND_ROBIN):
+        if strategy not in (self.ROUND_ROBIN, self.LEAST_LATENCY):
+            raise ValueError('Unknown read strategy %s' % strategy)
+        self.clients = clients
+        self.strategy = strategy
+        self.counter = itertools.count()
+        self.latency = {}
+        self.down_until = {}
+
+    def choose(self):
+        now = time.time()
+        alive = [client for client in self.clients if self.down_until.get(client, 0) <= now]
+        if not alive:
+            return None
+        if self.strategy == self.LEAST_LATENCY:
+            return min(alive, key=lambda client: self.latency.get(client, 0.0))
+        return alive[next(self.counter) % len(alive)]
+
+    def observe(self, client, elapsed):
+        previous = self.latency.get(client)
+        if previous is None:
+            self.latency[client] = elapsed
+        else:
+            self.latency[client] = previous + REDIS_REPLICA_LATENCY_DECAY * (elapsed - previous)
+
+    def mark_down(self, client):
+        self.down_until[client] = time.time() + REDIS_REPLICA_DOWN_TIME
+
+
 class RedisStore(object):
+    """
+    Without nodes the store talks to a single redis.Redis(**kwargs) client.
+    With nodes ([{'host': ..., 'port': ...}, ...] or ['host:port', ...]) keys are spread over
+    the nodes by consistent hashing, kwargs are shared connection params for every node.
+    Reads go to replicas when there are any: `replicas` for a single node, a 'replicas' list
+    inside a node dict or 'host:port+replica:port+...' for a sharded store, which rejects
+    the store-wide `replicas`. Writes always go to the primary.
+    With invalidation_channel the keys changed through the store are published on the channel,
+    newline separated in messages of up to REDIS_INVALIDATION_BATCH_SIZE keys, so the in-process
+    caches of every instance drop them, whether this process caches or not.
+    """
 
     client = None
     params = {}
 
-    def __init__(self, **kwargs):
+    def __init__(self, nodes=None, replicas=None, read_strategy=ReplicaSelector.ROUND_ROBIN,
+                 invalidation_channel=None, **kwargs):
+        if nodes and replicas:
+            raise ValueError('Replicas of a sharded store are given per node: host:port+replica:port')
         self.params = kwargs
+        self.nodes = {}
+        self.replicas = {None: [dict(kwargs, **self.parse_node(r)) for r in replicas or []]}
+        for node in nodes or []:
+            params = dict(kwargs, **self.parse_node(node))
+            node_replicas = params.pop('replicas', [])
+            name = self.node_name(params)
+            self.nodes[name] = params
+            self.replicas[name] = [dict(kwargs, **self.parse_node(r)) for r in node_replicas]
+        self.ring = HashRing(self.nodes) if self.nodes else None
+        self.read_strategy = read_strategy
+        self.clients = {}
+        self.selectors = {}
+        self.executor = None
+        # callables notified with the list of keys changed by every set/set_value/set_many/set_value_many
+        self.write_listeners = []
+        # channel the changed keys are published on for the other instances
+        self.invalidation_channel = invalidation_channel
+        self.scripts = {}
+
+    @staticmethod
+    def parse_node(node):
+        """'host:port' or 'host:port+replica:port+...' -> params with their 'replicas' list"""
+        if isinstance(node, str):
+            node, *replicas = node.split('+')
+            host, _, port = node.partition(':')
+            params = {'host': host, 'port': int(port or 6379)}
+            if replicas:
+                params['replicas'] = replicas
+            return params
+        return dict(node)
+
+    @staticmethod
+    def node_name(params):
+        return '%s:%s/%s' % (params.get('host', 'localhost'), params.get('port', 6379), params.get('db', 0))
 
     @retry(raise_on_failure=True)
+    def connect_node(self, params):
+        client = make_client(params)
+        client.ping()
+        return client
+
     def connect(self):
-        self.client = redis.Redis(**self.params)
-        self.client.ping()
+        if self.ring is None:
+            self.client = self.connect_node(self.params)
+        else:
+            for name, params in self.nodes.items():
+                self.clients[name] = self.connect_node(params)
+        if self.executor is None:
+            # threads start on the first parallel read, a single group always runs inline
+            self.executor = ThreadPoolExecutor(max_workers=max(len(self.clients), REDIS_READ_WORKERS))
+        for name, replicas in self.replicas.items():
+            if replicas:
+                # replicas connect lazily, the unavailable ones are skipped at read time
+                clients = [make_client(params) for params in replicas]
+                self.selectors[name] = ReplicaSelector(clients, self.read_strategy)
 
     def close(self):
-        self.client.close()
+        for selector in self.selectors.values():
+            for client in selector.clients:
+                client.close()
+        if self.ring is None:
+            self.client.close()
+            return
+        for client in self.clients.values():
+            client.close()
+
+    def node_for(self, key):
+        if self.ring is None:
+            return None
+        return self.ring.get_node(key)
+
+    def primary(self, node):
+        if node is None:
+            return self.client
+        return self.clients[node]
+
+    def client_for(self, key):
+        return self.primary(self.node_for(key))
+
+    def read(self, node, command, primary=False):
+        """
+        Runs command(client) on a replica of the node, falling back to the primary when
+        the node has no replicas or the chosen one failed. A failed primary is left to retry.
+        With primary the read skips the replicas, for readers that must not see a lagging copy.
+        """
+        selector = self.selectors.get(node) if not primary else None
+        replica = selector.choose() if selector else None
+        if replica is not None:
+            started = time.time()
+            try:
+                result = command(replica)
+            except (redis.exceptions.ConnectionError, redis.exceptions.TimeoutError) as e:
+                deadline = current_deadline()
+                if deadline is not None and deadline.expired():
+                    # the replica is fine, the request ran out of time
+                    raise DeadlineExceeded('Request deadline exceeded reading node %s: %s' % (node, e))
+                logging.warning('Replica %s of node %s failed: %s' % (replica, node, e))
+                selector.mark_down(replica)
+            else:
+                selector.observe(replica, time.time() - started)
+                return result
+        return command(self.primary(node))
+
+    def group_by_node(self, keys):
+        groups = {}
+        for key in keys:
+            groups.setdefault(self.node_for(key), []).append(key)
+        return list(groups.items())
+
+    def map_nodes(self, func, groups):
+        """Runs func(node, keys) for every group, in parallel when there is more than one"""
+        if len(groups) <= 1 or self.executor is None:
+            return [func(node, keys) for node, keys in groups]
+        futures = [self.executor.submit(func, node, keys) for node, keys in groups]
+        return [future.result() for future in futures]
+
+    def notify_writes(self, node, keys):
+        for listener in self.write_listeners:
+            listener(keys)
+        if self.invalidation_channel is None or not keys:
+            return
+        try:
+            pipe = self.primary(node).pipeline(transaction=False)
+            for start in range(0, len(keys), REDIS_INVALIDATION_BATCH_SIZE):
+                pipe.publish(self.invalidation_channel, '\n'.join(keys[start:start + REDIS_INVALIDATION_BATCH_SIZE]))
+            pipe.execute()
+        except (redis.exceptions.ConnectionError, redis.exceptions.TimeoutError) as e:
+            logging.warning('Invalidation of %d keys was not published: %s' % (len(keys), e))
+
+    def subscribe(self, channel, callback):
+        """Calls callback(data) for every message published on the channel of any primary"""
+        clients = [self.client] if self.ring is None else list(self.clients.values())
+        threads = []
+        for client in clients:
+            pubsub = client.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(**{channel: lambda message: callback(message['data'])})
+            threads.append(pubsub.run_in_thread(sleep_time=1, daemon=True))
+        return threads
+
+    def primaries(self):
+        return [self.client] if self.ring is None else list(self.clients.values())
+
+    @retry(raise_on_failure=True, retry_max_attempts=1)
+    def ping(self):
+        for client in self.primaries():
+            client.ping()
+        return True
+
+    def open_connections(self, count):
+        """Opens up to count connections in the pool of every primary ahead of traffic, returns how many"""
+        opened = 0
+        for client in self.primaries():
+            pool = client.connection_pool
+            connections = []
+            try:
+                for _ in range(count):
+                    # the pool connects a connection when it hands it out
+                    connections.append(pool.get_connection('PING'))
+                    opened += 1
+            finally:
+                for connection in connections:
+                    pool.release(connection)
+        return opened
+
+    def get_script(self, source):
+        """redis Script of the source, it runs by its sha and is loaded on the servers that miss it"""
+        script = self.scripts.get(source)
+        if script is None:
+            client = self.client if self.ring is None else next(iter(self.clients.values()))
+            script = self.scripts[source] = client.register_script(source)
+        return script
 
     @retry(raise_on_failure=True)
     def set(self, key, *values):
-        return self.client.sadd(key, *values)
+        result = self.client_for(key).sadd(key, *values)
+        self.notify_writes(self.node_for(key), [key])
+        return result
 
     @retry(raise_on_failure=True)
-    def get(self, key):
-        return self.client.smembers(key)
+    def get(self, key, primary=False):
+        return self.read(self.node_for(key), lambda client: client.smembers(key), primary)
 
     @retry(raise_on_failure=False)
     def cache_set(self, key, value, expire):
-        return self.client.set(key, value, ex=expire)
+        return self.client_for(key).set(key, value, ex=expire)
 
     @retry(raise_on_failure=False)
     def cache_get(self, key):
-        return self.client.get(key)
+        return self.read(self.node_for(key), lambda client: client.get(key))
+
+    @retry(raise_on_failure=True)
+    def set_value(self, key, value):
+        result = self.client_for(key).set(key, value)
+        self.notify_writes(self.node_for(key), [key])
+        return result
+
+    @retry(raise_on_failure=True)
+    def get_value(self, key, primary=False):
+        return self.read(self.node_for(key), lambda client: client.get(key), primary)
+
+    @retry(raise_on_failure=True)
+    def incr(self, key):
+        return self.client_for(key).incr(key)
 
+    @retry(raise_on_failure=True)
+    def set_hash_field(self, key, field, value, nx=False):
+        if nx:
+            return self.client_for(key).hsetnx(key, field, value)
+        return self.client_for(key).hset(key, field, value)
+
+    @retry(raise_on_failure=True)
+    def get_hash_field(self, key, field):
+        return self.client_for(key).hget(key, field)
+
+    @retry(raise_on_failure=True)
+    def get_hash(self, key):
+        return self.read(self.node_for(key), lambda client: client.hgetall(key))
+
+    @retry(raise_on_failure=True)
+    def _get_many(self, node, keys, primary=False):
+        def command(client):
+            pipe = client.pipeline(transaction=False)
+            for key in keys:
+                pipe.smembers(key)
+            return dict(zip(keys, pipe.execute()))
+        return self.read(node, command, primary)
+
+    @retry(raise_on_failure=True)
+    def _get_value_many(self, node, keys, primary=False):
+        def command(client):
+            pipe = client.pipeline(transaction=False)
+            for key in keys:
+                pipe.get(key)
+            return dict(zip(keys, pipe.execute()))
+        return self.read(node, command, primary)
+
+    @retry(raise_on_failure=True)
+    def _union_many(self, node, items):
+        def command(client):
+            pipe = client.pipeline(transaction=False)
+            for _, keys in items:
+                pipe.sunion(*keys)
+            return dict(zip([name for name, _ in items], pipe.execute()))
+        return self.read(node, command)
+
+    @retry(raise_on_failure=True)
+    def _count_many(self, node, keys, source):
+        script = self.get_script(source)
+
+        def command(client):
+            pipe = client.pipeline(transaction=False)
+            for start in range(0, len(keys), REDIS_SCRIPT_CHUNK_SIZE):
+                script(keys=keys[start:start + REDIS_SCRIPT_CHUNK_SIZE], client=pipe)
+            return pipe.execute()
+
+        counts = {}
+        for reply in self.read(node, command):
+            for member, count in zip(reply[::2], reply[1::2]):
+                counts[member] = counts.get(member, 0) + count
+        return counts
+
+    @retry(raise_on_failure=True)
+    def _set_many(self, node, items, expire_at=None):
+        pipe = self.primary(node).pipeline(transaction=False)
+        for key, values in items:
+            pipe.sadd(key, *values)
+            if expire_at and key in expire_at:
+                pipe.expireat(key, expire_at[key])
+        result = pipe.execute()
+        self.notify_writes(node, [key for key, _ in items])
+        return result
+
+    @retry(raise_on_failure=True)
+    def _set_value_many(self, node, items):
+        pipe = self.primary(node).pipeline(transaction=False)
+        for key, value in items:
+            pipe.set(key, value)
+        result = pipe.execute()
+        self.notify_writes(node, [key for key, _ in items])
+        return result
+
+    @retry(raise_on_failure=True)
+    def _merge_bits_many(self, node, items):
+        script = self.get_script(MERGE_BITS_SCRIPT)
+        pipe = self.primary(node).pipeline(transaction=False)
+        for start in range(0, len(items), REDIS_SCRIPT_CHUNK_SIZE):
+            chunk = items[start:start + REDIS_SCRIPT_CHUNK_SIZE]
+            script(keys=[key for key, _ in chunk], args=[value for _, value in chunk], client=pipe)
+        pipe.execute()
+        self.notify_writes(node, [key for key, _ in items])
+        return items
+
+    @retry(raise_on_failure=True)
+    def _incr_many(self, node, items, expire):
+        pipe = self.primary(node).pipeline(transaction=False)
+        for key, amount in items:
+            pipe.incrby(key, amount)
+            pipe.expire(key, expire)
+        return dict(zip([key for key, _ in items], pipe.execute()[::2]))
+
+    @retry(raise_on_failure=True)
+    def _cache_set_many(self, node, items, expire):
+        pipe = self.primary(node).pipeline(transaction=False)
+        for key, value in items:
+            pipe.set(key, value, ex=expire)
+        return pipe.execute()
+
+    @retry(raise_on_failure=True)
+    def _delete_matching(self, client, match):
+        deleted = 0
+        batch = []
+        for key in client.scan_iter(match=match, count=REDIS_REBALANCE_BATCH_SIZE):
+            batch.append(key)
+            if len(batch) >= REDIS_REBALANCE_BATCH_SIZE:
+                deleted += client.delete(*batch)
+                batch = []
+        if batch:
+            deleted += client.delete(*batch)
+        return deleted
+
+    def get_many(self, keys, deadline=None):
+        result = {}
+        for chunk in self.map_nodes(lambda node, keys: self._get_many(node, keys, deadline=deadline),
+                                    self.group_by_node(keys)):
+            result.update(chunk)
+        return result
+
+    def get_value_many(self, keys, deadline=None):
+        result = {}
+        for chunk in self.map_nodes(lambda node, keys: self._get_value_many(node, keys, deadline=deadline),
+                                    self.group_by_node(keys)):
+            result.update(chunk)
+        return result
+
+    def _read_partial(self, read, keys, deadline, **kwargs):
+        """
+        Runs read(node, keys, **kwargs) once for every REDIS_PARTIAL_CHUNK_SIZE keys of a shard, the chunks
+        run in parallel and a chunk that fails or runs out of time loses only its own keys:
+        returns ({key: value}, {key: 'timeout' | 'unavailable' | 'error'})
+        """
+        def fetch(node, keys):
+            try:
+                return read(node, keys, deadline=deadline, attempts=1, **kwargs), {}
+            except (DeadlineExceeded, redis.exceptions.TimeoutError):
+                return {}, dict.fromkeys(keys, 'timeout')
+            except redis.exceptions.ConnectionError:
+                return {}, dict.fromkeys(keys, 'unavailable')
+            except redis.exceptions.ResponseError:
+                # a key of the chunk holds a value of another type
+                return {}, dict.fromkeys(keys, 'error')
+
+        chunks = [(node, node_keys[start:start + REDIS_PARTIAL_CHUNK_SIZE])
+                  for node, node_keys in self.group_by_node(keys)
+                  for start in range(0, len(node_keys), REDIS_PARTIAL_CHUNK_SIZE)]
+        result, errors = {}, {}
+        for values, failed in self.map_nodes(fetch, chunks):
+            result.update(values)
+            errors.update(failed)
+        return result, errors
+
+    def get_many_partial(self, keys, deadline=None, primary=False):
+        return self._read_partial(self._get_many, keys, deadline, primary=primary)
+
+    def get_value_many_partial(self, keys, deadline=None, primary=False):
+        return self._read_partial(self._get_value_many, keys, deadline, primary=primary)
+
+    def union_many(self, mapping, deadline=None, partial=False):
+        """
+        Pipelined SUNION computed by Redis: {name: [key, ...]} -> {name: members}. The keys of
+        a name must share its hash tag to be on one node. With partial the names are read in chunks
+        of one attempt and ({name: members}, {name: error}) is returned, like get_many_partial does.
+        """
+        def read(node, names, **kwargs):
+            return self._union_many(node, [(name, mapping[name]) for name in names], **kwargs)
+
+        if partial:
+            return self._read_partial(read, list(mapping), deadline)
+        result = {}
+        for chunk in self.map_nodes(lambda node, names: read(node, names, deadline=deadline),
+                                    self.group_by_node(mapping)):
+            result.update(chunk)
+        return result
+
+    def count_members(self, keys, bitmap=False, deadline=None):
+        """
+        {member: number of keys containing it} counted by a Lua script inside Redis, so only
+        the distinct members travel over the network. Keys are sets, or bitmaps counted
+        by bit number with bitmap. Every node runs one pipeline of REDIS_SCRIPT_CHUNK_SIZE
+        keys long scripts, other clients' commands are served between the chunks.
+        """
+        source = COUNT_BITS_SCRIPT if bitmap else COUNT_MEMBERS_SCRIPT
+        counts = {}
+        for chunk in self.map_nodes(lambda node, keys: self._count_many(node, keys, source, deadline=deadline),
+                                    self.group_by_node(keys)):
+            for member, count in chunk.items():
+                counts[member] = counts.get(member, 0) + count
+        return counts
+
+    def incr_many(self, mapping, expire):
+        """Pipelined INCRBY of {key: amount} keeping the keys for expire seconds, returns the new values"""
+        groups = self.group_by_node(mapping)
+        groups = [(node, [(key, mapping[key]) for key in keys]) for node, keys in groups]
+        result = {}
+        for chunk in self.map_nodes(lambda node, items: self._incr_many(node, items, expire), groups):
+            result.update(chunk)
+        return result
+
+    def cache_set_many(self, mapping, expire):
+        """Pipelined SET of {key: value} expiring in expire seconds, returns the number of keys set"""
+        groups = self.group_by_node(mapping)
+        groups = [(node, [(key, mapping[key]) for key in keys]) for node, keys in groups]
+        return sum(sum(1 for ok in chunk if ok)
+                   for chunk in self.map_nodes(lambda node, items: self._cache_set_many(node, items, expire), groups))
+
+    def scan(self, match):
+        """Iterates keys matching the pattern on every primary"""
+        clients = [self.client] if self.ring is None else self.clients.values()
+        for client in clients:
+            for key in client.scan_iter(match=match, count=REDIS_REBALANCE_BATCH_SIZE):
+                yield key
+
+    def set_many(self, mapping, expire_at=None):
+        """Pipelined SADD of {key: [value, ...]}, expire_at is an optional {key: unix time} to expire keys at"""
+        groups = self.group_by_node(key for key, values in mapping.items() if values)
+        groups = [(node, [(key, mapping[key]) for key in keys]) for node, keys in groups]
+        return sum(len(chunk) for chunk in self.map_nodes(lambda node, items: self._set_many(node, items, expire_at),
+                                                          groups))
+
+    def set_value_many(self, mapping):
+        groups = self.group_by_node(mapping)
+        groups = [(node, [(key, mapping[key]) for key in keys]) for node, keys in groups]
+        return sum(len(chunk) for chunk in self.map_nodes(self._set_value_many, groups))
+
+    def merge_bits_many(self, mapping):
+        """
+        Bitwise OR of {key: bitmap} into the stored bitmaps by a Lua script, the bitmap
+        counterpart of set_many: rows of one key written by several batches are merged
+        whatever order they land in. Returns the number of keys written.
+        """
+        groups = self.group_by_node(mapping)
+        groups = [(node, [(key, mapping[key]) for key in keys]) for node, keys in groups]
+        return sum(len(chunk) for chunk in self.map_nodes(self._merge_bits_many, groups))
+
+    def delete_matching(self, match):
+        clients = [self.client] if self.ring is None else list(self.clients.values())
+        return sum(self._delete_matching(client, match) for client in clients)
+
+    @retry(raise_on_failure=True)
+    def _move_keys(self, source, keys):
+        pipe = source.pipeline(transaction=False)
+        for key in keys:
+            pipe.pttl(key)
+            pipe.dump(key)
+        dumped = pipe.execute()
+        moved = 0
+        for key, ttl, payload in zip(keys, dumped[::2], dumped[1::2]):
+            if payload is None:
+                continue
+            self.client_for(key).restore(key, max(ttl, 0), payload, replace=True)
+            source.delete(key)
+            moved += 1
+        return moved
 
+    def rebalance(self, match=None):
+        """
+        Moves keys that are stored on a node which no longer owns them, e.g. after a node was
+        added to the list. Consistent hashing keeps that to the keys of the taken over arcs.
+        """
+        if self.ring is None:
+            return 0
+        moved = 0
+        for name, client in self.clients.items():
+            batch = []
+            for key in client.scan_iter(match=match, count=REDIS_REBALANCE_BATCH_SIZE):
+                if self.ring.get_node(key) != name:
+                    batch.append(key)
+                if len(batch) >= REDIS_REBALANCE_BATCH_SIZE:
+                    moved += self._move_keys(client, batch)
+                    batch = []
+            if batch:
+                moved += self._move_keys(client, batch)
+        return moved
@@ -1,4 +1,12 @@
+import json
+import fnmatch
 import functools
+import logging
+import pickle
+import time
+import threading
+import unittest
+import http.client
 
 
 def cases(test_cases):
@@ -15,3 +23,237 @@ def cases(test_cases):
         return wrapper
     return decorator
 
+
+def merge_bits(client, keys, args):
+    """FakeRedis counterpart of store.MERGE_BITS_SCRIPT"""
+    for key, value in zip(keys, args):
+        current = client.get(key) or b''
+        size = max(len(current), len(value))
+        client.set(key, bytes(a | b for a, b in zip(current.ljust(size, b'\0'), value.ljust(size, b'\0'))))
+    return len(keys)
+
+
+class FakeScript(object):
+
+    def __init__(self, client, script):
+        self.client = client
+        self.script = script
+
+    def __call__(self, keys=(), args=(), client=None):
+        return (client or self.client).evalsha(self.script, len(keys), *(tuple(keys) + tuple(args)))
+
+
+class FakeRedis(object):
+    """
+    In-memory stand-in for redis.Redis with the subset of commands used by RedisStore.
+    Every instance is a separate "node", so several of them emulate a multi-instance setup.
+    Lua scripts run the Python function registered for their source in `scripts`.
+    """
+    # script source -> func(client, keys, args)
+    scripts = {}
+
+    def __init__(self, **params):
+        self.params = params
+        self.data = {}
+        self.expires = {}
+        self.calls = 0
+        self.published = []
+        self.subscribers = {}
+
+    def _key(self, key):
+        return key.encode('utf-8') if isinstance(key, str) else key
+
+    def _value(self, value):
+        if isinstance(value, bytes):
+            return value
+        return str(value).encode('utf-8')
+
+    def _alive(self, key):
+        key = self._key(key)
+        expire = self.expires.get(key)
+        if expire is not None and expire <= time.time():
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+        return key
+
+    def ping(self):
+        return True
+
+    def close(self):
+        pass
+
+    def flushdb(self):
+        self.data.clear()
+        self.expires.clear()
+
+    def sadd(self, key, *values):
+        self.calls += 1
+        members = self.data.setdefault(self._alive(key), set())
+        before = len(members)
+        members.update(self._value(v) for v in values)
+        return len(members) - before
+
+    def smembers(self, key):
+        self.calls += 1
+        return set(self.data.get(self._alive(key), set()))
+
+    def set(self, key, value, ex=None):
+        self.calls += 1
+        key = self._key(key)
+        self.data[key] = self._value(value)
+        self.expires.pop(key, None)
+        if ex:
+            self.expires[key] = time.time() + ex
+        return True
+
+    def get(self, key):
+        self.calls += 1
+        return self.data.get(self._alive(key))
+
+    def incr(self, key):
+        return self.incrby(key, 1)
+
+    def incrby(self, key, amount=1):
+        key = self._alive(key)
+        self.data[key] = self._value(int(self.data.get(key, 0)) + amount)
+        return int(self.data[key])
+
+    def expire(self, key, seconds):
+        key = self._alive(key)
+        if key not in self.data:
+            return False
+        self.expires[key] = time.time() + seconds
+        return True
+
+    def expireat(self, key, when):
+        return self.expire(key, when - time.time())
+
+    def sunion(self, *keys):
+        self.calls += 1
+        members = set()
+        for key in keys:
+            members.update(self.data.get(self._alive(key), set()))
+        return members
+
+    def register_script(self, script):
+        return FakeScript(self, script)
+
+    def evalsha(self, script, numkeys, *args):
+        self.calls += 1
+        return self.scripts[script](self, args[:numkeys], args[numkeys:])
+
+    def hset(self, key, field, value):
+        fields = self.data.setdefault(self._alive(key), {})
+        created = self._key(str(field)) not in fields
+        fields[self._key(str(field))] = self._value(value)
+        return int(created)
+
+    def hsetnx(self, key, field, value):
+        fields = self.data.setdefault(self._alive(key), {})
+        if self._key(str(field)) in fields:
+            return 0
+        return self.hset(key, field, value)
+
+    def hget(self, key, field):
+        return self.data.get(self._alive(key), {}).get(self._key(str(field)))
+
+    def hgetall(self, key):
+        self.calls += 1
+        return dict(self.data.get(self._alive(key), {}))
+
+    def delete(self, *keys):
+        return sum(self.data.pop(self._alive(key), None) is not None for key in keys)
+
+    def pttl(self, key):
+        key = self._alive(key)
+        if key not in self.data:
+            return -2
+        if key not in self.expires:
+            return -1
+        return int((self.expires[key] - time.time()) * 1000)
+
+    def dump(self, key):
+        key = self._alive(key)
+        return pickle.dumps(self.data[key]) if key in self.data else None
+
+    def restore(self, key, ttl, value, replace=False):
+        key = self._key(key)
+        self.data[key] = pickle.loads(value)
+        if ttl:
+            self.expires[key] = time.time() + ttl / 1000.0
+        return True
+
+    def scan_iter(self, match=None, count=None):
+        for key in list(self.data):
+            if self._alive(key) in self.data and (match is None or fnmatch.fnmatchcase(key.decode('utf-8'), match)):
+                yield key
+
+    def publish(self, channel, message):
+        self.published.append((channel, message))
+        handlers = self.subscribers.get(channel, [])
+        for handler in handlers:
+            handler({'type': 'message', 'channel': self._key(channel), 'data': self._value(message)})
+        return len(handlers)
+
+    def pubsub(self, ignore_subscribe_messages=False):
+        return FakePubSub(self)
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+
+class FakePubSub(object):
+    """Delivers the messages synchronously from publish, run_in_thread starts nothing"""
+
+    def __init__(self, client):
+        self.client = client
+
+    def subscribe(self, **handlers):
+        for channel, handler in handlers.items():
+            self.client.subscribers.setdefault(channel, []).append(handler)
+
+    def run_in_thread(self, sleep_time=0, daemon=False):
+        return None
+
+
+class FakePipeline(object):
+
+    def __init__(self, client):
+        self.client = client
+        self.commands = []
+
+    def __getattr__(self, name):
+        def command(*args, **kwargs):
+            self.commands.append((name, args, kwargs))
+            return self
+        return command
+
+    def execute(self):
+        commands, self.commands = self.commands, []
+        return [getattr(self.client, name)(*args, **kwargs) for name, args, kwargs in commands]
+
+
+class ServerTestCase(unittest.TestCase):
+    """Runs a ScoringHTTPServer with MainHTTPHandler on a free port for every test"""
+
+    def setUp(self):
+        from api import MainHTTPHandler, ScoringHTTPServer
+        logging.disable(logging.CRITICAL)
+        self.server = ScoringHTTPServer(('localhost', 0), MainHTTPHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        logging.disable(logging.NOTSET)
+
+    def request(self, method, path, body=None, headers=None):
+        """(status, response headers, raw response body), a dict body is sent as JSON"""
+        connection = http.client.HTTPConnection('localhost', self.server.server_address[1], timeout=5)
+        if isinstance(body, dict):
+            body = json.dumps(body)
+        connection.request(method, path, body=body, headers=headers or {})
+        response = connection.getresponse()
+        result = response.status, response.headers, response.read()
+        connection.close()
+        return result
@@ -96,3 +96,13 @@ class TestRedisStore(unittest.TestCase):
 
         with self.assertRaises(ConnectionError):
             self.store.get('foo')
+
+    def test_storage_count_members(self):
+        self.store.set('i#1', 'books', 'cars')
+        self.store.set('i#2', 'books')
+        self.assertEqual({b'books': 2, b'cars': 1}, self.store.count_members(['i#1', 'i#2', 'i#3']))
+
+    def test_storage_count_bits(self):
+        self.store.set_value('ib#1', bytes([0b101, 0b1]))
+        self.store.set_value('ib#2', bytes([0b1]))
+        self.assertEqual({0: 2, 2: 1, 8: 1}, self.store.count_members(['ib#1', 'ib#2'], bitmap=True))
@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+"""
+Allocation, memory and CPU budgets of the request handlers. Every handler runs over a fixed fixture
+against RedisStore on FakeRedis, so the store costs nothing but Python. Budgets live in
+budgets.json next to this file: after an intentional change rerun with --update and commit
+the new budgets with a bumped version.
+
+    python -m unittest discover tests.perf -v
+    python -m tests.perf.test_budgets --update
+"""
+
+import os
+import sys
+import json
+import time
+import hashlib
+import logging
+import unittest
+import statistics
+import tracemalloc
+from unittest.mock import patch
+from tests.helpers import FakeRedis
+from store import RedisStore
+import scoring
+import api
+
+BUDGETS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'budgets.json')
+# measured values are multiplied by the headroom when budgets are updated, CPU time is the noisiest
+HEADROOM = {'allocated_blocks': 1.2, 'peak_bytes': 1.5, 'retained_blocks': 1.0, 'cpu_ratio': 2.0}
+RETAINED_BLOCKS_SLACK = 2
+WARMUP_RUNS = 20
+ALLOCATION_RUNS = 20
+CPU_RUNS = 201
+CLIENTS = 100
+
+
+def calibrate():
+    """Fixed pure Python work, handler CPU time is measured in its units so budgets hold across machines"""
+    total = 0
+    for i in range(20000):
+        total += i * i % 7
+    return total
+
+
+def method_request(method, arguments):
+    return {"account": "horns&hoofs", "login": "h&f", "method": method, "arguments": arguments,
+            "token": hashlib.sha512(("horns&hoofs" + "h&f" + api.SALT).encode('utf-8')).hexdigest()}
+
+
+ONLINE_SCORE = method_request("online_score", {
+    "phone": "79175002040", "email": "stupnikov@otus.ru", "first_name": "Stanislav", "last_name": "Stupnikov",
+    "birthday": "01.01.1990", "gender": 1,
+})
+CLIENTS_INTERESTS = method_request("clients_interests", {"client_ids": list(range(CLIENTS)), "date": "20.07.2017"})
+
+
+def make_store():
+    with patch('redis.Redis', FakeRedis):
+        store = RedisStore()
+        store.connect()
+    for cid in range(CLIENTS):
+        scoring.set_interests(store, cid, ['books', 'cars'])
+    return store
+
+
+def make_calls(store):
+    """handler name -> call without arguments running it over its fixture"""
+    def method_handler():
+        return api.method_handler({"body": ONLINE_SCORE, "headers": {}}, {}, store)
+
+    def online_score_handler():
+        return api.online_score_handler(api.MethodRequest(**ONLINE_SCORE), {}, store)
+
+    def clients_interest_handler():
+        return api.clients_interest_handler(api.MethodRequest(**CLIENTS_INTERESTS), {}, store)
+
+    return {
+        'method_handler': method_handler,
+        'online_score_handler': online_score_handler,
+        'clients_interest_handler': clients_interest_handler,
+    }
+
+
+def median_time(call, runs):
+    times = []
+    for _ in range(runs):
+        started = time.process_time()
+        call()
+        times.append(time.process_time() - started)
+    return statistics.median(times)
+
+
+def measure_cpu(call, runs=CPU_RUNS):
+    """Median CPU time of a call in median calibrate() times, a small batch of calls per sample"""
+    batch = 10
+
+    def calls():
+        for _ in range(batch):
+            call()
+
+    return median_time(calls, runs // batch + 1) / median_time(calibrate, runs // batch + 1) / batch
+
+
+def count_allocations(call, runs=3):
+    """
+    Blocks allocated by a single call: the allocated block count is sampled on every function
+    call and return inside it and its increases are summed, so blocks freed before the next
+    sample are missed but every block that outlives a function boundary counts once
+    """
+    blocks = sys.getallocatedblocks
+    counts = []
+    for _ in range(runs):
+        # [blocks at the last sample, blocks allocated since the call started]
+        state = [0, 0]
+
+        def sample(frame, event, arg):
+            current = blocks()
+            if current > state[0]:
+                state[1] += current - state[0]
+            state[0] = current
+
+        state[0] = blocks()
+        sys.setprofile(sample)
+        try:
+            call()
+        finally:
+            sys.setprofile(None)
+        sample(None, 'return', None)
+        counts.append(state[1])
+    return min(counts)
+
+
+def measure_memory(call, runs=ALLOCATION_RUNS):
+    """(peak traced bytes of a single call, blocks left allocated per call)"""
+    tracemalloc.start()
+    try:
+        peaks = []
+        for _ in range(3):
+            tracemalloc.reset_peak()
+            before, _ = tracemalloc.get_traced_memory()
+            call()
+            peaks.append(tracemalloc.get_traced_memory()[1] - before)
+        snapshot = tracemalloc.take_snapshot()
+        for _ in range(runs):
+            call()
+        retained = sum(stat.count_diff for stat in tracemalloc.take_snapshot().compare_to(snapshot, 'filename'))
+    finally:
+        tracemalloc.stop()
+    return min(peaks), max(retained, 0) / float(runs)
+
+
+def measure(call):
+    for _ in range(WARMUP_RUNS):
+        call()
+    peak_bytes, retained_blocks = measure_memory(call)
+    return {'allocated_blocks': count_allocations(call), 'peak_bytes': peak_bytes,
+            'retained_blocks': retained_blocks, 'cpu_ratio': measure_cpu(call)}
+
+
+def load_budgets(path=BUDGETS_PATH):
+    with open(path) as f:
+        return json.load(f)
+
+
+def update_budgets(path=BUDGETS_PATH):
+    budgets = load_budgets(path)
+    store = make_store()
+    handlers = {}
+    for name, call in sorted(make_calls(store).items()):
+        measured = measure(call)
+        handlers[name] = {
+            'allocated_blocks': int(measured['allocated_blocks'] * HEADROOM['allocated_blocks']),
+            'peak_bytes': int(measured['peak_bytes'] * HEADROOM['peak_bytes']),
+            'retained_blocks': round(measured['retained_blocks'] * HEADROOM['retained_blocks'], 2),
+            'cpu_ratio': round(measured['cpu_ratio'] * HEADROOM['cpu_ratio'], 3),
+        }
+    budgets = {'version': budgets.get('version', 0) + 1, 'handlers': handlers}
+    with open(path, 'w') as f:
+        json.dump(budgets, f, indent=2, sort_keys=True)
+        f.write('\n')
+    return budgets
+
+
+class TestHandlerBudgets(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.budgets = load_budgets()
+        cls.store = make_store()
+        cls.calls = make_calls(cls.store)
+
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+    def check(self, name):
+        budget = self.budgets['handlers'][name]
+        measured = measure(self.calls[name])
+        hint = 'budgets.json version %s, rerun python -m tests.perf.test_budgets --update if it is intended' \
+               % self.budgets['version']
+        self.assertLessEqual(measured['allocated_blocks'], budget['allocated_blocks'],
+                             '%s allocates %d blocks per call over budget %d, %s'
+                             % (name, measured['allocated_blocks'], budget['allocated_blocks'], hint))
+        self.assertLessEqual(measured['peak_bytes'], budget['peak_bytes'],
+                             '%s peak memory %d B over budget %d B, %s'
+                             % (name, measured['peak_bytes'], budget['peak_bytes'], hint))
+        # a handler must not keep memory across calls, a block or two is interpreter noise
+        self.assertLessEqual(measured['retained_blocks'], budget['retained_blocks'] + RETAINED_BLOCKS_SLACK,
+                             '%s keeps %.2f blocks per call, budget %.2f, %s'
+                             % (name, measured['retained_blocks'], budget['retained_blocks'], hint))
+        self.assertLessEqual(measured['cpu_ratio'], budget['cpu_ratio'],
+                             '%s takes %.3f calibration loops, budget %.3f, %s'
+                             % (name, measured['cpu_ratio'], budget['cpu_ratio'], hint))
+
+    def test_budgets_cover_handlers(self):
+        self.assertEqual(set(self.calls), set(self.budgets['handlers']))
+
+    def test_method_handler(self):
+        self.check('method_handler')
+
+    def test_online_score_handler(self):
+        self.check('online_score_handler')
+
+    def test_clients_interest_handler(self):
+        self.check('clients_interest_handler')
+
+
+if __name__ == '__main__':
+    if '--update' in sys.argv:
+        logging.disable(logging.CRITICAL)
+        print(json.dumps(update_budgets(), indent=2, sort_keys=True))
+    else:
+        unittest.main()
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+
+import json
+import gzip
+import time
+import unittest
+from unittest.mock import Mock, patch
+from tests.helpers import ServerTestCase, cases
+from admission import AdaptiveLimiter, is_exempt
+from buffers import read_into
+from api import MainHTTPHandler, SERVICE_UNAVAILABLE, FORBIDDEN, OK
+
+USER_REQUEST = {"account": "horns&hoofs", "login": "h&f", "method": "online_score", "token": "", "arguments": {}}
+ADMIN_REQUEST = {"login": "admin", "method": "online_score", "token": "", "arguments": {}}
+
+
+class TestAdaptiveLimiter(unittest.TestCase):
+
+    def test_limiter_rejects_above_limit(self):
+        limiter = AdaptiveLimiter(initial_limit=2)
+        self.assertTrue(limiter.try_acquire())
+        self.assertTrue(limiter.try_acquire())
+        self.assertFalse(limiter.try_acquire())
+        limiter.release(0.01)
+        self.assertTrue(limiter.try_acquire())
+        self.assertEqual({'limit': 2, 'inflight': 2, 'accepted': 3, 'rejected': 1, 'dropped': 0}, limiter.stats())
+
+    def test_limiter_additive_increase(self):
+        limiter = AdaptiveLimiter(initial_limit=4, target_latency=0.1)
+        for _ in range(20):
+            limiter.try_acquire()
+            limiter.release(0.01)
+        self.assertGreaterEqual(limiter.limit, 7)
+
+    def test_limiter_multiplicative_decrease(self):
+        limiter = AdaptiveLimiter(initial_limit=100, target_latency=0)
+        for _ in range(5):
+            limiter.try_acquire()
+            limiter.release(1)
+        self.assertLess(limiter.limit, 100 * 0.9 ** 4 + 1)
+
+    def test_limiter_bounds(self):
+        limiter = AdaptiveLimiter(initial_limit=2, min_limit=1, max_limit=3, target_latency=0)
+        for _ in range(100):
+            limiter.try_acquire()
+            limiter.release(1)
+        self.assertEqual(1, int(limiter.limit))
+        limiter.target_latency = 10
+        for _ in range(100):
+            limiter.try_acquire()
+            limiter.release(0)
+        self.assertEqual(3, int(limiter.limit))
+
+    def test_limiter_rejects_queued(self):
+        limiter = AdaptiveLimiter(target_queue_delay=0.05)
+        self.assertFalse(limiter.try_acquire(queue_delay=0.5))
+        self.assertEqual(0, limiter.inflight)
+
+    def test_limiter_drops_queued_in_scheduler(self):
+        limiter = AdaptiveLimiter(initial_limit=10, target_queue_delay=0.05)
+        self.assertTrue(limiter.check_queue_delay(0.01))
+        self.assertFalse(limiter.check_queue_delay(0.5))
+        self.assertLess(limiter.limit, 10)
+        self.assertEqual(1, limiter.stats()['dropped'])
+
+    @cases([
+        ['metrics', None, True],
+        ['method', None, False],
+        ['method', b'{"login": "admin", "method": "online_score"}', True],
+        ['method', b'{"login":"admin"}', True],
+        ['method', b'{"arguments": {"phone": "7"}, "login" : "admin"}', True],
+        ['method', b'{"login": "h&f", "account": "admin"}', False],
+        ['method', b'{"login": "h&f", "arguments": {"login": "admin"}}', False],
+        ['method', b'{"method": "login", "token": "\\"login\\": \\"admin\\""}', False],
+        ['method', b'["login", "admin"]', False],
+        ['method', b'{"arguments": {"x": "%s"}, "login": "admin"}' % (b'y' * 1000), False],
+    ])
+    def test_is_exempt(self, params):
+        path, body, expected = params
+        self.assertEqual(expected, is_exempt(path, memoryview(body) if body is not None else None))
+
+
+class TestAdmissionServer(ServerTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.store = Mock()
+
+    def test_overloaded_request_is_shed(self):
+        limiter = Mock(try_acquire=Mock(return_value=False))
+        with patch.object(MainHTTPHandler, 'admission', limiter), patch.object(MainHTTPHandler, 'store', self.store):
+            code, headers, body = self.request('POST', '/method/', USER_REQUEST)
+        self.assertEqual(SERVICE_UNAVAILABLE, code)
+        self.assertEqual('1', headers['Retry-After'])
+        self.assertEqual(SERVICE_UNAVAILABLE, json.loads(body)['code'])
+        self.assertEqual([], self.store.method_calls)
+
+    def test_admitted_request_is_released(self):
+        limiter = AdaptiveLimiter()
+        with patch.object(MainHTTPHandler, 'admission', limiter):
+            code, _, _ = self.request('POST', '/method/', USER_REQUEST)
+        self.assertEqual(FORBIDDEN, code)
+        self.assertEqual(1, limiter.accepted)
+        self.assertEqual(0, limiter.inflight)
+
+    def test_admin_request_is_not_shed(self):
+        limiter = Mock(try_acquire=Mock(return_value=False))
+        with patch.object(MainHTTPHandler, 'admission', limiter):
+            code, _, _ = self.request('POST', '/method/', ADMIN_REQUEST)
+        self.assertEqual(FORBIDDEN, code)
+        limiter.try_acquire.assert_not_called()
+
+    def test_shed_request_is_not_decoded(self):
+        limiter = Mock(try_acquire=Mock(return_value=False))
+        body = gzip.compress(json.dumps(ADMIN_REQUEST).encode('utf-8'))
+        with patch.object(MainHTTPHandler, 'admission', limiter), patch('api.decompress_body') as decompress, \
+                patch('formats.decode') as decode:
+            code, _, _ = self.request('POST', '/method/', body, {'Content-Encoding': 'gzip'})
+        # only plain JSON bodies are peeked into for the admin login
+        self.assertEqual(SERVICE_UNAVAILABLE, code)
+        decompress.assert_not_called()
+        decode.assert_not_called()
+
+    def test_admin_login_in_arguments_is_shed(self):
+        limiter = Mock(try_acquire=Mock(return_value=False))
+        request = dict(USER_REQUEST, arguments={"login": "admin"})
+        with patch.object(MainHTTPHandler, 'admission', limiter):
+            code, _, _ = self.request('POST', '/method/', request)
+        self.assertEqual(SERVICE_UNAVAILABLE, code)
+
+    def test_body_upload_is_not_queue_delay_nor_latency(self):
+        limiter = Mock(try_acquire=Mock(return_value=True))
+
+        def slow_read(rfile, buffer, length):
+            time.sleep(0.3)
+            return read_into(rfile, buffer, length)
+
+        with patch.object(MainHTTPHandler, 'admission', limiter), patch('api.read_into', slow_read):
+            self.request('POST', '/method/', USER_REQUEST)
+        self.assertLess(limiter.try_acquire.call_args[0][0], 0.2)
+        self.assertLess(limiter.release.call_args[0][0], 0.2)
+
+    def test_request_queued_in_scheduler_is_shed(self):
+        limiter = AdaptiveLimiter(target_queue_delay=0.05)
+        scheduler = Mock(run=lambda account, cost, func: time.sleep(0.2) or func())
+        with patch.object(MainHTTPHandler, 'admission', limiter), \
+                patch.object(MainHTTPHandler, 'scheduler', scheduler), \
+                patch.object(MainHTTPHandler, 'store', self.store):
+            code, headers, _ = self.request('POST', '/method/', USER_REQUEST)
+        self.assertEqual(SERVICE_UNAVAILABLE, code)
+        self.assertEqual('1', headers['Retry-After'])
+        self.assertEqual(1, limiter.stats()['dropped'])
+        self.assertEqual(0, limiter.inflight)
+        self.assertEqual([], self.store.method_calls)
+
+    def test_metrics(self):
+        limiter = AdaptiveLimiter()
+        with patch.object(MainHTTPHandler, 'metrics', {'admission': limiter.stats}):
+            code, _, body = self.request('GET', '/metrics')
+        self.assertEqual(OK, code)
+        self.assertEqual(limiter.stats(), json.loads(body)['response']['admission'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -22,4 +22,10 @@ class TestCheckAuth(unittest.TestCase):
     ])
     def test_check_auth_is_false(self, values):
         request = MethodRequest(**values)
-        self.assertFalse(check_auth(request))
\ No newline at end of file
+        self.assertFalse(check_auth(request))
+
+    def test_check_auth_without_account(self):
+        # a user request must name its account, a token of the login alone does not authenticate it
+        request = MethodRequest(login="bar", token=hashlib.sha512(("bar" + SALT).encode('utf-8')).hexdigest())
+        with self.assertRaises(TypeError):
+            check_auth(request)
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+
+import io
+import json
+import time
+import unittest
+import logging
+import tracemalloc
+from unittest.mock import patch
+from buffers import BufferPool, read_into
+from replay import parse_line
+import api
+
+
+class ChunkedReader(object):
+    """rfile handing out at most chunk bytes per readinto, like a socket"""
+
+    def __init__(self, data, chunk):
+        self.data = io.BytesIO(data)
+        self.chunk = chunk
+
+    def readinto(self, view):
+        return self.data.readinto(view[:self.chunk])
+
+
+class TestBufferPool(unittest.TestCase):
+
+    def test_buffer_is_reused(self):
+        pool = BufferPool(initial_size=16)
+        buffer = pool.acquire(10)
+        self.assertEqual(16, len(buffer))
+        pool.release(buffer)
+        self.assertIs(buffer, pool.acquire(16))
+        self.assertEqual({'free': 0, 'created': 1, 'reused': 1}, pool.stats())
+
+    def test_small_buffer_is_grown(self):
+        pool = BufferPool(initial_size=16)
+        pool.release(pool.acquire(16))
+        self.assertEqual(32, len(pool.acquire(17)))
+        self.assertEqual(100, len(pool.acquire(100)))
+
+    def test_pool_is_bounded(self):
+        pool = BufferPool(max_buffers=1, initial_size=16, max_size=64)
+        pool.release(pool.acquire(128))
+        self.assertEqual(0, pool.stats()['free'])
+        pool.release(bytearray(16))
+        pool.release(bytearray(16))
+        self.assertEqual(1, pool.stats()['free'])
+
+    def test_read_into(self):
+        buffer = bytearray(16)
+        view = read_into(ChunkedReader(b'0123456789', 3), buffer, 10)
+        self.assertEqual(b'0123456789', bytes(view))
+        view.release()
+        # the view is released, the buffer may be resized again
+        buffer.extend(b'x')
+
+    def test_read_into_truncated_body(self):
+        buffer = bytearray(16)
+        with self.assertRaises(EOFError):
+            read_into(ChunkedReader(b'0123', 3), buffer, 10)
+        buffer.extend(b'x')
+
+
+class TestRequestAllocations(unittest.TestCase):
+    # peak traced memory of a request, in request body sizes: the parsed request itself
+    # takes about two of them (the decoded text and the string in the parsed arguments)
+    BUDGET = 2.5
+
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        self.body = json.dumps({"account": "horns&hoofs", "login": api.ADMIN_LOGIN, "method": "online_score",
+                                "token": api.get_token("horns&hoofs", api.ADMIN_LOGIN),
+                                "arguments": {"first_name": "a" * 16384, "last_name": "b"}}).encode('utf-8')
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+    def post(self):
+        handler = api.MainHTTPHandler.__new__(api.MainHTTPHandler)
+        handler.headers = {'Content-Length': str(len(self.body))}
+        handler.rfile, handler.wfile = io.BytesIO(self.body), io.BytesIO()
+        handler.path, handler.command, handler.requestline = '/method/', 'POST', 'POST /method/ HTTP/1.1'
+        handler.request_version = 'HTTP/1.1'
+        handler.client_address = ('127.0.0.1', 0)
+        handler.accepted_at = time.monotonic()
+        handler.log_message = lambda *args: None
+        handler.do_POST()
+        return handler.wfile.getvalue()
+
+    def test_allocations_are_within_budget(self):
+        pool = BufferPool()
+        with patch.object(api.MainHTTPHandler, 'buffers', pool):
+            for _ in range(3):
+                self.assertTrue(self.post().endswith(b'{"response": {"score": 42}, "code": 200}'))
+            tracemalloc.start()
+            try:
+                peaks = []
+                for _ in range(5):
+                    tracemalloc.reset_peak()
+                    before, _ = tracemalloc.get_traced_memory()
+                    self.post()
+                    peaks.append(tracemalloc.get_traced_memory()[1] - before)
+            finally:
+                tracemalloc.stop()
+        self.assertEqual(1, pool.stats()['created'])
+        self.assertLess(min(peaks), self.BUDGET * len(self.body))
+
+    def test_body_is_logged_when_enabled(self):
+        logging.disable(logging.NOTSET)
+        with self.assertLogs(level=logging.INFO) as logs:
+            self.post()
+        self.assertEqual(('/method/', json.loads(self.body)), parse_line(logs.records[0].getMessage()))
+
+
+if __name__ == '__main__':
+    unittest.main()
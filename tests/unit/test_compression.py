@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+
+import gzip
+import json
+import unittest
+from unittest.mock import patch
+from tests.helpers import ServerTestCase, cases
+from compression import CompressionError, GzipCompressor, parse_accept_encoding, choose_encoding, compress, \
+    decompress_body
+from api import MainHTTPHandler, FORBIDDEN, OK, UNSUPPORTED_MEDIA_TYPE
+
+USER_REQUEST = {"account": "horns&hoofs", "login": "h&f", "method": "online_score", "token": "", "arguments": {}}
+
+
+class TestCompression(unittest.TestCase):
+
+    def test_parse_accept_encoding(self):
+        self.assertEqual({'gzip': 0.5, 'br': 1.0, 'deflate': 0.0},
+                         parse_accept_encoding('gzip;q=0.5, br ,deflate;q=x'))
+        self.assertEqual({}, parse_accept_encoding(None))
+
+    @cases([
+        (None, None),
+        ('', None),
+        ('identity', None),
+        ('gzip', 'gzip'),
+        ('GZIP, deflate', 'gzip'),
+        ('gzip;q=0', None),
+        ('*', 'gzip'),
+        ('*, gzip;q=0', None),
+    ])
+    def test_choose_encoding(self, header, expected):
+        with patch.dict('compression.COMPRESSORS', {'gzip': GzipCompressor}, clear=True):
+            self.assertEqual(expected, choose_encoding(header))
+
+    def test_compress_roundtrip(self):
+        payload = json.dumps({"response": {str(i): ["books", "travel"] for i in range(10000)}}).encode('utf-8')
+        compressed = compress(payload, 'gzip')
+        self.assertLess(len(compressed), len(payload) // 10)
+        self.assertEqual(payload, gzip.decompress(compressed))
+        self.assertEqual(payload, decompress_body(compressed, 'gzip'))
+
+    def test_decompress_identity(self):
+        self.assertEqual(b'{}', decompress_body(b'{}', None))
+        self.assertEqual(b'{}', decompress_body(b'{}', 'identity'))
+
+    @cases([
+        (b'not gzip', 'gzip'),
+        (gzip.compress(b'{}')[:-4], 'gzip'),
+        (b'{}', 'br'),
+    ])
+    def test_decompress_errors(self, data, encoding):
+        with self.assertRaises(CompressionError):
+            decompress_body(data, encoding)
+
+    def test_decompress_limit(self):
+        with self.assertRaises(CompressionError):
+            decompress_body(gzip.compress(b'0' * 100000), 'gzip', max_size=1000)
+
+
+class TestCompressionServer(ServerTestCase):
+
+    def test_large_response_is_compressed(self):
+        metrics = {'big': lambda: {'values': list(range(5000))}}
+        with patch.object(MainHTTPHandler, 'metrics', metrics):
+            code, headers, body = self.request('GET', '/metrics', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(OK, code)
+        self.assertEqual('gzip', headers['Content-Encoding'])
+        self.assertEqual(list(range(5000)), json.loads(gzip.decompress(body))['response']['big']['values'])
+
+    def test_response_is_not_compressed(self):
+        metrics = {'big': lambda: {'values': list(range(5000))}}
+        with patch.object(MainHTTPHandler, 'metrics', metrics):
+            _, headers, body = self.request('GET', '/metrics')
+        self.assertIsNone(headers['Content-Encoding'])
+        self.assertEqual(OK, json.loads(body)['code'])
+
+    def test_small_response_is_not_compressed(self):
+        code, headers, body = self.request('POST', '/method/', USER_REQUEST, headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(FORBIDDEN, code)
+        self.assertIsNone(headers['Content-Encoding'])
+        self.assertEqual(FORBIDDEN, json.loads(body)['code'])
+
+    def test_gzip_request_body(self):
+        code, _, _ = self.request('POST', '/method/', gzip.compress(json.dumps(USER_REQUEST).encode('utf-8')),
+                                  headers={'Content-Encoding': 'gzip'})
+        self.assertEqual(FORBIDDEN, code)
+
+    def test_unsupported_request_encoding(self):
+        code, _, body = self.request('POST', '/method/', json.dumps(USER_REQUEST),
+                                     headers={'Content-Encoding': 'compress'})
+        self.assertEqual(UNSUPPORTED_MEDIA_TYPE, code)
+        self.assertIn('compress', json.loads(body)['error'])
+
+
+if __name__ == '__main__':
+    unittest.main()
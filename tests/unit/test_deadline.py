@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+
+import time
+import hashlib
+import unittest
+import logging
+from unittest.mock import Mock, patch
+from redis.exceptions import ConnectionError, TimeoutError
+from tests.helpers import cases
+from deadline import Deadline, DeadlineExceeded, parse_timeout, bind_deadline, current_deadline
+from store import RedisStore, DeadlineConnection
+import api
+
+
+class TestDeadline(unittest.TestCase):
+
+    @cases([
+        (None, 10.0),
+        ('', 10.0),
+        ('abc', 10.0),
+        ('0', 10.0),
+        ('-1', 10.0),
+        ('nan', 10.0),
+        ('0.5', 0.5),
+        ('3600', 60.0),
+    ])
+    def test_parse_timeout(self, value, expected):
+        self.assertEqual(expected, parse_timeout(value, default=10.0, maximum=60.0))
+
+    def test_deadline(self):
+        deadline = Deadline(10)
+        self.assertFalse(deadline.expired())
+        self.assertGreater(deadline.remaining(), 9)
+        deadline.check()
+        expired = Deadline(1, started=time.monotonic() - 2)
+        self.assertTrue(expired.expired())
+        self.assertEqual(0.0, expired.remaining())
+        with self.assertRaises(DeadlineExceeded):
+            expired.check()
+
+    def test_bind_deadline(self):
+        outer, inner = Deadline(10), Deadline(1)
+        self.assertIsNone(current_deadline())
+        with bind_deadline(outer):
+            with bind_deadline(inner):
+                self.assertIs(inner, current_deadline())
+            self.assertIs(outer, current_deadline())
+        self.assertIsNone(current_deadline())
+
+    def test_connection_timeout(self):
+        connection = DeadlineConnection(socket_timeout=5)
+        connection._sock = Mock()
+        connection.apply_deadline()
+        connection._sock.settimeout.assert_called_with(5)
+        with bind_deadline(Deadline(0.5)):
+            connection.apply_deadline()
+        self.assertLessEqual(connection._sock.settimeout.call_args[0][0], 0.5)
+        with bind_deadline(Deadline(1, started=time.monotonic() - 2)):
+            connection.apply_deadline()
+        self.assertEqual(0.001, connection._sock.settimeout.call_args[0][0])
+
+
+class TestStoreDeadline(unittest.TestCase):
+
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        self.store = RedisStore()
+        self.store.client = Mock(smembers=Mock(side_effect=ConnectionError), get=Mock(side_effect=TimeoutError))
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+    @patch('store.REDIS_RETRY_DELAY', 0.2)
+    @patch('store.REDIS_RETRY_MAX_ATTEMPTS', 5)
+    def test_retry_stops_at_deadline(self):
+        started = time.monotonic()
+        with self.assertRaises(DeadlineExceeded):
+            self.store.get('foo', deadline=Deadline(0.3))
+        self.assertLess(time.monotonic() - started, 0.5)
+        self.assertEqual(2, self.store.client.smembers.call_count)
+
+    @patch('store.REDIS_RETRY_DELAY', 0)
+    def test_expired_deadline_is_not_attempted(self):
+        with self.assertRaises(DeadlineExceeded):
+            self.store.cache_get('foo', deadline=Deadline(1, started=time.monotonic() - 2))
+        self.store.client.get.assert_not_called()
+
+    @patch('store.REDIS_RETRY_DELAY', 0.5)
+    @patch('store.REDIS_RETRY_MAX_ATTEMPTS', 3)
+    def test_deadline_exceeded_is_not_swallowed(self):
+        with self.assertRaises(DeadlineExceeded):
+            self.store.cache_get('foo', deadline=Deadline(0.1))
+
+    def test_deadline_is_bound_during_the_call(self):
+        deadline = Deadline(10)
+        seen = []
+        self.store.client = Mock(smembers=Mock(side_effect=lambda key: seen.append(current_deadline()) or set()))
+        self.store.get('foo', deadline=deadline)
+        self.assertEqual([deadline], seen)
+        self.assertIsNone(current_deadline())
+
+
+class TestMethodHandlerDeadline(unittest.TestCase):
+
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        self.request = {"account": "horns&hoofs", "login": "h&f", "method": "online_score",
+                        "arguments": {"phone": "79175002040", "email": "stupnikov@otus.ru"},
+                        "token": hashlib.sha512(("horns&hoofs" + "h&f" + api.SALT).encode('utf-8')).hexdigest()}
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+    @patch('scoring.get_score', side_effect=DeadlineExceeded)
+    def test_deadline_exceeded_is_gateway_timeout(self, get_score):
+        deadline = Deadline(1)
+        response, code = api.method_handler({"body": self.request, "headers": {}}, {"deadline": deadline}, Mock())
+        self.assertEqual(api.GATEWAY_TIMEOUT, code)
+        self.assertIs(deadline, get_score.call_args[1]['deadline'])
+
+    @patch('scoring.get_score', return_value=3.0)
+    def test_expired_request_is_not_handled(self, get_score):
+        handler = api.MainHTTPHandler.__new__(api.MainHTTPHandler)
+        handler.headers = {}
+        context = {"deadline": Deadline(1, started=time.monotonic() - 2)}
+        response, code = handler.route("method", self.request, context)
+        self.assertEqual(api.GATEWAY_TIMEOUT, code)
+        get_score.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
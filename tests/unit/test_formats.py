@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+
+import json
+import types
+import unittest
+from unittest.mock import patch
+from tests.helpers import ServerTestCase, cases
+import formats
+from api import BAD_REQUEST, FORBIDDEN, INVALID_REQUEST, UNSUPPORTED_MEDIA_TYPE
+
+USER_REQUEST = {"account": "horns&hoofs", "login": "h&f", "method": "online_score", "token": "", "arguments": {}}
+INVALID_ARGUMENTS = {"account": "horns&hoofs", "login": "admin", "method": "clients_interests",
+                     "token": "", "arguments": {"client_ids": ["1"]}}
+
+
+class TestFormats(unittest.TestCase):
+
+    @cases([
+        (None, formats.JSON),
+        ('application/json; charset=utf-8', formats.JSON),
+        ('text/plain', formats.JSON),
+        ('application/x-msgpack', formats.MSGPACK),
+        ('Application/MsgPack', formats.MSGPACK),
+    ])
+    def test_request_format(self, content_type, expected):
+        with patch.object(formats, 'msgpack', object()):
+            self.assertEqual(expected, formats.request_format(content_type))
+
+    def test_request_format_unavailable(self):
+        with patch.object(formats, 'msgpack', None):
+            self.assertEqual(formats.JSON, formats.request_format('application/json'))
+            with self.assertRaises(formats.FormatError):
+                formats.request_format('application/msgpack')
+
+    @cases([
+        (None, formats.JSON, formats.JSON),
+        (None, formats.MSGPACK, formats.MSGPACK),
+        ('*/*', formats.MSGPACK, formats.MSGPACK),
+        ('application/json', formats.MSGPACK, formats.JSON),
+        ('application/msgpack, application/json', formats.JSON, formats.MSGPACK),
+        ('text/html, application/x-msgpack;q=0.9', formats.JSON, formats.MSGPACK),
+    ])
+    def test_response_format(self, accept, default, expected):
+        with patch.object(formats, 'msgpack', object()):
+            self.assertEqual(expected, formats.response_format(accept, default))
+
+    def test_response_format_unavailable(self):
+        with patch.object(formats, 'msgpack', None):
+            self.assertEqual(formats.JSON, formats.response_format('application/msgpack'))
+
+    def test_json_roundtrip(self):
+        self.assertEqual(USER_REQUEST, formats.decode(formats.encode(USER_REQUEST)))
+
+    @unittest.skipIf(formats.msgpack is None, 'msgpack is not installed')
+    def test_msgpack_roundtrip(self):
+        obj = {"response": {"1": ["books"], "2": []}, "code": 200}
+        self.assertEqual(obj, formats.decode(formats.encode(obj, formats.MSGPACK), formats.MSGPACK))
+
+    @cases([
+        [(1, 'books')],
+        [('login', 'h&f'), (b'method', 'online_score')],
+        [('login', 'h&f'), ((1, 2), 'online_score')],
+    ])
+    def test_msgpack_non_str_keys(self, pairs):
+        with patch.object(formats, 'msgpack', fake_msgpack(pairs)):
+            with self.assertRaises(ValueError):
+                formats.decode(b'', formats.MSGPACK)
+
+    def test_msgpack_str_keys(self):
+        with patch.object(formats, 'msgpack', fake_msgpack([('login', 'h&f')])):
+            self.assertEqual({'login': 'h&f'}, formats.decode(b'', formats.MSGPACK))
+
+
+def fake_msgpack(pairs):
+    """msgpack module stand-in whose unpackb builds every map from the given pairs"""
+    def unpackb(data, raw=True, object_pairs_hook=None, **kwargs):
+        return object_pairs_hook(pairs) if object_pairs_hook is not None else dict(pairs)
+
+    return types.SimpleNamespace(unpackb=unpackb, packb=lambda obj, **kwargs: json.dumps(obj).encode('utf-8'))
+
+
+class TestFormatsServer(ServerTestCase):
+
+    def test_json_is_default(self):
+        code, headers, body = self.request('POST', '/method/', USER_REQUEST)
+        self.assertEqual(FORBIDDEN, code)
+        self.assertEqual(formats.JSON, headers['Content-Type'])
+        self.assertEqual(FORBIDDEN, json.loads(body)['code'])
+
+    @unittest.skipIf(formats.msgpack is not None, 'msgpack is installed')
+    def test_msgpack_unavailable(self):
+        code, headers, body = self.request('POST', '/method/', b'\x80', {'Content-Type': 'application/msgpack'})
+        self.assertEqual(UNSUPPORTED_MEDIA_TYPE, code)
+        self.assertEqual(formats.JSON, headers['Content-Type'])
+
+    @unittest.skipIf(formats.msgpack is None, 'msgpack is not installed')
+    def test_msgpack_request(self):
+        code, headers, body = self.request('POST', '/method/', formats.encode(USER_REQUEST, formats.MSGPACK),
+                                           {'Content-Type': 'application/msgpack'})
+        self.assertEqual(FORBIDDEN, code)
+        self.assertEqual(formats.MSGPACK, headers['Content-Type'])
+        self.assertEqual(FORBIDDEN, formats.decode(body, formats.MSGPACK)['code'])
+
+    @unittest.skipIf(formats.msgpack is None, 'msgpack is not installed')
+    def test_msgpack_request_is_validated(self):
+        with patch('api.check_auth', return_value=True):
+            code, _, body = self.request('POST', '/method/', formats.encode(INVALID_ARGUMENTS, formats.MSGPACK),
+                                         {'Content-Type': 'application/msgpack', 'Accept': 'application/json'})
+        self.assertEqual(INVALID_REQUEST, code)
+        self.assertEqual(INVALID_REQUEST, json.loads(body)['code'])
+
+    def test_msgpack_non_str_keys_are_bad_request(self):
+        pairs = [('login', 'h&f'), ('method', 'online_score'), (1, 'x')]
+        with patch.object(formats, 'msgpack', fake_msgpack(pairs)):
+            code, _, body = self.request('POST', '/method/', b'\x80',
+                                         {'Content-Type': 'application/msgpack', 'Accept': 'application/json'})
+        self.assertEqual(BAD_REQUEST, code)
+        self.assertEqual(BAD_REQUEST, json.loads(body)['code'])
+
+
+if __name__ == '__main__':
+    unittest.main()
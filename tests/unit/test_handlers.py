@@ -4,7 +4,7 @@ import unittest
 from unittest.mock import Mock, patch
 import datetime
 from tests.helpers import cases
-from api import MethodRequest, online_score_handler, clients_interest_handler, ADMIN_LOGIN
+from api import MethodRequest, online_score_handler, clients_interest_handler, ADMIN_LOGIN, OK, PARTIAL_CONTENT
 
 
 class TestOnlineScoreHandler(unittest.TestCase):
@@ -62,6 +62,24 @@ class TestClientsInterestHandler(unittest.TestCase):
             arguments['client_ids']
         )
 
+    @patch('scoring.get_interests_partial', return_value=({1: ['foo']}, {2: 'timeout'}))
+    def test_clients_interest_handler_partial(self, mock_func):
+        ctx = {}
+        arguments = {'client_ids': [1, 2], 'partial': True}
+        request = MethodRequest(account='', login='login', token='', method='foobar', arguments=arguments)
+        response = clients_interest_handler(request=request, ctx=ctx, store=Mock())
+        self.assertEqual(PARTIAL_CONTENT, response.code)
+        self.assertEqual({'interests': {1: ['foo']}, 'errors': {2: 'timeout'}}, response.response)
+        self.assertEqual(1, ctx['nerrors'])
+
+    @patch('scoring.get_interests_partial', return_value=({1: ['foo'], 2: []}, {}))
+    def test_clients_interest_handler_partial_complete(self, mock_func):
+        arguments = {'client_ids': [1, 2], 'partial': True}
+        request = MethodRequest(account='', login='login', token='', method='foobar', arguments=arguments)
+        response = clients_interest_handler(request=request, ctx={}, store=Mock())
+        self.assertEqual(OK, response.code)
+        self.assertEqual({}, response.response['errors'])
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+
+import json
+import unittest
+import threading
+import logging
+from unittest.mock import Mock, patch
+from redis.exceptions import ConnectionError
+from tests.helpers import FakeRedis, ServerTestCase
+from health import HealthCheck
+from store import RedisStore
+import api
+
+
+class TestHealthCheck(unittest.TestCase):
+
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+    def test_ping_is_cached(self):
+        store = Mock()
+        health = HealthCheck(store, ttl=60)
+        self.assertEqual((True, None), health.check())
+        self.assertEqual((True, None), health.check())
+        self.assertEqual(1, store.ping.call_count)
+
+    def test_failed_ping(self):
+        store = Mock(ping=Mock(side_effect=ConnectionError('refused')))
+        health = HealthCheck(store, ttl=0)
+        health.warm.set()
+        self.assertEqual((False, {'warm': True, 'store': 'refused'}), health.ready())
+        store.ping.side_effect = None
+        self.assertEqual((True, {'warm': True, 'store': 'ok'}), health.ready())
+
+    def test_concurrent_probe_gets_previous_result(self):
+        started, release = threading.Event(), threading.Event()
+        store = Mock(ping=Mock(side_effect=lambda: started.set() or release.wait(5)))
+        health = HealthCheck(store, ttl=0)
+        probe = threading.Thread(target=health.check)
+        probe.start()
+        started.wait(5)
+        self.assertEqual((False, None), health.check())
+        release.set()
+        probe.join(5)
+        self.assertEqual(1, store.ping.call_count)
+
+    def test_ready_after_warm_up(self):
+        store = Mock(open_connections=Mock(return_value=4))
+        health = HealthCheck(store)
+        self.assertFalse(health.ready()[0])
+        request = Mock()
+        health.warm_up(request, requests=3, connections=4)
+        store.open_connections.assert_called_once_with(4)
+        self.assertEqual(3, request.call_count)
+        self.assertTrue(health.ready()[0])
+
+    def test_failed_warm_up_still_gets_ready(self):
+        health = HealthCheck(Mock())
+        health.warm_up(Mock(side_effect=RuntimeError('boom')), requests=1)
+        self.assertTrue(health.ready()[0])
+
+    @patch('redis.Redis', FakeRedis)
+    def test_warm_up_request(self):
+        store = RedisStore()
+        store.connect()
+        self.assertEqual(api.OK, api.warm_up_request(store, 1)[1])
+        self.assertEqual(1, len(store.client.data))
+
+
+class TestHealthServer(ServerTestCase):
+
+    def test_live(self):
+        health = HealthCheck(Mock(ping=Mock(side_effect=ConnectionError)))
+        with patch.object(api.MainHTTPHandler, 'health', health):
+            code, _, body = self.request('GET', '/health/live')
+        self.assertEqual(api.OK, code)
+        self.assertEqual({'live': True}, json.loads(body)['response'])
+
+    def test_ready(self):
+        store = Mock()
+        health = HealthCheck(store, ttl=60)
+        with patch.object(api.MainHTTPHandler, 'health', health):
+            code, _, body = self.request('GET', '/health/ready')
+            self.assertEqual(api.SERVICE_UNAVAILABLE, code)
+            self.assertFalse(json.loads(body)['error']['ready'])
+            health.warm.set()
+            for _ in range(3):
+                code, _, body = self.request('GET', '/health/ready')
+        self.assertEqual(api.OK, code)
+        self.assertTrue(json.loads(body)['response']['ready'])
+        self.assertEqual(1, store.ping.call_count)
+
+
+if __name__ == '__main__':
+    unittest.main()
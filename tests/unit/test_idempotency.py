@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+
+import time
+import hashlib
+import unittest
+import threading
+import logging
+from unittest.mock import Mock, patch
+from idempotency import IdempotencyCache, IdempotencyConflict, request_key, request_digest
+import api
+
+
+class TestIdempotencyCache(unittest.TestCase):
+
+    def test_completed_result_is_replayed(self):
+        cache = IdempotencyCache()
+        func = Mock(return_value='result')
+        self.assertEqual('result', cache.run('key', func))
+        self.assertEqual('result', cache.run('key', func))
+        self.assertEqual(1, func.call_count)
+        self.assertEqual({'size': 1, 'bytes': 8, 'hits': 1, 'misses': 1, 'waits': 0, 'conflicts': 0, 'oversized': 0},
+                         cache.stats())
+
+    def test_result_expires(self):
+        cache = IdempotencyCache(ttl=0.01)
+        func = Mock(return_value='result')
+        cache.run('key', func)
+        time.sleep(0.02)
+        cache.run('key', func)
+        self.assertEqual(2, func.call_count)
+
+    def test_failure_is_not_remembered(self):
+        cache = IdempotencyCache()
+        func = Mock(side_effect=[RuntimeError('boom'), 'result'])
+        with self.assertRaises(RuntimeError):
+            cache.run('key', func)
+        self.assertEqual('result', cache.run('key', func))
+        self.assertEqual(2, func.call_count)
+
+    def test_size_is_bounded(self):
+        cache = IdempotencyCache(max_size=2)
+        for key in ('a', 'b', 'c'):
+            cache.run(key, Mock(return_value=key))
+        self.assertEqual(['b', 'c'], list(cache.entries))
+
+    def test_bytes_are_bounded(self):
+        cache = IdempotencyCache(max_bytes=25, sizeof=len)
+        for key in ('a', 'b', 'c'):
+            cache.run(key, Mock(return_value=key * 10))
+        self.assertEqual(['b', 'c'], list(cache.entries))
+        self.assertEqual(20, cache.stats()['bytes'])
+
+    def test_oversized_result_is_not_remembered(self):
+        cache = IdempotencyCache(max_result_size=5, sizeof=len)
+        func = Mock(return_value='x' * 10)
+        self.assertEqual('x' * 10, cache.run('key', func))
+        self.assertEqual('x' * 10, cache.run('key', func))
+        self.assertEqual(2, func.call_count)
+        self.assertEqual({'size': 0, 'bytes': 0, 'oversized': 2},
+                         {name: value for name, value in cache.stats().items() if name in ('size', 'bytes', 'oversized')})
+
+    def test_other_digest_conflicts(self):
+        cache = IdempotencyCache()
+        cache.run('key', Mock(return_value='result'), digest='a')
+        with self.assertRaises(IdempotencyConflict):
+            cache.run('key', Mock(return_value='other'), digest='b')
+        self.assertEqual('result', cache.run('key', Mock(), digest='a'))
+        self.assertEqual(1, cache.stats()['conflicts'])
+
+    def test_concurrent_duplicates_wait(self):
+        cache = IdempotencyCache()
+        started, release = threading.Event(), threading.Event()
+        calls = []
+
+        def func():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return 'result'
+
+        results = []
+        first = threading.Thread(target=lambda: results.append(cache.run('key', func)))
+        first.start()
+        started.wait(5)
+        duplicates = [threading.Thread(target=lambda: results.append(cache.run('key', func))) for _ in range(3)]
+        for thread in duplicates:
+            thread.start()
+        while cache.stats()['waits'] < 3:
+            time.sleep(0.001)
+        release.set()
+        for thread in [first] + duplicates:
+            thread.join(5)
+        self.assertEqual(['result'] * 4, results)
+        self.assertEqual(1, len(calls))
+
+    def test_request_key(self):
+        self.assertEqual(('', 'h&f', 'online_score', 'abc'), request_key('abc', None, 'h&f', 'online_score'))
+        self.assertIsNone(request_key(None, 'horns&hoofs', 'h&f', 'online_score'))
+        self.assertIsNone(request_key('x' * 1000, 'horns&hoofs', 'h&f', 'online_score'))
+
+    def test_request_digest(self):
+        self.assertEqual(request_digest({'phone': '7', 'email': 'a@b'}), request_digest({'email': 'a@b', 'phone': '7'}))
+        self.assertNotEqual(request_digest({'phone': '7'}), request_digest({'phone': '8'}))
+
+
+class TestIdempotentMethodHandler(unittest.TestCase):
+
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        self.request = {"account": "horns&hoofs", "login": "h&f", "method": "online_score",
+                        "arguments": {"phone": "79175002040", "email": "stupnikov@otus.ru"},
+                        "token": hashlib.sha512(("horns&hoofs" + "h&f" + api.SALT).encode('utf-8')).hexdigest()}
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+    def call(self, headers):
+        return api.method_handler({"body": self.request, "headers": headers}, {}, Mock())
+
+    @patch('scoring.get_score', return_value=3.0)
+    def test_retry_is_replayed(self, get_score):
+        with patch.object(api, 'idempotency_cache', IdempotencyCache()):
+            first = self.call({'X-Request-ID': 'abc'})
+            second = self.call({'X-Request-ID': 'abc'})
+            self.call({'X-Request-ID': 'other'})
+        self.assertEqual((dict(score=3.0), api.OK), first)
+        self.assertEqual(first, second)
+        self.assertEqual(2, get_score.call_count)
+
+    @patch('scoring.get_score', return_value=3.0)
+    def test_retry_with_other_arguments_is_rejected(self, get_score):
+        with patch.object(api, 'idempotency_cache', IdempotencyCache()):
+            self.call({'X-Request-ID': 'abc'})
+            self.request["arguments"] = {"phone": "79175002041", "email": "stupnikov@otus.ru"}
+            response, code = self.call({'X-Request-ID': 'abc'})
+        self.assertEqual(api.INVALID_REQUEST, code)
+        self.assertIn('abc', response)
+        self.assertEqual(1, get_score.call_count)
+
+    @patch('scoring.get_score', return_value=3.0)
+    def test_without_request_id(self, get_score):
+        with patch.object(api, 'idempotency_cache', IdempotencyCache()):
+            self.call({})
+            self.call({})
+        self.assertEqual(2, get_score.call_count)
+
+    def test_get_request_id(self):
+        handler = api.MainHTTPHandler.__new__(api.MainHTTPHandler)
+        self.assertEqual('abc', handler.get_request_id({'X-Request-ID': 'abc'}))
+        self.assertEqual(32, len(handler.get_request_id({})))
+
+
+if __name__ == '__main__':
+    unittest.main()
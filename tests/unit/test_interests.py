@@ -0,0 +1,317 @@
+# -*- coding: utf-8 -*-
+
+import datetime
+import unittest
+from unittest.mock import Mock, patch
+from redis.exceptions import ConnectionError
+from tests.helpers import cases, merge_bits, FakeRedis
+from interests import InterestCodec, InterestCache, INTERESTS_TABLE_KEY, INTERESTS_INVALIDATION_CHANNEL
+from store import RedisStore, COUNT_MEMBERS_SCRIPT, COUNT_BITS_SCRIPT, MERGE_BITS_SCRIPT
+import scoring
+import api
+
+
+def count_members(client, keys, args):
+    counts = {}
+    for key in keys:
+        for member in client.smembers(key):
+            counts[member] = counts.get(member, 0) + 1
+    return [value for item in counts.items() for value in item]
+
+
+def count_bits(client, keys, args):
+    counts = {}
+    for key in keys:
+        for index, byte in enumerate(client.get(key) or b''):
+            for bit in range(8):
+                if byte & (1 << bit):
+                    counts[index * 8 + bit] = counts.get(index * 8 + bit, 0) + 1
+    return [value for item in counts.items() for value in item]
+
+
+class TestInterestCodec(unittest.TestCase):
+
+    @patch('redis.Redis', FakeRedis)
+    def setUp(self):
+        self.store = RedisStore()
+        self.store.connect()
+        self.codec = InterestCodec()
+
+    @cases([
+        [],
+        ['books'],
+        ['books', 'cars', 'travel', 'music', 'sport', 'hi-tech', 'pets', 'tv', 'cinema', 'geek', 'otus'],
+        ['книги', 'путешествия'],
+    ])
+    def test_codec_round_trip(self, interests):
+        bitmap = self.codec.encode(self.store, interests)
+        self.assertLessEqual(len(bitmap), 2)
+        self.assertEqual(sorted(interests), sorted(self.codec.decode(self.store, bitmap)))
+
+    def test_codec_shares_ids_between_processes(self):
+        bitmap = self.codec.encode(self.store, ['books', 'cars'])
+        other = InterestCodec()
+        self.assertEqual(bitmap, other.encode(self.store, ['cars', 'books']))
+        self.assertEqual(2, len(self.store.get_hash(INTERESTS_TABLE_KEY)))
+
+    def test_codec_reloads_unknown_ids(self):
+        reader = InterestCodec()
+        reader.load(self.store)
+        bitmap = self.codec.encode(self.store, ['books', 'cars'])
+        self.assertEqual(['books', 'cars'], reader.decode(self.store, bitmap))
+
+    def test_codec_interns_names(self):
+        first = self.codec.decode(self.store, self.codec.encode(self.store, ['books']))
+        second = InterestCodec()
+        second.load(self.store)
+        self.assertIs(first[0], second.decode(self.store, self.codec.encode(self.store, ['books']))[0])
+
+
+class TestInterestsFormat(unittest.TestCase):
+
+    @patch('redis.Redis', FakeRedis)
+    def setUp(self):
+        self.store = RedisStore()
+        self.store.connect()
+
+    @cases([
+        [1, ['books', 'cars']],
+        [2, ['travel']],
+        [3, []],
+    ])
+    def test_get_interests_same_output(self, params):
+        cid, interests = params
+        if interests:
+            scoring.set_interests(self.store, cid, interests)
+        expected = sorted(scoring.get_interests(self.store, cid))
+        with patch('scoring.interest_codec', InterestCodec()):
+            if interests:
+                scoring.set_interests(self.store, cid, interests)
+            self.assertEqual(expected, sorted(scoring.get_interests(self.store, cid)))
+        self.assertEqual(sorted(interests), expected)
+
+
+class TestInterestCache(unittest.TestCase):
+
+    def test_cache_hit_miss(self):
+        cache = InterestCache()
+        hit, token = cache.get('i#1')
+        self.assertFalse(hit)
+        self.assertTrue(cache.put('i#1', ['books'], token))
+        self.assertEqual((True, ['books']), cache.get('i#1'))
+        self.assertEqual({'size': 1, 'hits': 1, 'misses': 1}, cache.stats())
+
+    @patch('time.monotonic')
+    def test_cache_ttl(self, monotonic):
+        monotonic.return_value = 100
+        cache = InterestCache(ttl=10, negative_ttl=1)
+        cache.put('i#1', ['books'], cache.get('i#1')[1])
+        cache.put('i#2', [], cache.get('i#2')[1])
+        monotonic.return_value = 105
+        self.assertEqual((True, ['books']), cache.get('i#1'))
+        self.assertFalse(cache.get('i#2')[0])
+        monotonic.return_value = 111
+        self.assertFalse(cache.get('i#1')[0])
+
+    def test_cache_lru_eviction(self):
+        cache = InterestCache(max_size=2)
+        for cid in (1, 2):
+            cache.put('i#%d' % cid, ['books'], cache.get('i#%d' % cid)[1])
+        cache.get('i#1')
+        cache.put('i#3', ['cars'], cache.get('i#3')[1])
+        self.assertTrue(cache.get('i#1')[0])
+        self.assertFalse(cache.get('i#2')[0])
+
+    def test_cache_invalidate(self):
+        cache = InterestCache()
+        cache.put('i#1', ['books'], cache.get('i#1')[1])
+        cache.invalidate(b'i#1')
+        hit, token = cache.get('i#1')
+        self.assertFalse(hit)
+        self.assertTrue(cache.put('i#1', ['cars'], token))
+
+    def test_cache_stale_read_after_invalidate(self):
+        cache = InterestCache()
+        _, token = cache.get('i#1')
+        cache.invalidate('i#1')
+        self.assertFalse(cache.put('i#1', ['stale'], token))
+        self.assertFalse(cache.get('i#1')[0])
+
+    def test_cache_stale_read_after_forgotten_invalidate(self):
+        cache = InterestCache(max_size=1)
+        _, token = cache.get('i#1')
+        cache.invalidate('i#1')
+        cache.invalidate('i#2')
+        self.assertFalse(cache.put('i#1', ['stale'], token))
+
+    @patch('redis.Redis', FakeRedis)
+    def test_cache_invalidated_by_store_writes(self):
+        store = RedisStore(invalidation_channel='i#invalidate')
+        store.connect()
+        cache = InterestCache()
+        cache.attach(store, channel=None)
+        scoring.set_interests(store, 1, ['books'])
+        with patch('scoring.interest_cache', cache):
+            self.assertEqual(['books'], scoring.get_interests(store, 1))
+            store.client.sadd('i#1', 'cars')
+            self.assertEqual(['books'], scoring.get_interests(store, 1))
+            scoring.set_interests(store, 1, ['travel'])
+            self.assertEqual(['books', 'cars', 'travel'], sorted(scoring.get_interests(store, 1)))
+            store.set_many({'i#1': ['music']})
+            self.assertEqual(4, len(scoring.get_interests(store, 1)))
+        self.assertEqual([('i#invalidate', 'i#1')] * 3, store.client.published)
+
+    @patch('redis.Redis', FakeRedis)
+    def test_cache_invalidated_by_batched_messages(self):
+        reader = RedisStore()
+        reader.connect()
+        writer = RedisStore(invalidation_channel=INTERESTS_INVALIDATION_CHANNEL)
+        writer.client = reader.client
+        cache = InterestCache()
+        cache.attach(reader)
+        tokens = {cid: cache.get('i#%d' % cid)[1] for cid in range(3)}
+        with patch('store.REDIS_INVALIDATION_BATCH_SIZE', 2):
+            scoring.set_interests_many(writer, {0: ['books'], 1: ['cars'], 2: ['travel']})
+        self.assertEqual(2, len(reader.client.published))
+        self.assertEqual(('i#invalidate', 'i#0\ni#1'), reader.client.published[0])
+        self.assertFalse(any(cache.put('i#%d' % cid, ['stale'], token) for cid, token in tokens.items()))
+
+    @patch('redis.Redis', FakeRedis)
+    def test_cache_fills_from_primary(self):
+        store = RedisStore(replicas=['localhost:7001'])
+        store.connect()
+        scoring.set_interests(store, 1, ['books'])
+        scoring.set_interests(store, 2, ['cars'])
+        # the replica has not caught up with the writes yet
+        self.assertEqual([], scoring.get_interests(store, 1))
+        with patch('scoring.interest_cache', InterestCache()):
+            self.assertEqual(['books'], scoring.get_interests(store, 1))
+            self.assertEqual(({2: ['cars']}, {}), scoring.get_interests_partial(store, [2]))
+
+    @cases([None, InterestCodec()])
+    @patch('redis.Redis', FakeRedis)
+    def test_cache_invalidated_by_writes_of_another_store(self, codec):
+        reader = RedisStore()
+        reader.connect()
+        # a loader process without a cache writing to the same server
+        writer = RedisStore(invalidation_channel=INTERESTS_INVALIDATION_CHANNEL)
+        writer.client = reader.client
+        cache = InterestCache()
+        cache.attach(reader)
+        with patch('scoring.interest_codec', codec), patch.dict(FakeRedis.scripts, {MERGE_BITS_SCRIPT: merge_bits}):
+            scoring.set_interests(writer, 1, ['books'])
+            with patch('scoring.interest_cache', cache):
+                self.assertEqual(['books'], scoring.get_interests(reader, 1))
+                scoring.set_interests_many(writer, {1: ['cars']})
+                self.assertEqual(['books', 'cars'], sorted(scoring.get_interests(reader, 1)))
+
+
+class TestDatedInterests(unittest.TestCase):
+
+    @patch('redis.Redis', FakeRedis)
+    def setUp(self):
+        self.store = RedisStore(nodes=['localhost:7001', 'localhost:7002', 'localhost:7003'])
+        self.store.connect()
+        self.day = datetime.date(2017, 7, 20)
+        with patch('scoring.INTERESTS_RETENTION_DAYS', 36500):
+            for i, interests in enumerate([['books'], ['cars'], ['books', 'travel']]):
+                scoring.set_interests_many(self.store, {1: interests, 2: ['tv'] * (i == 1)},
+                                           date=self.day + datetime.timedelta(days=i))
+
+    def test_dated_partitions_share_node(self):
+        keys = [scoring.dated_interests_key(1, self.day + datetime.timedelta(days=i)) for i in range(3)]
+        self.assertEqual(1, len({self.store.node_for(key) for key in keys}))
+        self.assertEqual(1, len({self.store.node_for(key) for key in keys + ['i#{1}']}))
+
+    def test_dated_partitions_expire(self):
+        old = datetime.date.today() - datetime.timedelta(days=scoring.INTERESTS_RETENTION_DAYS + 2)
+        scoring.set_interests(self.store, 1, ['books'], date=old)
+        key = scoring.dated_interests_key(1, old)
+        self.assertEqual(-2, self.store.client_for(key).pttl(key))
+        today = datetime.date.today()
+        scoring.set_interests(self.store, 1, ['books'], date=today)
+        key = scoring.dated_interests_key(1, today)
+        days = self.store.client_for(key).pttl(key) / 1000.0 / 86400
+        self.assertTrue(scoring.INTERESTS_RETENTION_DAYS <= days <= scoring.INTERESTS_RETENTION_DAYS + 1)
+
+    def test_get_interests_dated(self):
+        self.assertEqual({1: ['books'], 2: [], 3: []},
+                         scoring.get_interests_dated(self.store, [1, 2, 3], self.day))
+        result = scoring.get_interests_dated(self.store, [1, 2], self.day, self.day + datetime.timedelta(days=2))
+        self.assertEqual(['books', 'cars', 'travel'], sorted(result[1]))
+        self.assertEqual(['tv'], result[2])
+        self.assertEqual([], scoring.get_interests(self.store, 1))
+
+    def test_get_interests_dated_partial(self):
+        broken = self.store.node_for('i#{1}')
+        self.store.clients[broken].sunion = Mock(side_effect=ConnectionError)
+        cids = list(range(1, 30))
+        result, errors = scoring.get_interests_dated(self.store, cids, self.day, partial=True)
+        lost = [cid for cid in cids if self.store.node_for('i#{%s}' % cid) == broken]
+        self.assertEqual(dict.fromkeys(lost, 'unavailable'), errors)
+        self.assertEqual(sorted(set(cids) - set(lost)), sorted(result))
+
+    @cases([
+        ({'client_ids': [1], 'date_to': '20.07.2017'}, 'date is required'),
+        ({'client_ids': [1], 'date': '20.07.2017', 'date_to': '19.07.2017'}, 'before date'),
+        ({'client_ids': [1], 'date': '20.07.2017', 'date_to': '20.09.2017'}, 'at most'),
+    ])
+    def test_date_range_validation(self, arguments, message):
+        request = api.ClientsInterestsRequest(**arguments)
+        with self.assertRaises(api.ValidationError) as e:
+            request.validate()
+        self.assertIn(message, str(e.exception))
+
+
+@patch.dict(FakeRedis.scripts, {COUNT_MEMBERS_SCRIPT: count_members, COUNT_BITS_SCRIPT: count_bits})
+class TestInterestsSummary(unittest.TestCase):
+
+    interests = {1: ['books', 'cars'], 2: ['books'], 3: ['travel', 'books', 'cars'], 4: [], 5: ['tv']}
+
+    @patch('redis.Redis', FakeRedis)
+    def setUp(self):
+        self.store = RedisStore(nodes=['localhost:7001', 'localhost:7002'])
+        self.store.connect()
+
+    @cases([None, InterestCodec()])
+    def test_interests_summary(self, codec):
+        with patch('scoring.interest_codec', codec):
+            for cid, interests in self.interests.items():
+                if interests:
+                    scoring.set_interests(self.store, cid, interests)
+            self.assertEqual({'books': 3, 'cars': 2, 'travel': 1, 'tv': 1},
+                             scoring.get_interests_summary(self.store, list(self.interests) + [6]))
+            self.assertEqual({'books': 3, 'cars': 2}, scoring.get_interests_summary(self.store, self.interests, top=2))
+
+    def test_interests_summary_duplicate_ids(self):
+        scoring.set_interests(self.store, 1, ['books'])
+        self.assertEqual({'books': 1}, scoring.get_interests_summary(self.store, [1, 1, 1]))
+
+    @patch('store.REDIS_SCRIPT_CHUNK_SIZE', 2)
+    def test_count_members_chunks(self):
+        keys = ['i#%d' % i for i in range(10)]
+        self.store.set_many({key: ['books'] for key in keys})
+        chunks = []
+
+        def recording(client, keys, args):
+            chunks.append(len(keys))
+            return count_members(client, keys, args)
+
+        with patch.dict(FakeRedis.scripts, {COUNT_MEMBERS_SCRIPT: recording}):
+            self.assertEqual({b'books': 10}, self.store.count_members(keys))
+        self.assertEqual(10, sum(chunks))
+        self.assertLessEqual(max(chunks), 2)
+
+    @patch('scoring.get_interests_summary', return_value={'books': 2})
+    def test_interests_summary_handler(self, get_interests_summary):
+        request = api.MethodRequest(account='', login='login', token='', method='interests_summary',
+                                    arguments={'client_ids': [1, 2], 'top': 5})
+        ctx = {}
+        response = api.interests_summary_handler(request=request, ctx=ctx, store=Mock())
+        self.assertEqual(({'books': 2}, api.OK), response)
+        self.assertEqual(2, ctx['nclients'])
+        self.assertEqual(5, get_interests_summary.call_args[1]['top'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+
+import time
+import hashlib
+import unittest
+import threading
+import logging
+from unittest.mock import patch
+from tests.helpers import FakeRedis
+from jobs import JobManager, JobsFull, DONE, FAILED
+from store import RedisStore
+import scoring
+import api
+
+OWNER = ('horns&hoofs', 'h&f')
+
+
+def wait_for(manager, job_id, owner=OWNER, status=DONE):
+    for _ in range(500):
+        state = manager.status(job_id, owner)
+        if state['status'] == status:
+            return state
+        time.sleep(0.01)
+    raise AssertionError('Job %s is still %s' % (job_id, state['status']))
+
+
+class TestJobManager(unittest.TestCase):
+
+    @patch('redis.Redis', FakeRedis)
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        self.store = RedisStore()
+        self.store.connect()
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+    def test_job_pages(self):
+        manager = JobManager(self.store, chunk_size=3, ttl=60)
+        job_id, state = manager.submit(OWNER, list(range(8)), lambda items: {str(i): i * 2 for i in items})
+        self.assertEqual(3, state['pages'])
+        state = wait_for(manager, job_id)
+        self.assertEqual(3, state['done'])
+        self.assertEqual({'0': 0, '1': 2, '2': 4}, manager.page(job_id, 0))
+        self.assertEqual({'6': 12, '7': 14}, manager.page(job_id, 2))
+        self.assertGreater(self.store.client.pttl('job#%s#0' % job_id), 0)
+        self.assertEqual(0, manager.stats()['pending'])
+
+    def test_job_owner(self):
+        manager = JobManager(self.store)
+        job_id, _ = manager.submit(OWNER, [1], lambda items: {})
+        wait_for(manager, job_id)
+        self.assertIsNone(manager.status(job_id, ('other', 'h&f')))
+        self.assertIsNone(manager.status('missing', OWNER))
+
+    def test_job_failure(self):
+        manager = JobManager(self.store, chunk_size=1)
+
+        def fetch(items):
+            if items == [2]:
+                raise RuntimeError('boom')
+            return {}
+
+        job_id, submitted = manager.submit(OWNER, [1, 2, 3], fetch)
+        state = wait_for(manager, job_id, status=FAILED)
+        # the worker updates its own copy of the state
+        self.assertEqual('queued', submitted['status'])
+        self.assertNotIn('error', submitted)
+        self.assertEqual(1, state['done'])
+        self.assertEqual('boom', state['error'])
+
+    def test_pending_jobs_are_bounded(self):
+        manager = JobManager(self.store, workers=1, max_pending=1)
+        release = threading.Event()
+        job_id, _ = manager.submit(OWNER, [1], lambda items: release.wait(5) and {})
+        with self.assertRaises(JobsFull):
+            manager.submit(OWNER, [1], lambda items: {})
+        release.set()
+        wait_for(manager, job_id)
+        manager.submit(OWNER, [1], lambda items: {})
+
+
+class TestJobHandlers(unittest.TestCase):
+
+    @patch('redis.Redis', FakeRedis)
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        self.store = RedisStore()
+        self.store.connect()
+        for cid in range(1, 6):
+            scoring.set_interests(self.store, cid, ['books'])
+        self.manager = JobManager(self.store, chunk_size=2)
+        self.token = hashlib.sha512(("horns&hoofs" + "h&f" + api.SALT).encode('utf-8')).hexdigest()
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+    def call(self, method, arguments):
+        request = {"account": "horns&hoofs", "login": "h&f", "method": method, "token": self.token,
+                   "arguments": arguments}
+        with patch.object(api, 'job_manager', self.manager):
+            return api.method_handler({"body": request, "headers": {}}, {}, self.store)
+
+    def test_async_clients_interests(self):
+        response, code = self.call('clients_interests', {'client_ids': [1, 2, 3, 4, 5, 6], 'async': True})
+        self.assertEqual(api.ACCEPTED, code)
+        self.assertEqual(3, response['pages'])
+        job_id = response['job_id']
+        wait_for(self.manager, job_id)
+
+        response, code = self.call('job_status', {'job_id': job_id})
+        self.assertEqual(api.OK, code)
+        self.assertEqual(DONE, response['status'])
+        self.assertNotIn('owner', response)
+
+        response, code = self.call('job_result', {'job_id': job_id, 'page': 2})
+        self.assertEqual(api.OK, code)
+        self.assertEqual({'5': ['books'], '6': []}, response['interests'])
+        _, code = self.call('job_result', {'job_id': job_id, 'page': 3})
+        self.assertEqual(api.INVALID_REQUEST, code)
+        _, code = self.call('job_result', {'job_id': 'missing'})
+        self.assertEqual(api.NOT_FOUND, code)
+
+    def test_job_result_not_ready(self):
+        release = threading.Event()
+        job_id, _ = self.manager.submit(OWNER, [1, 2, 3], lambda items: release.wait(5) and {})
+        response, code = self.call('job_result', {'job_id': job_id, 'page': 1})
+        release.set()
+        self.assertEqual(api.ACCEPTED, code)
+        self.assertNotIn('interests', response)
+
+    def test_job_result_failed(self):
+        def fetch(items):
+            if 3 in items:
+                raise RuntimeError('boom')
+            return {str(cid): ['books'] for cid in items}
+
+        job_id, _ = self.manager.submit(OWNER, [1, 2, 3, 4], fetch)
+        wait_for(self.manager, job_id, status=FAILED)
+        response, code = self.call('job_result', {'job_id': job_id, 'page': 1})
+        self.assertEqual(api.INTERNAL_ERROR, code)
+        self.assertIn('boom', response)
+        response, code = self.call('job_result', {'job_id': job_id, 'page': 0})
+        self.assertEqual(api.OK, code)
+        self.assertEqual({'1': ['books'], '2': ['books']}, response['interests'])
+
+    def test_async_disabled(self):
+        with patch.object(api, 'job_manager', None):
+            request = {"account": "horns&hoofs", "login": "h&f", "method": "clients_interests", "token": self.token,
+                       "arguments": {'client_ids': [1], 'async': True}}
+            _, code = api.method_handler({"body": request, "headers": {}}, {}, self.store)
+        self.assertEqual(api.INVALID_REQUEST, code)
+
+
+if __name__ == '__main__':
+    unittest.main()
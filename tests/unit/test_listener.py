@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import socket
+import shutil
+import tempfile
+import unittest
+import threading
+import logging
+import http.client
+import api
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+
+    def __init__(self, socket_path, timeout=5):
+        super(UnixHTTPConnection, self).__init__('localhost', timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+class NodelayHandler(api.MainHTTPHandler):
+    seen = []
+
+    def do_GET(self):
+        self.seen.append(self.connection.getsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY))
+        super(NodelayHandler, self).do_GET()
+
+
+class TestListener(unittest.TestCase):
+
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        self.servers = []
+
+    def tearDown(self):
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+        logging.disable(logging.NOTSET)
+
+    def serve(self, server):
+        self.servers.append(server)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+    def get(self, connection, path='/health/live'):
+        connection.request('GET', path)
+        response = connection.getresponse()
+        result = response.status, json.loads(response.read())
+        connection.close()
+        return result
+
+    def test_unix_socket(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'api.sock')
+        # a socket file left by a crashed process is replaced
+        stale = socket.socket(socket.AF_UNIX)
+        stale.bind(path)
+        stale.close()
+        server = self.serve(api.make_server(api.MainHTTPHandler, unix_socket=path))
+        code, body = self.get(UnixHTTPConnection(path))
+        self.assertEqual(api.OK, code)
+        self.assertEqual({'live': True}, body['response'])
+        server.shutdown()
+        server.server_close()
+        self.servers.remove(server)
+        self.assertFalse(os.path.exists(path))
+
+    def test_backlog(self):
+        server = api.make_server(api.MainHTTPHandler, port=0, backlog=512)
+        server.server_close()
+        self.assertEqual(512, server.request_queue_size)
+
+    @unittest.skipUnless(hasattr(socket, 'SO_REUSEPORT'), 'SO_REUSEPORT is not supported')
+    def test_reuse_port(self):
+        first = self.serve(api.make_server(api.MainHTTPHandler, port=0, reuse_port=True))
+        port = first.server_address[1]
+        self.serve(api.make_server(api.MainHTTPHandler, port=port, reuse_port=True))
+        with self.assertRaises(OSError):
+            api.make_server(api.MainHTTPHandler, port=port)
+        self.assertEqual(api.OK, self.get(http.client.HTTPConnection('localhost', port, timeout=5))[0])
+
+    def test_tcp_nodelay(self):
+        for nodelay in (True, False):
+            server = self.serve(api.make_server(NodelayHandler, port=0, tcp_nodelay=nodelay))
+            self.get(http.client.HTTPConnection('localhost', server.server_address[1], timeout=5))
+        self.assertEqual([True, False], [bool(value) for value in NodelayHandler.seen])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import shutil
+import tempfile
+import unittest
+import logging
+from unittest.mock import patch
+from tests.helpers import cases, merge_bits, FakeRedis
+from store import RedisStore, MERGE_BITS_SCRIPT
+from loader import parse_row, read_batches, BulkLoader
+from interests import InterestCodec
+import scoring
+
+
+class TestParseRow(unittest.TestCase):
+
+    @cases([
+        ['1,books,cars\n', 'csv', (1, ['books', 'cars'])],
+        ['2,"hi, tech"\n', 'csv', (2, ['hi, tech'])],
+        ['3\n', 'csv', (3, [])],
+        ['{"client_id": 4, "interests": ["books"]}\n', 'jsonl', (4, ['books'])],
+        ['\n', 'csv', None],
+    ])
+    def test_parse_row(self, params):
+        line, fmt, expected = params
+        self.assertEqual(expected, parse_row(line, fmt))
+
+
+class TestBulkLoader(unittest.TestCase):
+
+    @patch('redis.Redis', FakeRedis)
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, 'interests.csv')
+        self.checkpoint = os.path.join(self.tmp, 'load.ckpt')
+        with open(self.path, 'w') as f:
+            for cid in range(100):
+                f.write('%d,books,i%d\n' % (cid, cid % 7))
+        self.store = RedisStore()
+        self.store.connect()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+        logging.disable(logging.NOTSET)
+
+    def assert_loaded(self, namespace=''):
+        for cid in range(100):
+            self.assertEqual({b'books', ('i%d' % (cid % 7)).encode('utf-8')},
+                             self.store.get(scoring.interests_key(cid, namespace)))
+
+    def test_read_batches_offsets(self):
+        batches = list(read_batches(self.path, 'csv', batch_size=30))
+        self.assertEqual([30, 30, 30, 10], [len(batch) for batch, _ in batches])
+        self.assertEqual(os.path.getsize(self.path), batches[-1][1])
+        rest = list(read_batches(self.path, 'csv', offset=batches[1][1], batch_size=30))
+        self.assertEqual(list(range(60, 100)), [cid for batch, _ in rest for cid in batch])
+
+    def test_bulk_loader_load(self):
+        loader = BulkLoader(self.store, self.path, workers=3, batch_size=7, checkpoint=self.checkpoint)
+        self.assertEqual('', loader.run())
+        self.assertEqual(100, loader.rows)
+        self.assert_loaded()
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+    @patch('scoring.versioned_interests', True)
+    @patch('scoring._namespace', (0, ''))
+    def test_bulk_loader_swap(self):
+        loader = BulkLoader(self.store, self.path, batch_size=10, swap=True)
+        namespace = loader.run()
+        self.assertTrue(namespace)
+        self.assert_loaded(namespace)
+        self.assertEqual(set(), self.store.get('i#1'))
+        self.assertEqual(['books', 'i1'], sorted(scoring.get_interests(self.store, 1)))
+
+    def test_bulk_loader_resume(self):
+        loader = BulkLoader(self.store, self.path, workers=1, batch_size=10, swap=True, checkpoint=self.checkpoint)
+        calls = []
+
+        def write(batch, namespace):
+            if len(calls) == 5:
+                raise ConnectionError('lost connection')
+            calls.append(batch)
+            return scoring.set_interests_many(self.store, batch, namespace) and len(batch)
+
+        with patch.object(loader, 'write', write):
+            with self.assertRaises(ConnectionError):
+                loader.run()
+        with open(self.checkpoint) as f:
+            state = json.load(f)
+        self.assertEqual(50, state['rows'])
+        self.assertEqual(b'', self.store.get_value(scoring.INTERESTS_NAMESPACE_KEY) or b'')
+
+        resumed = BulkLoader(self.store, self.path, batch_size=10, swap=True, checkpoint=self.checkpoint)
+        self.assertEqual(state['namespace'], resumed.run(resume=True))
+        self.assertEqual(100, resumed.rows)
+        self.assert_loaded(state['namespace'])
+
+    @patch.dict(FakeRedis.scripts, {MERGE_BITS_SCRIPT: merge_bits})
+    def test_bitmap_rows_merged_across_batches(self):
+        with open(self.path, 'a') as f:
+            for cid in range(0, 100, 3):
+                f.write('%d,cars\n' % cid)
+        with patch('scoring.interest_codec', InterestCodec()):
+            BulkLoader(self.store, self.path, workers=3, batch_size=10).run()
+            for cid in range(100):
+                expected = {'books', 'i%d' % (cid % 7)} | ({'cars'} if cid % 3 == 0 else set())
+                self.assertEqual(expected, set(scoring.get_interests(self.store, cid)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import json
+import math
+import time
+import hashlib
+import itertools
+import tempfile
+import unittest
+import subprocess
+from unittest.mock import ANY, Mock, patch
+from tests.helpers import cases
+import models
+import scoring
+from models import ScoringModel, get_model, model_for_account, load_config, register_model
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def reference_score(phone, email, birthday=None, gender=None, first_name=None, last_name=None):
+    score = 0
+    if phone:
+        score += 1.5
+    if email:
+        score += 1.5
+    if birthday and gender:
+        score += 1.5
+    if first_name and last_name:
+        score += 0.5
+    return score
+
+
+def all_rows():
+    values = {
+        'phone': [None, '', 79175002040],
+        'email': [None, 'foo@bar.com'],
+        'birthday': [None, '01.01.2000'],
+        'gender': [None, 0, 1, 2],
+        'first_name': [None, 'foo'],
+        'last_name': [None, '', 'bar'],
+    }
+    for combination in itertools.product(*values.values()):
+        yield dict(zip(values, combination))
+
+
+class TestScoringModel(unittest.TestCase):
+
+    def test_default_model_matches_formula(self):
+        model = get_model()
+        for row in all_rows():
+            self.assertEqual(reference_score(**row), model.score(**row))
+
+    def test_default_model_batch_matches_formula(self):
+        rows = list(all_rows())
+        expected = [reference_score(**row) for row in rows]
+        self.assertEqual(expected, get_model().score_batch(rows))
+        with patch('models.numpy', None):
+            self.assertEqual(expected, get_model().score_batch(rows))
+
+    def test_numpy_is_imported_lazily(self):
+        code = 'import sys, api; print("numpy" in sys.modules)'
+        output = subprocess.check_output([sys.executable, '-c', code], cwd=ROOT)
+        self.assertEqual(b'False', output.strip())
+
+    def test_default_model_features(self):
+        self.assertEqual(list(models.FEATURES), get_model().features)
+
+    def test_model_unknown_feature(self):
+        with self.assertRaises(ValueError):
+            ScoringModel('foo', [(('phone', 'age'), 1)])
+
+
+class TestGetScore(unittest.TestCase):
+
+    @cases([
+        {'phone': 79175002040, 'email': 'foo@bar.com'},
+        {'phone': None, 'email': None, 'gender': 1, 'birthday': '01.01.2000', 'first_name': 'a', 'last_name': 'b'},
+    ])
+    def test_get_score_default_cache_key(self, row):
+        store = Mock(cache_get=Mock(return_value=None))
+        key = 'p#%se#%sb#%sg#%sfn#%sln#%s' % (row.get('phone'), row.get('email'), row.get('birthday'),
+                                              row.get('gender'), row.get('first_name'), row.get('last_name'))
+        score = scoring.get_score(store, **row)
+        self.assertEqual(reference_score(**row), score)
+        store.cache_set.assert_called_once_with(hashlib.sha512(('swr#' + key).encode('utf-8')).hexdigest(), ANY, 90,
+                                                deadline=None)
+        # the keys older releases keep bare scores under are neither read nor written
+        legacy = hashlib.sha512(key.encode('utf-8')).hexdigest()
+        self.assertNotIn(legacy, [call[0][0] for call in store.cache_get.call_args_list])
+        cached, soft, hard = scoring.decode_score(store.cache_set.call_args[0][1])
+        self.assertEqual(score, cached)
+        self.assertAlmostEqual(time.time() + 60, soft, delta=1)
+        self.assertAlmostEqual(time.time() + 90, hard, delta=1)
+
+    def test_get_score_cached(self):
+        store = Mock(cache_get=Mock(return_value=b'3.0'))
+        self.assertEqual(3.0, scoring.get_score(store, 79175002040, 'foo@bar.com'))
+        store.cache_set.assert_not_called()
+
+    def cached(self, score, soft, hard):
+        now = time.time()
+        return ('%r|%.3f|%.3f' % (score, now + soft, now + hard)).encode('utf-8')
+
+    @cases([
+        (3.0, 60, 90, False),
+        (0.0, 60, 90, False),
+        (3.0, -1, 29, True),
+    ])
+    def test_cached_score_is_served(self, score, soft, hard, refreshed):
+        store = Mock(cache_get=Mock(return_value=self.cached(score, soft, hard)))
+        refresher = Mock()
+        with patch.object(scoring, 'score_refresher', refresher):
+            self.assertEqual(score, scoring.get_score(store, 79175002040, 'foo@bar.com'))
+        store.cache_set.assert_not_called()
+        self.assertEqual(refreshed, refresher.submit.called)
+
+    def test_stale_score_is_refreshed_in_background(self):
+        store = Mock(cache_get=Mock(return_value=self.cached(1.0, -1, 29)))
+        refresher = Mock()
+        with patch.object(scoring, 'score_refresher', refresher):
+            self.assertEqual(1.0, scoring.get_score(store, 79175002040, 'foo@bar.com'))
+        key, refresh = refresher.submit.call_args[0]
+        self.assertEqual(scoring.get_score_key(79175002040, 'foo@bar.com'), key)
+        self.assertEqual(3.0, refresh())
+        self.assertEqual(3.0, scoring.decode_score(store.cache_set.call_args[0][1])[0])
+
+    def test_stale_score_is_recomputed_inline_without_refresher(self):
+        store = Mock(cache_get=Mock(return_value=self.cached(1.0, -1, 29)))
+        self.assertEqual(3.0, scoring.get_score(store, 79175002040, 'foo@bar.com'))
+        store.cache_set.assert_called_once()
+
+    def test_score_is_not_served_past_hard_expiry(self):
+        # the store still returns it, e.g. a replica applied the expiry late
+        store = Mock(cache_get=Mock(return_value=self.cached(1.0, -31, -1)))
+        refresher = Mock()
+        with patch.object(scoring, 'score_refresher', refresher):
+            self.assertEqual(3.0, scoring.get_score(store, 79175002040, 'foo@bar.com'))
+        refresher.submit.assert_not_called()
+        store.cache_set.assert_called_once()
+
+    @cases([
+        (0.0, 2, False),
+        (1 - math.exp(-3), 2, True),
+        (1 - math.exp(-1), 2, False),
+        (0.0, 0, True),
+    ])
+    def test_expires_early(self, rnd, remaining, expected):
+        with patch('random.random', return_value=rnd):
+            self.assertEqual(expected, scoring.expires_early(100.0 - remaining, 100.0))
+
+    def test_decode_score(self):
+        model = get_model()
+        score, soft, hard = scoring.decode_score(scoring.encode_score(1.5, model, now=1000.0).encode('utf-8'))
+        self.assertEqual((1.5, 1060.0, 1090.0), (score, soft, hard))
+        self.assertEqual((3.0, None, None), scoring.decode_score(b'3.0'))
+
+    def test_get_score_not_cacheable(self):
+        store = Mock()
+        model = ScoringModel('fast', get_model().weights, cacheable=False)
+        self.assertEqual(3.0, scoring.get_score(store, 79175002040, 'foo@bar.com', model=model))
+        store.cache_get.assert_not_called()
+        store.cache_set.assert_not_called()
+
+
+class TestModelsConfig(unittest.TestCase):
+
+    def setUp(self):
+        self.models = dict(models.MODELS)
+        self.accounts = dict(models.ACCOUNT_MODELS)
+
+    def tearDown(self):
+        models.MODELS.clear()
+        models.MODELS.update(self.models)
+        models.ACCOUNT_MODELS.clear()
+        models.ACCOUNT_MODELS.update(self.accounts)
+
+    def test_load_config(self):
+        config = {
+            'models': [{'name': 'phone_only', 'weights': [[['phone'], 5]], 'cacheable': False}],
+            'accounts': {'horns&hoofs': 'phone_only'},
+        }
+        fd, path = tempfile.mkstemp()
+        with os.fdopen(fd, 'w') as f:
+            json.dump(config, f)
+        try:
+            load_config(path)
+        finally:
+            os.remove(path)
+        self.assertEqual('phone_only', model_for_account('horns&hoofs').name)
+        self.assertFalse(model_for_account('horns&hoofs').cacheable)
+        self.assertEqual(models.DEFAULT_MODEL, model_for_account('other').name)
+
+    def test_model_cache_keys_differ(self):
+        other = register_model(ScoringModel('other', [(('phone',), 1)]))
+        self.assertNotEqual(scoring.get_score_key(79175002040, None),
+                            scoring.get_score_key(79175002040, None, model=other))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+
+import json
+import unittest
+import logging
+from unittest.mock import patch
+from tests.helpers import cases, FakeRedis
+from store import RedisStore
+from prewarm import parse_sample, score_entry, Prewarmer
+import models
+import scoring
+
+ARGUMENTS = {"phone": "79175002040", "email": "stupnikov@otus.ru"}
+
+
+def sample(account, **arguments):
+    return json.dumps({"account": account, "login": "h&f", "method": "online_score", "arguments": arguments})
+
+
+class TestParseSample(unittest.TestCase):
+
+    @cases([
+        (sample("horns&hoofs", **ARGUMENTS), ("horns&hoofs", ARGUMENTS)),
+        (json.dumps(ARGUMENTS), (None, ARGUMENTS)),
+        ("[2020.10.01 10:00:00] I /method/: b'%s' 3f2a" % sample("horns&hoofs", **ARGUMENTS),
+         ("horns&hoofs", ARGUMENTS)),
+        (json.dumps({"login": "h&f", "method": "clients_interests", "arguments": {}}), None),
+        (json.dumps({"login": "admin", "method": "online_score", "arguments": ARGUMENTS}), None),
+        ('', None),
+    ])
+    def test_parse_sample(self, line, expected):
+        self.assertEqual(expected, parse_sample(line))
+
+    def test_score_entry_matches_get_score(self):
+        key, model, values = score_entry("horns&hoofs", ARGUMENTS)
+        self.assertEqual(scoring.get_score_key(ARGUMENTS["phone"], ARGUMENTS["email"], model=model), key)
+        self.assertEqual(model.score(**values), scoring.get_score(store=_NoStore(), **ARGUMENTS))
+
+    @cases([
+        {"phone": "79175002040"},
+        {"phone": 123, "email": "stupnikov@otus.ru"},
+    ])
+    def test_invalid_arguments_are_skipped(self, arguments):
+        self.assertIsNone(score_entry(None, arguments))
+
+
+class _NoStore(object):
+
+    def cache_get(self, key, deadline=None):
+        return None
+
+    def cache_set(self, key, value, expire, deadline=None):
+        return True
+
+
+class TestPrewarmer(unittest.TestCase):
+
+    @patch('redis.Redis', FakeRedis)
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        self.store = RedisStore()
+        self.store.connect()
+        self.lines = [sample(None, phone="7917500%04d" % (i % 4), email="a%d@otus.ru" % (i % 4)) for i in range(10)]
+        self.lines.append('not a request')
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+    def key(self, i):
+        return score_entry(None, {"phone": "7917500%04d" % i, "email": "a%d@otus.ru" % i})[0]
+
+    def test_keys_are_written(self):
+        report = Prewarmer(self.store, batch_size=3, rate=0).run(self.lines)
+        self.assertEqual(10, report['requests'])
+        self.assertEqual(1, report['skipped'])
+        self.assertEqual(4, report['keys'])
+        self.assertEqual(4, report['written'])
+        self.assertEqual(1.0, report['coverage'])
+        self.assertEqual(3.0, scoring.decode_score(self.store.cache_get(self.key(0)))[0])
+        self.assertGreater(self.store.client.pttl(self.key(0)), 60000)
+
+    def test_cached_keys_are_skipped(self):
+        self.store.cache_set(self.key(0), 3.0, 60)
+        report = Prewarmer(self.store, rate=0).run(self.lines)
+        self.assertEqual(1, report['cached'])
+        self.assertEqual(3, report['written'])
+
+    def test_hottest_keys_first(self):
+        report = Prewarmer(self.store, rate=0, limit=2).run(self.lines)
+        self.assertEqual(2, report['written'])
+        self.assertEqual(0.5, report['coverage'])
+        self.assertEqual(0.6, report['request_coverage'])
+        self.assertIsNotNone(self.store.cache_get(self.key(0)))
+        self.assertIsNone(self.store.cache_get(self.key(3)))
+
+    def test_failed_batch_is_reported(self):
+        with patch.object(self.store, 'cache_set_many', side_effect=RuntimeError('boom')):
+            report = Prewarmer(self.store, rate=0).run(self.lines)
+        self.assertEqual(4, report['failed'])
+        self.assertEqual(0.0, report['coverage'])
+
+    @patch('time.sleep')
+    def test_rate_limit(self, sleep):
+        Prewarmer(self.store, batch_size=1, rate=1).run(self.lines)
+        self.assertEqual(3, sleep.call_count)
+        self.assertGreater(sleep.call_args[0][0], 2)
+
+    def test_uncacheable_model_is_skipped(self):
+        model = models.register_model(models.ScoringModel('fast', [(['phone'], 1.5)], cacheable=False))
+        try:
+            with patch.dict(models.ACCOUNT_MODELS, {'fast': 'fast'}):
+                report = Prewarmer(self.store, rate=0).run([sample('fast', **ARGUMENTS)])
+        finally:
+            models.MODELS.pop(model.name)
+        self.assertEqual(0, report['keys'])
+        self.assertEqual(1, report['skipped'])
+
+
+if __name__ == '__main__':
+    unittest.main()
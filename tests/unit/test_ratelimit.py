@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+from unittest.mock import patch
+from tests.helpers import cases, FakeRedis
+from store import RedisStore
+from ratelimit import TokenBucket, RateLimiter, RATE_LIMIT_SYNC_WINDOW
+import api
+
+
+LIMITS = {
+    "accounts": {
+        "horns&hoofs": {"*": [0, 3], "clients_interests": [0, 1]},
+        "*": {"*": [0, 5]},
+    },
+    "logins": {
+        "h&f": {"*": [0, 2]},
+    },
+}
+
+
+class TestTokenBucket(unittest.TestCase):
+
+    def test_bucket_burst(self):
+        bucket = TokenBucket(0, 2)
+        self.assertTrue(bucket.consume())
+        self.assertTrue(bucket.consume())
+        self.assertFalse(bucket.consume())
+        self.assertEqual(2, bucket.take_consumed())
+        self.assertEqual(0, bucket.take_consumed())
+
+    @patch('time.monotonic')
+    def test_bucket_refill(self, monotonic):
+        monotonic.return_value = 100.0
+        bucket = TokenBucket(10, 1)
+        self.assertTrue(bucket.consume())
+        self.assertFalse(bucket.consume())
+        monotonic.return_value = 100.2
+        self.assertTrue(bucket.consume())
+        monotonic.return_value = 200.0
+        self.assertTrue(bucket.consume())
+        self.assertFalse(bucket.consume())
+
+    def test_bucket_drain(self):
+        bucket = TokenBucket(0, 5)
+        bucket.drain(100)
+        self.assertEqual(-5, bucket.tokens)
+        self.assertFalse(bucket.consume())
+
+
+class TestRateLimiter(unittest.TestCase):
+
+    def setUp(self):
+        self.limiter = RateLimiter(LIMITS)
+
+    def allowed(self, account, login, method, count=10):
+        return sum(self.limiter.allow(account, login, method) for _ in range(count))
+
+    @cases([
+        ['horns&hoofs', 'other', 'online_score', 3],
+        ['horns&hoofs', 'other', 'clients_interests', 1],
+        ['acme', 'other', 'online_score', 5],
+        ['acme', 'h&f', 'online_score', 2],
+        ['', 'other', 'online_score', 5],
+    ])
+    def test_limiter_limits(self, params):
+        account, login, method, expected = params
+        self.limiter = RateLimiter(LIMITS)
+        self.assertEqual(expected, self.allowed(account, login, method))
+
+    def test_limiter_separate_buckets(self):
+        self.assertEqual(5, self.allowed('acme', 'foo', 'online_score'))
+        self.assertEqual(5, self.allowed('initech', 'foo', 'online_score'))
+
+    def test_limiter_refunds_rejected(self):
+        self.assertEqual(2, self.allowed('acme', 'h&f', 'online_score'))
+        self.assertEqual(5 - 2, self.allowed('acme', 'foo', 'online_score'))
+
+    def test_limiter_no_limits(self):
+        self.assertEqual(10, RateLimiter({}).allow('acme', 'foo', 'online_score') * 10)
+
+    @patch('redis.Redis', FakeRedis)
+    def test_limiter_sync(self):
+        store = RedisStore()
+        store.connect()
+        first, second = RateLimiter(LIMITS), RateLimiter(LIMITS)
+        self.assertTrue(first.allow('acme', 'foo', 'online_score'))
+        self.assertTrue(second.allow('acme', 'foo', 'online_score'))
+        first.sync(store)
+        second.sync(store)
+        first.sync(store)
+        self.assertEqual(3, sum(first.allow('acme', 'foo', 'online_score') for _ in range(10)))
+        self.assertEqual(3, sum(second.allow('acme', 'foo', 'online_score') for _ in range(10)))
+
+    @patch('redis.Redis', FakeRedis)
+    @patch('time.time')
+    def test_limiter_sync_skips_idle_buckets(self, now):
+        now.return_value = 1000 * RATE_LIMIT_SYNC_WINDOW
+        store = RedisStore()
+        store.connect()
+        limiter = RateLimiter(LIMITS)
+        for account in ('acme', 'initech', 'globex'):
+            limiter.allow(account, 'foo', 'online_score')
+        limiter.sync(store)
+        self.assertEqual(3, len(store.client.data))
+        now.return_value += RATE_LIMIT_SYNC_WINDOW
+        limiter.allow('acme', 'foo', 'online_score')
+        limiter.sync(store)
+        # only the bucket used in the new window is pushed
+        self.assertEqual(4, len(store.client.data))
+
+    @patch('time.monotonic')
+    def test_limiter_prunes_idle_buckets(self, monotonic):
+        monotonic.return_value = 100.0
+        limiter = RateLimiter({"accounts": {"*": {"*": [1, 2]}}})
+        limiter.prune_at = 3
+        for account in ('a', 'b', 'c'):
+            limiter.allow(account, None, 'online_score')
+        monotonic.return_value = 100.5
+        self.assertTrue(limiter.allow('b', None, 'online_score'))
+        monotonic.return_value = 101.5
+        # a and c refilled to burst, b is still short of it
+        limiter.allow('d', None, 'online_score')
+        self.assertEqual({('accounts', 'b', '*'), ('accounts', 'd', '*')}, set(limiter.buckets))
+
+    @patch('redis.Redis', FakeRedis)
+    @patch('time.monotonic')
+    def test_limiter_keeps_unsynced_buckets(self, monotonic):
+        monotonic.return_value = 100.0
+        store = RedisStore()
+        store.connect()
+        limiter = RateLimiter({"accounts": {"*": {"*": [1, 2]}}})
+        limiter.sync(store)
+        limiter.allow('a', None, 'online_score')
+        monotonic.return_value = 110.0
+        # refilled, but its consumption is not pushed yet
+        self.assertEqual(0, limiter.prune())
+        limiter.sync(store)
+        self.assertEqual(0, limiter.prune())
+        self.assertEqual(1, len(limiter.buckets))
+
+
+class TestRateLimitedMethodHandler(unittest.TestCase):
+
+    def test_method_handler_too_many_requests(self):
+        request = {"account": "horns&hoofs", "login": "h&f", "method": "online_score",
+                   "token": api.get_token("horns&hoofs", "h&f"), "arguments": {"phone": "79175002040"}}
+        with patch('api.rate_limiter', RateLimiter({"accounts": {"*": {"*": [0, 1]}}})):
+            codes = [api.method_handler({"body": request}, {}, None).code for _ in range(2)]
+        self.assertEqual([api.INVALID_REQUEST, api.TOO_MANY_REQUESTS], codes)
+
+    def test_method_handler_forbidden_before_limits(self):
+        request = {"account": "horns&hoofs", "login": "h&f", "method": "online_score", "token": "", "arguments": {}}
+        limiter = RateLimiter({"accounts": {"*": {"*": [0, 1]}}})
+        with patch('api.rate_limiter', limiter):
+            codes = [api.method_handler({"body": request}, {}, None).code for _ in range(2)]
+        self.assertEqual([api.FORBIDDEN, api.FORBIDDEN], codes)
+        self.assertEqual({}, limiter.buckets)
+
+
+if __name__ == '__main__':
+    unittest.main()
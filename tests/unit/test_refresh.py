@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+
+import time
+import unittest
+import threading
+import logging
+from refresh import BackgroundRefresher
+
+
+class TestBackgroundRefresher(unittest.TestCase):
+
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+    def wait_idle(self, refresher):
+        for _ in range(500):
+            if not refresher.stats()['pending']:
+                return
+            time.sleep(0.01)
+        self.fail('Refreshes are still pending')
+
+    def test_key_is_refreshed_once_at_a_time(self):
+        refresher = BackgroundRefresher()
+        release = threading.Event()
+        calls = []
+        self.assertTrue(refresher.submit('key', lambda: calls.append(1) or release.wait(5)))
+        self.assertFalse(refresher.submit('key', lambda: calls.append(2)))
+        release.set()
+        self.wait_idle(refresher)
+        self.assertEqual([1], calls)
+        self.assertTrue(refresher.submit('key', lambda: calls.append(3)))
+        self.wait_idle(refresher)
+        self.assertEqual([1, 3], calls)
+
+    def test_pending_refreshes_are_bounded(self):
+        refresher = BackgroundRefresher(workers=1, max_pending=1)
+        release = threading.Event()
+        refresher.submit('a', lambda: release.wait(5))
+        self.assertFalse(refresher.submit('b', lambda: None))
+        release.set()
+        self.wait_idle(refresher)
+        self.assertEqual({'pending': 0, 'submitted': 1, 'dropped': 1, 'failed': 0}, refresher.stats())
+
+    def test_failed_refresh_is_counted(self):
+        refresher = BackgroundRefresher()
+        refresher.submit('key', lambda: 1 / 0)
+        self.wait_idle(refresher)
+        self.assertEqual(1, refresher.stats()['failed'])
+
+
+if __name__ == '__main__':
+    unittest.main()
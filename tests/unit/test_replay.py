@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+import threading
+import logging
+from http.server import HTTPServer
+from unittest.mock import Mock
+from tests.helpers import cases
+from api import MainHTTPHandler, MethodRequest, check_auth, FORBIDDEN, OK
+from replay import parse_line, resign, percentile, Replayer
+
+
+class TestParseLine(unittest.TestCase):
+
+    @cases([
+        ['{"login": "h&f", "method": "online_score"}', ('/method', {"login": "h&f", "method": "online_score"})],
+        ['{"path": "/method/", "body": {"login": "h&f"}}', ('/method/', {"login": "h&f"})],
+        ["[2020.10.01 10:00:00] I /method/: b'{\"login\": \"h&f\"}' 3f2a", ('/method/', {"login": "h&f"})],
+    ])
+    def test_parse_line_ok(self, params):
+        line, expected = params
+        self.assertEqual(expected, parse_line(line))
+
+    @cases([
+        '',
+        '[1, 2]',
+        "[2020.10.01 10:00:00] I {'request_id': '3f2a', 'code': 200}",
+    ])
+    def test_parse_line_skip(self, line):
+        self.assertIsNone(parse_line(line))
+
+
+class TestResign(unittest.TestCase):
+
+    @cases([
+        {"account": "horns&hoofs", "login": "h&f", "token": "bad"},
+        {"login": "h&f", "token": ""},
+        {"account": "horns&hoofs", "login": "admin", "token": "stale"},
+    ])
+    def test_resign_passes_check_auth(self, body):
+        body = resign(body)
+        request = MethodRequest(**dict(body, account=body.get('account', '')))
+        self.assertTrue(check_auth(request))
+
+
+class TestPercentile(unittest.TestCase):
+
+    @cases([
+        [50, 50],
+        [95, 95],
+        [99.9, 100],
+        [100, 100],
+    ])
+    def test_percentile(self, params):
+        p, expected = params
+        self.assertEqual(expected, percentile(list(range(100, 0, -1)), p))
+
+    def test_percentile_empty(self):
+        self.assertEqual(0.0, percentile([], 99))
+
+
+class TestReplayer(unittest.TestCase):
+
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        self.store_backup = MainHTTPHandler.store
+        MainHTTPHandler.store = Mock(cache_get=Mock(return_value=None), get=Mock(return_value=[b'foo']))
+        self.server = HTTPServer(('localhost', 0), MainHTTPHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        MainHTTPHandler.store = self.store_backup
+        logging.disable(logging.NOTSET)
+
+    def test_replay_report(self):
+        body = {"account": "horns&hoofs", "login": "h&f", "token": "", "method": "clients_interests",
+                "arguments": {"client_ids": [1, 2]}}
+        replayer = Replayer('localhost', self.server.server_address[1], [('/method', body)] * 10,
+                            concurrency=2, resign_tokens=True)
+        report = replayer.run()
+        self.assertEqual(10, report['requests'])
+        self.assertEqual({OK: 10}, report['codes'])
+        self.assertEqual({'p50', 'p95', 'p99', 'p99.9'}, set(report['latency']))
+
+    def test_replay_without_resign(self):
+        body = {"account": "horns&hoofs", "login": "h&f", "token": "", "method": "online_score", "arguments": {}}
+        replayer = Replayer('localhost', self.server.server_address[1], [('/method', body)] * 3, rate=100)
+        self.assertEqual({FORBIDDEN: 3}, replayer.run()['codes'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+
+import time
+import unittest
+import threading
+from tests.helpers import cases
+from scheduler import FairScheduler, estimate_cost
+
+
+class TestEstimateCost(unittest.TestCase):
+
+    @cases([
+        [{"method": "clients_interests", "arguments": {"client_ids": list(range(100))}}, 100],
+        [{"method": "clients_interests", "arguments": {"client_ids": []}}, 1],
+        [{"method": "clients_interests", "arguments": {"client_ids": "foo"}}, 1],
+        [{"method": "online_score", "arguments": {"phone": "79175002040"}}, 1],
+        [[], 1],
+    ])
+    def test_estimate_cost(self, params):
+        body, expected = params
+        self.assertEqual(expected, estimate_cost(body))
+
+
+class TestFairScheduler(unittest.TestCase):
+
+    def block(self, scheduler):
+        gate = threading.Event()
+        scheduler.submit('gate', 1, gate.wait)
+        while scheduler.stats()['queued']:
+            time.sleep(0.001)
+        return gate
+
+    def test_scheduler_run_result(self):
+        scheduler = FairScheduler(workers=2)
+        self.assertEqual(42, scheduler.run('acme', 1, lambda: 42))
+        with self.assertRaises(ValueError):
+            scheduler.run('acme', 1, lambda: int('foo'))
+
+    def test_scheduler_cheap_requests_overtake_heavy(self):
+        scheduler = FairScheduler(workers=1)
+        gate = self.block(scheduler)
+        order = []
+        jobs = [scheduler.submit('heavy', 1000, lambda i=i: order.append('heavy%d' % i)) for i in range(3)]
+        jobs += [scheduler.submit('light', 1, lambda i=i: order.append('light%d' % i)) for i in range(3)]
+        self.assertEqual({'heavy': 3, 'light': 3}, scheduler.stats()['accounts'])
+        gate.set()
+        for job in jobs:
+            job.done.wait(5)
+        self.assertEqual(['light0', 'light1', 'light2', 'heavy0', 'heavy1', 'heavy2'], order)
+        self.assertEqual({}, scheduler.stats()['accounts'])
+
+    def test_scheduler_weights(self):
+        scheduler = FairScheduler(workers=1, weights={'gold': 3})
+        gate = self.block(scheduler)
+        order = []
+        jobs = []
+        for i in range(4):
+            jobs.append(scheduler.submit('basic', 1, lambda: order.append('basic')))
+            jobs.append(scheduler.submit('gold', 1, lambda: order.append('gold')))
+        gate.set()
+        for job in jobs:
+            job.done.wait(5)
+        self.assertEqual(3, order[:4].count('gold'))
+        self.assertEqual(['basic'] * 3, order[5:])
+
+
+if __name__ == '__main__':
+    unittest.main()
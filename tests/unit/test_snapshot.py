@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import shutil
+import tempfile
+import unittest
+import logging
+from unittest.mock import patch, Mock
+from tests.helpers import cases, FakeRedis
+from store import RedisStore
+from snapshot import export, InterestSnapshot, SnapshotReloader, SnapshotError
+import scoring
+
+
+class TestInterestSnapshot(unittest.TestCase):
+
+    @patch('redis.Redis', FakeRedis)
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, 'interests.snapshot')
+        self.store = RedisStore()
+        self.store.connect()
+        for cid in range(1, 200, 2):
+            scoring.set_interests(self.store, cid, ['books', 'i%d' % (cid % 5), 'книги'])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+        logging.disable(logging.NOTSET)
+
+    def test_snapshot_export_count(self):
+        self.assertEqual(100, export(self.store, self.path, batch_size=7))
+
+    @cases([1, 3, 99, 199])
+    def test_snapshot_get(self, cid):
+        export(self.store, self.path)
+        snapshot = InterestSnapshot(self.path)
+        self.assertEqual(sorted(scoring.get_interests(self.store, cid)), sorted(snapshot.get(cid)))
+
+    @cases([0, 2, 200, -1, 'foo'])
+    def test_snapshot_get_missing(self, cid):
+        export(self.store, self.path)
+        self.assertIsNone(InterestSnapshot(self.path).get(cid))
+
+    def test_snapshot_not_a_snapshot(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'\0' * 64)
+        with self.assertRaises(SnapshotError):
+            InterestSnapshot(self.path)
+
+    def test_get_interests_from_snapshot(self):
+        export(self.store, self.path)
+        store = Mock(get=Mock(return_value={b'redis'}))
+        with patch('scoring.interest_snapshot', InterestSnapshot(self.path)):
+            self.assertIn('books', scoring.get_interests(store, 1))
+            self.assertEqual(['redis'], scoring.get_interests(store, 2))
+        self.assertEqual(1, store.get.call_count)
+
+    def test_get_interests_stale_snapshot(self):
+        export(self.store, self.path)
+        store = Mock(get=Mock(return_value={b'redis'}))
+        with patch('scoring.interest_snapshot', InterestSnapshot(self.path, max_age=0)):
+            self.assertEqual(['redis'], scoring.get_interests(store, 1))
+
+    @patch('scoring.interest_snapshot', None)
+    def test_snapshot_reloader(self):
+        export(self.store, self.path)
+        reloader = SnapshotReloader(self.path)
+        self.assertTrue(reloader.reload())
+        first = scoring.interest_snapshot
+        self.assertFalse(reloader.reload())
+        scoring.set_interests(self.store, 2, ['cars'])
+        time.sleep(0.01)
+        export(self.store, self.path)
+        self.assertTrue(reloader.reload())
+        self.assertIsNot(first, scoring.interest_snapshot)
+        self.assertEqual(['cars'], scoring.interest_snapshot.get(2))
+        self.assertIsNone(first.get(2))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,8 +2,9 @@
 
 import unittest
 from unittest.mock import Mock, patch
-from store import RedisStore
-from redis.exceptions import TimeoutError, ConnectionError
+from store import RedisStore, HashRing, ReplicaSelector
+from redis.exceptions import TimeoutError, ConnectionError, ResponseError
+from tests.helpers import cases, FakeRedis
 import logging
 
 
@@ -51,6 +52,209 @@ class TestStoreConnection(unittest.TestCase):
         self.assertEqual(5, self.storage.client.smembers.call_count)
 
 
+class TestHashRing(unittest.TestCase):
+
+    def setUp(self):
+        self.keys = ['i#%d' % i for i in range(2000)]
+
+    def test_hash_ring_distribution(self):
+        ring = HashRing(['a', 'b', 'c', 'd'])
+        counts = {}
+        for key in self.keys:
+            node = ring.get_node(key)
+            counts[node] = counts.get(node, 0) + 1
+        self.assertEqual(['a', 'b', 'c', 'd'], sorted(counts))
+        for count in counts.values():
+            self.assertGreater(count, len(self.keys) / 4 * 0.6)
+
+    def test_hash_ring_add_node_moves_few_keys(self):
+        ring = HashRing(['a', 'b', 'c', 'd'])
+        before = {key: ring.get_node(key) for key in self.keys}
+        ring.add_node('e')
+        moved = [key for key in self.keys if ring.get_node(key) != before[key]]
+        self.assertTrue(all(ring.get_node(key) == 'e' for key in moved))
+        self.assertLess(len(moved), len(self.keys) / 5 * 1.5)
+
+    def test_hash_ring_remove_node(self):
+        ring = HashRing(['a', 'b', 'c'])
+        before = {key: ring.get_node(key) for key in self.keys}
+        ring.remove_node('c')
+        for key in self.keys:
+            if before[key] != 'c':
+                self.assertEqual(before[key], ring.get_node(key))
+            else:
+                self.assertIn(ring.get_node(key), ('a', 'b'))
+
+    @cases([
+        ('i#{42}#20170720', '42'),
+        (b'i#{42}#20170720', '42'),
+        ('i#{}#{42}', 'i#{}#{42}'),
+        ('i#{42', 'i#{42'),
+        ('i#42', 'i#42'),
+    ])
+    def test_hash_ring_hash_tag(self, key, tag):
+        self.assertEqual(tag, HashRing.hash_tag(key))
+        ring = HashRing(['a', 'b', 'c'])
+        self.assertEqual(ring.get_node(tag), ring.get_node(key))
+
+
+class TestShardedStore(unittest.TestCase):
+
+    nodes = ['localhost:7001', 'localhost:7002', {'host': 'localhost', 'port': 7003}]
+
+    @patch('redis.Redis', FakeRedis)
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        self.storage = RedisStore(nodes=self.nodes, socket_connect_timeout=1)
+        self.storage.connect()
+
+    def tearDown(self):
+        self.storage.close()
+        logging.disable(logging.NOTSET)
+
+    def test_sharded_store_node_params(self):
+        self.assertEqual(3, len(self.storage.clients))
+        for client in self.storage.clients.values():
+            self.assertEqual(1, client.params['socket_connect_timeout'])
+
+    def test_sharded_store_spreads_keys(self):
+        for i in range(300):
+            self.storage.set('i#%d' % i, 'foo')
+            self.storage.cache_set('score#%d' % i, 1.5, 60)
+        for client in self.storage.clients.values():
+            self.assertGreater(len(client.data), 100)
+        for i in range(300):
+            self.assertEqual({b'foo'}, self.storage.get('i#%d' % i))
+            self.assertEqual(b'1.5', self.storage.cache_get('score#%d' % i))
+
+    def test_sharded_store_get_set_many(self):
+        mapping = {'i#%d' % i: ['foo', str(i)] for i in range(100)}
+        self.assertEqual(100, self.storage.set_many(mapping))
+        result = self.storage.get_many(list(mapping) + ['i#missing'])
+        self.assertEqual(set(), result.pop('i#missing'))
+        self.assertEqual({key: {v.encode('utf-8') for v in values} for key, values in mapping.items()}, result)
+
+    @patch('store.REDIS_RETRY_DELAY', 0)
+    @patch('store.REDIS_RETRY_MAX_ATTEMPTS', 2)
+    def test_sharded_store_shard_failure(self):
+        keys = ['i#%d' % i for i in range(50)]
+        broken = self.storage.ring.get_node(keys[0])
+        self.storage.clients[broken].smembers = Mock(side_effect=ConnectionError)
+        with self.assertRaises(ConnectionError):
+            self.storage.get_many(keys)
+        healthy = [key for key in keys if self.storage.ring.get_node(key) != broken]
+        self.assertEqual(set(), self.storage.get(healthy[0]))
+
+    @patch('store.REDIS_RETRY_DELAY', 0)
+    @patch('store.REDIS_RETRY_MAX_ATTEMPTS', 3)
+    def test_sharded_store_partial_read(self):
+        mapping = {'i#%d' % i: ['foo'] for i in range(50)}
+        self.storage.set_many(mapping)
+        broken = self.storage.ring.get_node('i#0')
+        self.storage.clients[broken].smembers = Mock(side_effect=ConnectionError)
+        result, errors = self.storage.get_many_partial(list(mapping))
+        lost = [key for key in mapping if self.storage.ring.get_node(key) == broken]
+        self.assertEqual(dict.fromkeys(lost, 'unavailable'), errors)
+        self.assertEqual({key: {b'foo'} for key in mapping if key not in lost}, result)
+        # a single attempt: the pipeline of the broken shard fails on its first command once
+        self.assertEqual(1, self.storage.clients[broken].smembers.call_count)
+
+    @patch('redis.Redis', FakeRedis)
+    @patch('store.REDIS_PARTIAL_CHUNK_SIZE', 10)
+    def test_partial_read_failing_key_loses_its_chunk(self):
+        storage = RedisStore()
+        storage.connect()
+        mapping = {'i#%d' % i: ['foo'] for i in range(100)}
+        storage.set_many(mapping)
+        smembers = storage.client.smembers
+
+        def failing(key):
+            if key == 'i#0':
+                raise ResponseError('WRONGTYPE Operation against a key holding the wrong kind of value')
+            return smembers(key)
+
+        storage.client.smembers = failing
+        result, errors = storage.get_many_partial(list(mapping))
+        self.assertEqual(dict.fromkeys(list(mapping)[:10], 'error'), errors)
+        self.assertEqual({key: {b'foo'} for key in list(mapping)[10:]}, result)
+
+    @patch('redis.Redis', FakeRedis)
+    def test_sharded_store_rebalance(self):
+        mapping = {'i#%d' % i: ['foo'] for i in range(300)}
+        self.storage.set_many(mapping)
+        grown = RedisStore(nodes=self.nodes + ['localhost:7004'])
+        grown.connect()
+        grown.clients.update({name: client for name, client in self.storage.clients.items()})
+        moved = grown.rebalance()
+        self.assertGreater(moved, 0)
+        self.assertLess(moved, 150)
+        for key in mapping:
+            self.assertEqual({b'foo'}, grown.get(key))
+
+
+class TestReplicaStore(unittest.TestCase):
+
+    @patch('redis.Redis', FakeRedis)
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        self.storage = RedisStore(replicas=['localhost:7001', 'localhost:7002'])
+        self.storage.connect()
+        self.replicas = self.storage.selectors[None].clients
+        for client in [self.storage.client] + self.replicas:
+            client.sadd('i#1', 'foo')
+            client.set('score', '1.5')
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+    def test_replica_store_reads_from_replicas(self):
+        for _ in range(4):
+            self.storage.get('i#1')
+            self.storage.cache_get('score')
+        self.assertEqual(2, self.storage.client.calls)
+        self.assertEqual([6, 6], [client.calls for client in self.replicas])
+
+    def test_replica_store_primary_reads(self):
+        self.storage.get('i#1', primary=True)
+        self.storage.get_many_partial(['i#1'], primary=True)
+        self.assertEqual(4, self.storage.client.calls)
+        self.assertEqual([2, 2], [client.calls for client in self.replicas])
+
+    def test_replica_store_writes_to_primary(self):
+        self.storage.set('i#2', 'bar')
+        self.storage.cache_set('foo', 'bar', 60)
+        self.assertEqual({b'bar'}, self.storage.client.smembers('i#2'))
+        self.assertEqual(b'bar', self.storage.client.get('foo'))
+        self.assertEqual([2, 2], [client.calls for client in self.replicas])
+
+    def test_replica_store_fallback_to_primary(self):
+        for client in self.replicas:
+            client.smembers = Mock(side_effect=ConnectionError)
+        self.assertEqual({b'foo'}, self.storage.get('i#1'))
+        self.assertEqual({b'foo'}, self.storage.get('i#1'))
+        self.assertIsNone(self.storage.selectors[None].choose())
+        self.assertEqual([1, 1], [client.smembers.call_count for client in self.replicas])
+
+    @patch('redis.Redis', FakeRedis)
+    def test_sharded_store_node_replicas(self):
+        storage = RedisStore(nodes=['localhost:7001+localhost:7101', 'localhost:7002'])
+        storage.connect()
+        self.assertEqual(['localhost:7001/0'], list(name for name in storage.selectors if name is not None))
+        self.assertEqual(7101, storage.selectors['localhost:7001/0'].clients[0].params['port'])
+
+    def test_sharded_store_rejects_store_wide_replicas(self):
+        with self.assertRaises(ValueError):
+            RedisStore(nodes=['localhost:7001', 'localhost:7002'], replicas=['localhost:7101'])
+
+    def test_replica_selector_least_latency(self):
+        selector = ReplicaSelector(['slow', 'fast'], strategy=ReplicaSelector.LEAST_LATENCY)
+        selector.observe('slow', 0.2)
+        selector.observe('fast', 0.01)
+        self.assertEqual('fast', selector.choose())
+        selector.mark_down('fast')
+        self.assertEqual('slow', selector.choose())
+
+
 if __name__ == '__main__':
     unittest.main()
 